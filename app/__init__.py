@@ -1,31 +1,120 @@
+import os
+
 from flask import Flask
 from config import Config
+from patching import is_patched
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_socketio import SocketIO
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app.cache import Cache
+from app.write_behind import MessageWriter, ChatMessageWriter
+from app.call_rooms import CallRooms
+from app.images import AvatarProcessor
+from app.assets import Assets, compile_templates
+from app.identity import IdentityCache
+from app.passwords import PasswordHasher
+from app.presence import Presence
+from app.chat_rooms import ChatRooms
+from app.notifications import Notifier
+from app.timelines import Timelines
+from app.counters import Counters
+from app.metrics import Metrics
+from app.schema import include_object
+from app.replicas import Replicas, RoutingSession
+from app.wire import Wire
+from app.retention import Retention
+
+# Absolute, so release scripts and the flask CLI find the migrations from any working directory
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate(directory=MIGRATIONS_DIR, include_object=include_object)
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 login_manager.login_view = 'main.login'
 login_manager.login_message_category = 'info'
 socketio = SocketIO() # Create SocketIO instance
+cache = Cache()
+message_writer = MessageWriter()
+chat_message_writer = ChatMessageWriter()
+call_rooms = CallRooms()
+avatar_processor = AvatarProcessor()
+assets = Assets()
+identity_cache = IdentityCache()
+password_hasher = PasswordHasher()
+presence = Presence()
+chat_rooms = ChatRooms()
+notifier = Notifier()
+timelines = Timelines()
+counters = Counters()
+metrics = Metrics()
+replicas = Replicas()
+wire = Wire()
+retention = Retention()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if not is_patched(app.config['ASYNC_MODE']):
+        # Not started through run.py: green threads without a patched
+        # standard library would block on the first queue or socket
+        app.config['ASYNC_MODE'] = 'threading'
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=1)
 
     db.init_app(app)
+    replicas.init_app(app)
     migrate.init_app(app, db)
+    metrics.init_app(app)
 
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     login_manager.init_app(app)
-    socketio.init_app(app) # Initialize SocketIO with the app
+    # Initialize SocketIO with the app; the message queue (if any) lets
+    # several worker processes share broadcasts and rooms
+    asgi = app.config['ASYNC_MODE'] == 'asgi'
+    socketio.init_app(app, async_mode='threading' if asgi else app.config['ASYNC_MODE'],
+                      message_queue=None if asgi else app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+                      compression_threshold=app.config.get('SOCKETIO_COMPRESSION_THRESHOLD', 1024))
+    if asgi:
+        # The same handlers on python-socketio's AsyncServer (see app/asgi.py)
+        from app.asgi import ThreadedAsyncServer
+        socketio.server = ThreadedAsyncServer(app, socketio.server)
+    wire.init_app(app)
+    cache.init_app(app)
+    message_writer.init_app(app)
+    chat_message_writer.init_app(app)
+    call_rooms.init_app(app)
+    presence.init_app(app)
+    chat_rooms.init_app(app)
+    notifier.init_app(app)
+    timelines.init_app(app)
+    counters.init_app(app)
+    retention.init_app(app)
+    avatar_processor.init_app(app)
+    assets.init_app(app)
+    identity_cache.init_app(app)
+
+    @app.context_processor
+    def inject_socketio_options():
+        # Options passed to io() in the templates
+        options = {'transports': ['websocket']} if app.config.get('SOCKETIO_WEBSOCKET_ONLY') else {}
+        return {'socketio_options': options,
+                'socketio_wire_format': wire.format,
+                'presence_heartbeat_ms': app.config.get('PRESENCE_HEARTBEAT_INTERVAL', 25) * 1000}
 
     from app.main.routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    # After the blueprint import, which registers the Socket.IO handlers
+    metrics.instrument_socketio(socketio)
+
+    if app.config.get('TEMPLATE_PRELOAD'):
+        compile_templates(app)
+
+    from app.commands import register_commands
+    register_commands(app)
 
     return app
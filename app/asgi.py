@@ -0,0 +1,154 @@
+"""
+ASYNC_MODE 'asgi': python-socketio's AsyncServer on an asyncio event loop,
+served by uvicorn, with no monkey-patching.
+
+Connections, heartbeats and room fan-out live on the event loop, so an
+idle client costs a coroutine instead of a thread or greenlet. The app's
+own code stays synchronous:
+
+  * Socket.IO handlers run in a thread pool of ASGI_THREADS threads.
+  * Flask routes run behind a2wsgi in a second pool of the same size.
+  * ThreadedAsyncServer gives Flask-SocketIO the blocking Server API it
+    expects (emit, join_room, start_background_task, ...). It runs each
+    call on the loop and waits for it.
+
+Keep ASGI_THREADS near DB_POOL_SIZE + DB_MAX_OVERFLOW. More threads only
+queue for connections.
+
+Only redis:// message queues are supported. They go through
+AsyncRedisManager on Flask-SocketIO's channel, so asgi and WSGI workers
+can share one queue.
+
+create_app() installs the server when the process was started for 'asgi'
+(see patching.py), and run.py then exposes asgi_app(app) as `app`. Serve
+it with `uvicorn run:app`, or with gunicorn through
+uvicorn_worker.UvicornWorker.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+
+class ThreadedAsyncServer:
+    """The blocking socketio.Server API, backed by a socketio.AsyncServer."""
+
+    def __init__(self, app, replaced=None):
+        self.app = app
+        url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+        manager = None
+        if url:
+            if not url.startswith(('redis://', 'rediss://')):
+                raise ValueError("ASYNC_MODE='asgi' needs a redis:// SOCKETIO_MESSAGE_QUEUE")
+            manager = socketio.AsyncRedisManager(url, channel='flask-socketio')
+        self.server = socketio.AsyncServer(async_mode='asgi', client_manager=manager,
+                                           compression_threshold=app.config.get('SOCKETIO_COMPRESSION_THRESHOLD',
+                                                                                1024))
+        self.eio = self.server.eio
+        self.async_mode = 'asgi'
+        self.handlers = {}   # namespace -> event -> the synchronous handler
+        self._pool = ThreadPoolExecutor(max_workers=app.config.get('ASGI_THREADS', 16),
+                                        thread_name_prefix='socketio')
+        self._loop = None
+        # Handlers Flask-SocketIO registered on the server it built itself
+        for namespace, handlers in (replaced.handlers if replaced else {}).items():
+            for event, handler in handlers.items():
+                self.on(event, handler, namespace=namespace)
+
+    def start(self):
+        """ASGI startup: remember the loop the blocking calls are sent to."""
+        self._loop = asyncio.get_running_loop()
+
+    def stop(self):
+        self._pool.shutdown(wait=False)
+
+    def on(self, event, handler, namespace=None):
+        namespace = namespace or '/'
+        self.handlers.setdefault(namespace, {})[event] = handler
+        self.server.on(event, self._dispatcher(event, namespace), namespace=namespace)
+
+    def register_namespace(self, namespace_handler):
+        raise NotImplementedError("Class-based namespaces aren't supported with ASYNC_MODE='asgi'")
+
+    def _dispatcher(self, event, namespace):
+        async def dispatch(*args):
+            if event == 'connect':
+                self._prepare_environ(args[-2])
+            # Looked up per call so wrappers added after registration (metrics) apply
+            handler = self.handlers[namespace][event]
+            return await self._loop.run_in_executor(self._pool, handler, *args)
+        return dispatch
+
+    def _prepare_environ(self, environ):
+        # What Flask-SocketIO's WSGI middleware would have added, plus the
+        # real client address (engineio's ASGI environ says 127.0.0.1)
+        environ['flask.app'] = self.app
+        client = environ['asgi.scope'].get('client')
+        if client:
+            environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = client[0], str(client[1])
+
+    def _wait(self, coro):
+        # Called from pool and background threads, never from the loop itself
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError("The ASGI server isn't running")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _in_pool(self, callback):
+        if callback is None:
+            return None
+
+        async def run(*args):
+            return await self._loop.run_in_executor(self._pool, callback, *args)
+        return run
+
+    def emit(self, event, *args, callback=None, **kwargs):
+        return self._wait(self.server.emit(event, *args, callback=self._in_pool(callback), **kwargs))
+
+    def call(self, event, *args, **kwargs):
+        return self._wait(self.server.call(event, *args, **kwargs))
+
+    def enter_room(self, sid, room, namespace=None):
+        return self._wait(self.server.enter_room(sid, room, namespace=namespace))
+
+    def leave_room(self, sid, room, namespace=None):
+        return self._wait(self.server.leave_room(sid, room, namespace=namespace))
+
+    def close_room(self, room, namespace=None):
+        return self._wait(self.server.close_room(room, namespace=namespace))
+
+    def rooms(self, sid, namespace=None):
+        async def rooms():
+            return self.server.rooms(sid, namespace=namespace)
+        return self._wait(rooms())
+
+    def get_environ(self, sid, namespace=None):
+        return self.server.get_environ(sid, namespace=namespace)
+
+    def disconnect(self, sid, namespace=None, ignore_queue=False):
+        # Not waited for: the disconnect handler it triggers needs a pool
+        # thread, and the caller may be holding the last one
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                self.server.disconnect(sid, namespace=namespace, ignore_queue=ignore_queue), self._loop)
+
+    def start_background_task(self, target, *args, **kwargs):
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def sleep(self, seconds=0):
+        time.sleep(seconds)
+
+
+def asgi_app(app):
+    """The ASGI application for app: Socket.IO on the loop, everything else through a2wsgi."""
+    from a2wsgi import WSGIMiddleware
+
+    server = app.extensions['socketio'].server
+    if not isinstance(server, ThreadedAsyncServer):
+        raise RuntimeError("create_app() didn't run with ASYNC_MODE='asgi' in a process started for it")
+    wsgi = WSGIMiddleware(app, workers=app.config.get('ASGI_THREADS', 16))
+    return socketio.ASGIApp(server.server, other_asgi_app=wsgi, on_startup=server.start, on_shutdown=server.stop)
@@ -0,0 +1,161 @@
+"""
+Static asset fingerprinting and caching.
+
+Every file under static/ gets a content hash, and url_for('static', ...)
+emits the hashed name (css/style.css -> css/style.3f2a9c0d.css). Hashed
+URLs are served with a one-year immutable Cache-Control, since a new
+version always has a new URL. The mapping is kept in static/manifest.json,
+written by `flask assets-build` together with gzip/brotli copies of text
+assets. If the manifest is missing it is computed in memory at startup.
+
+With Config.STATIC_SENDFILE the bytes are handed to the front-end server
+instead: 'x-accel' for nginx (X-Accel-Redirect) or 'x-sendfile' for
+Apache/lighttpd.
+
+Templates are handled here too: compile_templates() compiles all of them
+at startup, with the compiled code cached on disk, so no request pays for
+parsing one.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, send_from_directory, abort
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import safe_join
+
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+IMMUTABLE_MAX_AGE = 31536000
+
+# Generated profile picture variants are already content-hashed (app/images.py)
+_HASHED_AVATAR = re.compile(r'^profile_pics/[0-9a-f]{16}_\d+\.(webp|jpg)$')
+
+
+def _iter_static_files(static_folder):
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if name == MANIFEST_NAME or name.endswith(('.gz', '.br', '.tmp')):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def hashed_name(filename, digest):
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{digest[:8]}{ext}"
+
+
+def compute_manifest(static_folder):
+    """Map every static file to its content-hashed name."""
+    manifest = {}
+    for filename, path in _iter_static_files(static_folder):
+        if _HASHED_AVATAR.match(filename):
+            continue
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        manifest[filename] = hashed_name(filename, digest)
+    return manifest
+
+
+def build_static_assets(static_folder):
+    """Write manifest.json and .gz/.br siblings for compressible files."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = compute_manifest(static_folder)
+    for filename in manifest:
+        if os.path.splitext(filename)[1] not in COMPRESSIBLE:
+            continue
+        path = os.path.join(static_folder, filename)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(data))
+
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def compile_templates(app):
+    """Compile every template into the app's Jinja cache. Returns how many."""
+    names = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+class Assets:
+    def __init__(self):
+        self.manifest = {}
+        self.originals = {}
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+        if cache_dir:
+            cache_dir = os.path.join(app.instance_path, cache_dir)
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        if app.config.get('STATIC_SENDFILE') == 'x-sendfile':
+            app.config['USE_X_SENDFILE'] = True
+        if not app.config.get('STATIC_FINGERPRINT', True):
+            return
+
+        manifest_path = os.path.join(app.static_folder, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = compute_manifest(app.static_folder)
+        self.originals = {hashed: original for original, hashed in self.manifest.items()}
+
+        app.url_defaults(self._hash_static_url)
+        app.view_functions['static'] = self.send_static
+
+    def _hash_static_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+
+    def send_static(self, filename):
+        original = self.originals.get(filename)
+        immutable = original is not None or bool(_HASHED_AVATAR.match(filename))
+        filename = original or filename
+        if safe_join(current_app.static_folder, filename) is None:
+            abort(404)
+        static_folder = current_app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        if current_app.config.get('STATIC_SENDFILE') == 'x-accel':
+            response = current_app.response_class(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = current_app.config['STATIC_ACCEL_PREFIX'] + filename
+        else:
+            # Prefer a precompressed copy the client accepts
+            encoding = None
+            for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if request.accept_encodings[candidate] and \
+                        os.path.isfile(os.path.join(static_folder, filename + suffix)):
+                    encoding = candidate
+                    filename += suffix
+                    break
+            response = send_from_directory(static_folder, filename, mimetype=mimetype,
+                                           max_age=current_app.get_send_file_max_age(filename))
+            if encoding:
+                response.content_encoding = encoding
+            response.vary.add('Accept-Encoding')
+
+        if immutable:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
@@ -0,0 +1,239 @@
+"""
+Read-through cache for rendered page fragments and query results.
+
+Backends are available, selected with Config.CACHE_TYPE:
+  * 'memory' - in-process LRU with per-key TTL (default)
+  * 'redis'  - any Redis-compatible server at Config.CACHE_REDIS_URL
+  * 'null'   - disables caching entirely
+
+Every cached entry can be tagged (e.g. 'post:12', 'user:3'). Write paths
+invalidate tags rather than guessing keys, so only the fragments that
+actually contain the changed post or user are dropped.
+
+Invalidation only reaches the cache it runs against. With 'memory' each
+worker would keep serving a deleted or edited post from its own dict
+until the entry expires, so several workers (SOCKETIO_MESSAGE_QUEUE set)
+need 'redis' or 'null'; init_app refuses 'memory' there.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class BaseCache:
+    def __init__(self, default_timeout=300):
+        self.default_timeout = default_timeout
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None, tags=()):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def invalidate_tags(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+    def get_or_set(self, key, producer, timeout=None, tags=()):
+        """Return the cached value for key, calling producer() to fill it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = producer()
+            self.set(key, value, timeout, tags)
+        return value
+
+
+class NullCache(BaseCache):
+    """Cache that never stores anything."""
+
+
+class MemoryCache(BaseCache):
+    """Thread-safe LRU cache with per-key expiry, local to one process."""
+
+    def __init__(self, default_timeout=300, max_entries=1024):
+        super().__init__(default_timeout)
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._key_tags = {}          # key -> set of tags
+        self._tag_keys = {}          # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None, tags=()):
+        timeout = self.default_timeout if timeout is None else timeout
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + timeout, value)
+            if tags:
+                self._key_tags[key] = set(tags)
+                for tag in tags:
+                    self._tag_keys.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_entries:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tag_keys.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._key_tags.clear()
+            self._tag_keys.clear()
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        self._data.pop(key, None)
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_keys[tag]
+
+
+class RedisCache(BaseCache):
+    """Cache stored in a Redis-compatible server, shared by every worker."""
+
+    def __init__(self, url, default_timeout=300, key_prefix='flasksocial:'):
+        super().__init__(default_timeout)
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_TYPE='redis' requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def _key(self, key):
+        return self.key_prefix + key
+
+    def _tag(self, tag):
+        return self.key_prefix + 'tag:' + tag
+
+    def get(self, key):
+        raw = self._client.get(self._key(key))
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, timeout=None, tags=()):
+        timeout = self.default_timeout if timeout is None else timeout
+        pipe = self._client.pipeline()
+        pipe.set(self._key(key), pickle.dumps(value), ex=timeout)
+        for tag in tags:
+            pipe.sadd(self._tag(tag), self._key(key))
+            # A tag set never needs to outlive the entries it points to
+            pipe.expire(self._tag(tag), timeout)
+        pipe.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*[self._key(k) for k in keys])
+
+    def invalidate_tags(self, *tags):
+        for tag in tags:
+            tag_key = self._tag(tag)
+            keys = self._client.smembers(tag_key)
+            pipe = self._client.pipeline()
+            if keys:
+                pipe.delete(*keys)
+            pipe.delete(tag_key)
+            pipe.execute()
+
+    def clear(self):
+        for key in self._client.scan_iter(self.key_prefix + '*'):
+            self._client.delete(key)
+
+
+class Cache:
+    """Flask extension wrapper that picks a backend from the app config."""
+
+    def __init__(self):
+        self.backend = NullCache()
+
+    def init_app(self, app):
+        cache_type = app.config.get('CACHE_TYPE', 'memory')
+        timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+        if cache_type == 'memory' and app.config.get('SOCKETIO_MESSAGE_QUEUE'):
+            raise ValueError("CACHE_TYPE='memory' can't be invalidated across workers; "
+                             "use 'redis' (or 'null') with SOCKETIO_MESSAGE_QUEUE")
+        if cache_type == 'memory':
+            self.backend = MemoryCache(timeout, app.config.get('CACHE_MAX_ENTRIES', 1024))
+        elif cache_type == 'redis':
+            self.backend = RedisCache(app.config['CACHE_REDIS_URL'], timeout)
+        elif cache_type == 'null':
+            self.backend = NullCache(timeout)
+        else:
+            raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+        app.extensions['cache'] = self
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+# -------------------- KEYS AND INVALIDATION --------------------
+
+def feed_key(cursor):
+    return f"feed:{cursor or ''}"
+
+def api_feed_key(cursor):
+    return f"api_feed:{cursor or ''}"
+
+def post_key(post_id):
+    return f"post:{post_id}"
+
+def post_comments_key(post_id):
+    return f"post_comments:{post_id}"
+
+def user_posts_key(username, cursor):
+    return f"user_posts:{username}:{cursor or ''}"
+
+def user_post_count_key(username):
+    return f"user_post_count:{username}"
+
+def page_tags(posts):
+    """Tags for a fragment showing these posts: each post and each author."""
+    tags = {f"post:{p.id}" for p in posts}
+    tags.update(f"user:{p.user_id}" for p in posts)
+    return tags
+
+
+def invalidate_new_post(cache, post):
+    # Keyset pages after the first only hold posts older than their cursor,
+    # so a new post can only land on the first page of each listing.
+    cache.delete(feed_key(None), api_feed_key(None),
+                 user_posts_key(post.author.username, None),
+                 user_post_count_key(post.author.username))
+
+def invalidate_post(cache, post):
+    cache.invalidate_tags(f"post:{post.id}")
+
+def invalidate_deleted_post(cache, post):
+    cache.invalidate_tags(f"post:{post.id}")
+    cache.delete(user_post_count_key(post.author.username))
+
+def invalidate_user(cache, user):
+    cache.invalidate_tags(f"user:{user.id}")
@@ -0,0 +1,328 @@
+"""
+Video call sessions, shared across Socket.IO worker processes.
+
+Selected with Config.CALL_ROOM_STORE:
+  * 'memory' - dicts in this process; only correct with a single worker
+  * 'redis'  - lists/sets/hashes in a Redis-compatible server, so every
+               worker sees the same calls. Join, leave and relay are atomic.
+
+A call is a room, 'call:<low user id>:<high user id>', holding an ordered
+list of sids (first joiner first, at most two). Each sid keeps the set of
+calls it is in, so a disconnect finds its calls without walking every
+room. A call is 'ringing' until the second peer joins, then 'connected';
+ending it (hang up, disconnect or timeout) drops all of its state.
+Calls still ringing after CALL_RING_TIMEOUT seconds, or older than
+CALL_MAX_AGE seconds, are ended by a background sweep.
+
+Every signalling frame forwarded to the other peer is counted per call
+(a batch of ICE candidates counts each candidate). The running total is
+the flasksocial_call_signals_relayed_total counter on /metrics, and each
+call's count is observed in flasksocial_call_signals when it ends.
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+
+RINGING = 'ringing'
+CONNECTED = 'connected'
+ENDED = 'ended'
+
+
+def call_room(user_id, other_id):
+    """Canonical room for a call between two users, derived from their ids."""
+    low, high = sorted((user_id, other_id))
+    return f"call:{low}:{high}"
+
+
+class MemoryCallRoomStore:
+    def __init__(self):
+        self._rooms = {}       # room -> [sid, ...]
+        self._meta = {}        # room -> {'created': t, 'connected': t or None, 'signals': n}
+        self._sid_rooms = {}   # sid -> {room, ...}
+        self._lock = threading.Lock()
+
+    def join(self, room, sid, now):
+        """Add sid to room and return the room's members after the join."""
+        with self._lock:
+            members = self._rooms.setdefault(room, [])
+            meta = self._meta.setdefault(room, {'created': now, 'connected': None, 'signals': 0})
+            if sid not in members:
+                members.append(sid)
+                self._sid_rooms.setdefault(sid, set()).add(room)
+            if len(members) >= 2 and meta['connected'] is None:
+                meta['connected'] = now
+            return list(members)
+
+    def leave(self, room, sid):
+        """Remove sid from room and return the members left behind."""
+        with self._lock:
+            members = self._rooms.get(room, [])
+            if sid in members:
+                members.remove(sid)
+            self._discard_sid_room(sid, room)
+            if not members:
+                self._rooms.pop(room, None)
+                self._meta.pop(room, None)
+            return list(members)
+
+    def members(self, room):
+        with self._lock:
+            return list(self._rooms.get(room, ()))
+
+    def relay(self, room, sid, frames=1):
+        """Count frames relayed by sid, if it has a peer to relay to, and return the room's members."""
+        with self._lock:
+            members = self._rooms.get(room, ())
+            if len(members) == 2 and sid in members:
+                self._meta[room]['signals'] += frames
+            return list(members)
+
+    def info(self, room):
+        with self._lock:
+            meta = self._meta.get(room)
+            return dict(meta) if meta is not None else None
+
+    def delete(self, room):
+        """Drop the whole room, returning who was in it."""
+        with self._lock:
+            members = self._rooms.pop(room, [])
+            self._meta.pop(room, None)
+            for sid in members:
+                self._discard_sid_room(sid, room)
+            return members
+
+    def rooms_for(self, sid):
+        with self._lock:
+            return set(self._sid_rooms.get(sid, ()))
+
+    def stale(self, now, ring_timeout, max_age):
+        """Rooms still ringing after ring_timeout, or older than max_age."""
+        with self._lock:
+            return [room for room, meta in self._meta.items()
+                    if (meta['connected'] is None and meta['created'] < now - ring_timeout)
+                    or meta['created'] < now - max_age]
+
+    def _discard_sid_room(self, sid, room):
+        rooms = self._sid_rooms.get(sid)
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self._sid_rooms[sid]
+
+
+class RedisCallRoomStore:
+    # KEYS: room list, sid set, room meta hash, active zset. ARGV: sid, room, now
+    # Atomic "append if absent, then read back" so two workers joining the
+    # same room at once can never both see themselves as the only member.
+    JOIN_SCRIPT = """
+    local present = false
+    for _, member in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+        if member == ARGV[1] then present = true end
+    end
+    if not present then
+        redis.call('RPUSH', KEYS[1], ARGV[1])
+        redis.call('SADD', KEYS[2], ARGV[2])
+    end
+    if redis.call('HSETNX', KEYS[3], 'created', ARGV[3]) == 1 then
+        redis.call('ZADD', KEYS[4], ARGV[3], ARGV[2])
+    end
+    if redis.call('LLEN', KEYS[1]) >= 2 then
+        redis.call('HSETNX', KEYS[3], 'connected', ARGV[3])
+    end
+    return redis.call('LRANGE', KEYS[1], 0, -1)
+    """
+
+    # KEYS: room list, sid set, room meta hash, active zset. ARGV: sid, room
+    LEAVE_SCRIPT = """
+    redis.call('LREM', KEYS[1], 0, ARGV[1])
+    redis.call('SREM', KEYS[2], ARGV[2])
+    local members = redis.call('LRANGE', KEYS[1], 0, -1)
+    if #members == 0 then
+        redis.call('DEL', KEYS[3])
+        redis.call('ZREM', KEYS[4], ARGV[2])
+    end
+    return members
+    """
+
+    # KEYS: room list, room meta hash. ARGV: sid, frames
+    RELAY_SCRIPT = """
+    local members = redis.call('LRANGE', KEYS[1], 0, -1)
+    if #members == 2 and (members[1] == ARGV[1] or members[2] == ARGV[1]) then
+        redis.call('HINCRBY', KEYS[2], 'signals', ARGV[2])
+    end
+    return members
+    """
+
+    # KEYS: room list, room meta hash, active zset. ARGV: sid key prefix, room
+    DELETE_SCRIPT = """
+    local members = redis.call('LRANGE', KEYS[1], 0, -1)
+    for _, member in ipairs(members) do
+        redis.call('SREM', ARGV[1] .. member, ARGV[2])
+    end
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('ZREM', KEYS[3], ARGV[2])
+    return members
+    """
+
+    def __init__(self, url, key_prefix='flasksocial:call:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CALL_ROOM_STORE='redis' requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self._active_key = key_prefix + 'active'
+        self._join = self._client.register_script(self.JOIN_SCRIPT)
+        self._leave = self._client.register_script(self.LEAVE_SCRIPT)
+        self._relay = self._client.register_script(self.RELAY_SCRIPT)
+        self._delete = self._client.register_script(self.DELETE_SCRIPT)
+        # Load up front so a server without scripting fails at startup, not mid-call
+        for script in (self._join, self._leave, self._relay, self._delete):
+            self._client.script_load(script.script)
+
+    def _room_key(self, room):
+        return f"{self.key_prefix}room:{room}"
+
+    def _meta_key(self, room):
+        return f"{self.key_prefix}meta:{room}"
+
+    def _sid_key(self, sid):
+        return f"{self.key_prefix}sid:{sid}"
+
+    def join(self, room, sid, now):
+        return self._join(keys=[self._room_key(room), self._sid_key(sid), self._meta_key(room), self._active_key],
+                          args=[sid, room, now])
+
+    def leave(self, room, sid):
+        return self._leave(keys=[self._room_key(room), self._sid_key(sid), self._meta_key(room), self._active_key],
+                           args=[sid, room])
+
+    def members(self, room):
+        return self._client.lrange(self._room_key(room), 0, -1)
+
+    def relay(self, room, sid, frames=1):
+        return self._relay(keys=[self._room_key(room), self._meta_key(room)], args=[sid, frames])
+
+    def info(self, room):
+        meta = self._client.hgetall(self._meta_key(room))
+        if not meta:
+            return None
+        return {'created': float(meta['created']),
+                'connected': float(meta['connected']) if 'connected' in meta else None,
+                'signals': int(meta.get('signals', 0))}
+
+    def delete(self, room):
+        return self._delete(keys=[self._room_key(room), self._meta_key(room), self._active_key],
+                            args=[self._sid_key(''), room])
+
+    def rooms_for(self, sid):
+        return self._client.smembers(self._sid_key(sid))
+
+    def stale(self, now, ring_timeout, max_age):
+        rooms = self._client.zrangebyscore(self._active_key, '-inf', now - ring_timeout)
+        if not rooms:
+            return []
+        pipe = self._client.pipeline()
+        for room in rooms:
+            pipe.hmget(self._meta_key(room), 'created', 'connected')
+        stale = []
+        for room, (created, connected) in zip(rooms, pipe.execute()):
+            if created is None or connected is None or float(created) < now - max_age:
+                stale.append(room)
+        return stale
+
+
+def turn_credentials(secret, user_id, ttl, now=None):
+    """
+    Short-lived TURN username/password in the coturn REST API format
+    (use-auth-secret): username '<expiry>:<user id>', password
+    base64(HMAC-SHA1(secret, username)).
+    """
+    username = f"{int((now or time.time()) + ttl)}:{user_id}"
+    digest = hmac.new(secret.encode(), username.encode(), hashlib.sha1).digest()
+    return username, base64.b64encode(digest).decode()
+
+
+class CallRooms:
+    """Flask extension: store selection, ICE config and the timeout sweep."""
+
+    def __init__(self):
+        self.app = None
+        self.store = MemoryCallRoomStore()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        store_type = app.config.get('CALL_ROOM_STORE', 'memory')
+        if store_type == 'memory':
+            self.store = MemoryCallRoomStore()
+        elif store_type == 'redis':
+            self.store = RedisCallRoomStore(app.config['CALL_ROOM_REDIS_URL'])
+        else:
+            raise ValueError(f"Unknown CALL_ROOM_STORE: {store_type}")
+        self.ring_timeout = app.config.get('CALL_RING_TIMEOUT', 60)
+        self.max_age = app.config.get('CALL_MAX_AGE', 6 * 3600)
+        self.sweep_interval = app.config.get('CALL_SWEEP_INTERVAL', 15)
+        self.ice_batch_ms = app.config.get('CALL_ICE_BATCH_MS', 50)
+        self.stun_servers = app.config.get('WEBRTC_STUN_URLS', ())
+        self.turn_urls = app.config.get('WEBRTC_TURN_URLS', ())
+        self.turn_secret = app.config.get('WEBRTC_TURN_SECRET')
+        self.turn_ttl = app.config.get('WEBRTC_TURN_TTL', 3600)
+        app.extensions['call_rooms'] = self
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def join(self, room, sid):
+        self._ensure_started()
+        return self.store.join(room, sid, time.time())
+
+    def state(self, room):
+        info = self.store.info(room)
+        if info is None:
+            return ENDED
+        return CONNECTED if info['connected'] is not None else RINGING
+
+    def ice_servers(self, user_id):
+        """RTCPeerConnection iceServers for this user, with fresh TURN credentials if configured."""
+        servers = []
+        if self.stun_servers:
+            servers.append({'urls': list(self.stun_servers)})
+        if self.turn_urls and self.turn_secret:
+            username, credential = turn_credentials(self.turn_secret, user_id, self.turn_ttl)
+            servers.append({'urls': list(self.turn_urls), 'username': username, 'credential': credential})
+        return servers
+
+    def end(self, room, reason):
+        """End a call, returning the sids that were in it."""
+        info = self.store.info(room)
+        members = self.store.delete(room)
+        if info is not None:
+            from app import metrics
+            metrics.observe('flasksocial_call_signals', info['signals'], (reason,))
+            self.app.logger.info('Call %s ended (%s) after %d relayed signals', room, reason, info['signals'])
+        return members
+
+    def _ensure_started(self):
+        # Started lazily from an event so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            socketio.sleep(self.sweep_interval)
+            try:
+                for room in self.store.stale(time.time(), self.ring_timeout, self.max_age):
+                    if self.end(room, 'timeout'):
+                        socketio.emit('call_ended', {'reason': 'timeout'}, to=room)
+                        socketio.close_room(room)
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('call_room_sweep',))
+                self.app.logger.exception('Call room sweep failed')
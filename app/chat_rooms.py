@@ -0,0 +1,208 @@
+"""
+Public chat rooms with bounded history.
+
+Rooms are the names in Config.CHAT_ROOMS. Each keeps its newest
+CHAT_HISTORY_SIZE messages in a ring buffer, so someone joining gets the
+recent conversation replayed in a single 'chat_history' frame without a
+database query. Messages are written to the chat_message table in the
+background (ChatMessageWriter), and a buffer is seeded from that table
+the first time a room is used.
+
+Selected with Config.CHAT_HISTORY_STORE:
+  * 'memory' - a deque per room in this process; only correct with a single worker
+  * 'redis'  - a capped list per room in a Redis-compatible server
+
+Sending is rate limited per user per room and per room overall
+(token buckets, local to the process) so one noisy client cannot keep
+the worker busy fanning out its messages.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from app.wire import epoch
+
+
+class RateLimited(Exception):
+    pass
+
+
+class Overloaded(RateLimited):
+    """The database write queue is full; the message was not sent."""
+
+
+def chat_room(name):
+    """Socket.IO room that members of a public chat room are in."""
+    return f"chat:{name}"
+
+
+def private_room(user_id, other_id):
+    """Canonical Socket.IO room for a private conversation, derived from both user ids."""
+    low, high = sorted((user_id, other_id))
+    return f"dm:{low}:{high}"
+
+
+def chat_message_to_dict(room, user_id, username, body, timestamp):
+    """History record of a chat message; app/wire.py turns it into what is sent."""
+    return {
+        'room': room,
+        'user_id': user_id,
+        'username': username,
+        'message': body,
+        'timestamp': timestamp.strftime('%I:%M %p'),
+        'ts': epoch(timestamp)
+    }
+
+
+class TokenBuckets:
+    """Token bucket per key: `rate` tokens per second, up to `burst` saved up."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Use one token for key. Returns False if none are left."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            if len(self._buckets) >= self.max_keys and key not in self._buckets:
+                # Full buckets carry no state worth keeping
+                self._buckets = {k: v for k, v in self._buckets.items()
+                                 if v[0] + (now - v[1]) * self.rate < self.burst}
+            self._buckets[key] = (tokens - 1, now)
+            return True
+
+
+class MemoryChatHistory:
+    def __init__(self, size):
+        self.size = size
+        self._rooms = {}   # room -> deque of message dicts, oldest first
+        self._lock = threading.Lock()
+
+    def is_seeded(self, room):
+        return room in self._rooms
+
+    def seed(self, room, messages):
+        with self._lock:
+            if room not in self._rooms:
+                self._rooms[room] = deque(messages, maxlen=self.size)
+
+    def append(self, room, message):
+        with self._lock:
+            self._rooms.setdefault(room, deque(maxlen=self.size)).append(message)
+
+    def recent(self, room):
+        with self._lock:
+            return list(self._rooms.get(room, ()))
+
+
+class RedisChatHistory:
+    def __init__(self, url, size, key_prefix='flasksocial:chat:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CHAT_HISTORY_STORE='redis' requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.size = size
+        self.key_prefix = key_prefix
+        self._seeded = set()   # rooms known to be seeded, to skip the round trip
+
+    def _key(self, room):
+        return f"{self.key_prefix}history:{room}"
+
+    def is_seeded(self, room):
+        if room in self._seeded:
+            return True
+        if self._client.exists(self._key(room) + ':seeded'):
+            self._seeded.add(room)
+            return True
+        return False
+
+    def seed(self, room, messages):
+        # Only the first worker to get here fills the list
+        if self._client.set(self._key(room) + ':seeded', 1, nx=True) and messages:
+            pipe = self._client.pipeline()
+            # The list is newest first; seeded messages are older than anything pushed since
+            pipe.rpush(self._key(room), *[json.dumps(m) for m in reversed(messages)])
+            pipe.ltrim(self._key(room), 0, self.size - 1)
+            pipe.execute()
+        self._seeded.add(room)
+
+    def append(self, room, message):
+        pipe = self._client.pipeline()
+        pipe.lpush(self._key(room), json.dumps(message))
+        pipe.ltrim(self._key(room), 0, self.size - 1)
+        pipe.execute()
+
+    def recent(self, room):
+        return [json.loads(m) for m in reversed(self._client.lrange(self._key(room), 0, -1))]
+
+
+class ChatRooms:
+    """Flask extension: room list, history buffers and rate limits."""
+
+    def __init__(self):
+        self.rooms = ()
+        self.history = MemoryChatHistory(50)
+        self._seed_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.rooms = tuple(app.config.get('CHAT_ROOMS', ('general',)))
+        size = app.config.get('CHAT_HISTORY_SIZE', 50)
+        store_type = app.config.get('CHAT_HISTORY_STORE', 'memory')
+        if store_type == 'memory':
+            self.history = MemoryChatHistory(size)
+        elif store_type == 'redis':
+            self.history = RedisChatHistory(app.config['CHAT_HISTORY_REDIS_URL'], size)
+        else:
+            raise ValueError(f"Unknown CHAT_HISTORY_STORE: {store_type}")
+        self.user_limits = TokenBuckets(app.config.get('CHAT_USER_RATE', 1.0),
+                                        app.config.get('CHAT_USER_BURST', 5))
+        self.room_limits = TokenBuckets(app.config.get('CHAT_ROOM_RATE', 20.0),
+                                        app.config.get('CHAT_ROOM_BURST', 40))
+        app.extensions['chat_rooms'] = self
+
+    def recent(self, room):
+        """The room's newest messages, oldest first."""
+        self._ensure_seeded(room)
+        return self.history.recent(room)
+
+    def post(self, room, user_id, username, body, timestamp):
+        """
+        Record a message in the room's history and queue it for the database.
+        Returns the history record, for wire.chat_message(). Raises
+        RateLimited if the user or the room is sending too fast, or
+        Overloaded if the write queue is full.
+        """
+        if not self.user_limits.take((room, user_id)) or not self.room_limits.take(room):
+            raise RateLimited(f"Too many messages in #{room}, slow down a little.")
+        from app import chat_message_writer
+        # Queued first: a message the database won't get isn't shown either
+        if not chat_message_writer.submit(room, user_id, body, timestamp):
+            raise Overloaded("Server busy, message not sent. Please retry.")
+        self._ensure_seeded(room)
+        message = chat_message_to_dict(room, user_id, username, body, timestamp)
+        self.history.append(room, message)
+        return message
+
+    def _ensure_seeded(self, room):
+        if self.history.is_seeded(room):
+            return
+        from app.models import ChatMessage
+        with self._seed_lock:
+            if self.history.is_seeded(room):
+                return
+            rows = (ChatMessage.query.filter_by(room=room)
+                    .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                    .limit(self.history.size).all())
+            self.history.seed(room, [chat_message_to_dict(room, m.user_id, m.author.username, m.body, m.timestamp)
+                                     for m in reversed(rows)])
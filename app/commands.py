@@ -0,0 +1,83 @@
+import click
+
+
+def register_commands(app):
+    """Attach the app's `flask <command>` maintenance commands."""
+
+    @app.cli.command('schema-check')
+    @click.option('--check-only', is_flag=True, help="Only report; exit 1 if the database isn't at head.")
+    def schema_check_command(check_only):
+        """Apply committed migrations, skipping them when the database is at head."""
+        from app.schema import upgrade_schema, OUT_OF_DATE
+        status, seconds = upgrade_schema(check_only)
+        click.echo(f"{'❌' if status == OUT_OF_DATE else '✅'} Database schema {status} ({seconds:.2f}s)")
+        if status == OUT_OF_DATE:
+            raise SystemExit(1)
+
+    @app.cli.command('backfill-conversations')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def backfill_conversations_command(batch_size):
+        """Link existing private messages to their Conversation rows."""
+        from app.models import backfill_conversations
+        updated, skipped = backfill_conversations(batch_size)
+        click.echo(f"✅ Linked {updated} messages to conversations ({skipped} without a conversation skipped)")
+
+    @app.cli.command('timeline-rebuild')
+    @click.option('--batch-size', default=500, show_default=True)
+    def timeline_rebuild_command(batch_size):
+        """Recount followers and regenerate every user's timeline."""
+        from app import timelines
+        rebuilt = timelines.rebuild(batch_size)
+        click.echo(f"✅ Rebuilt {rebuilt} timelines")
+
+    @app.cli.command('counters-recount')
+    def counters_recount_command():
+        """Recompute every post's like and comment totals from their tables."""
+        from app.counters import recount
+        updated = recount()
+        click.echo(f"✅ Recounted {updated} posts")
+
+    @app.cli.command('messages-archive')
+    @click.option('--days', type=int, help='Archive messages older than this (default MESSAGE_RETENTION_DAYS).')
+    @click.option('--chunk-size', type=int, help='Messages per archive chunk (default MESSAGE_ARCHIVE_CHUNK).')
+    def messages_archive_command(days, chunk_size):
+        """Move old private messages into the compressed archive."""
+        from app import retention
+        from app.retention import archive_messages, purge_unlinkable, maintain_partitions
+        days = days or retention.retention_days
+        if not days:
+            raise click.UsageError("MESSAGE_RETENTION_DAYS is 0; pass --days")
+        cutoff = retention.cutoff(days)
+        moved = archive_messages(cutoff, chunk_size or retention.chunk_size)
+        click.echo(f"✅ Archived {moved} messages older than {days} days")
+        deleted, waiting = purge_unlinkable(cutoff, chunk_size or retention.chunk_size)
+        if deleted:
+            click.echo(f"✅ Deleted {deleted} old messages that belong to no conversation")
+        if waiting:
+            click.echo(f"⚠️ {waiting} old messages are not linked to a conversation yet; "
+                       f"run the backfill (render_start.py) and archive again")
+        created, dropped = maintain_partitions(cutoff, retention.months_ahead)
+        if created or dropped:
+            click.echo(f"✅ Created {created} and dropped {dropped} message partitions")
+
+    @app.cli.command('assets-build')
+    def assets_build_command():
+        """Fingerprint static files and write precompressed copies."""
+        from app.assets import build_static_assets
+        manifest = build_static_assets(app.static_folder)
+        click.echo(f"✅ Fingerprinted {len(manifest)} static files")
+
+    @app.cli.command('search-reindex')
+    @click.option('--schema-only', is_flag=True, help='Only create missing search tables/indexes.')
+    def search_reindex_command(schema_only):
+        """Rebuild the full-text search index for posts and messages."""
+        from app import db
+        from app.search import reindex, ensure_schema
+        if schema_only:
+            ensure_schema(db.session)
+            db.session.commit()
+            click.echo("✅ Search schema ready")
+            return
+        reindex(db.session)
+        db.session.commit()
+        click.echo("✅ Search index rebuilt")
@@ -0,0 +1,130 @@
+"""
+Write-coalesced engagement counters.
+
+Likes, comments and views each move a denormalized total on Post
+(like_count, comment_count, view_count) so listings can show them without
+COUNT queries. Running `UPDATE post SET like_count = like_count + 1` per
+click would make a popular post's row the most contended lock in the
+database, so increments are summed in memory and written as a single
+UPDATE per post every COUNTER_FLUSH_INTERVAL seconds.
+
+The deltas are additive, so every worker process keeps and flushes its
+own without coordinating. Whatever is pending is flushed at exit; a
+crashed worker loses at most one interval of counts, and
+`flask counters-recount` recomputes likes and comments from their tables.
+
+Flushing a like or comment change drops the cached copies of the post so
+pages catch up within one interval. View counts only ever show up when
+the cache refreshes on its own.
+"""
+import atexit
+import threading
+
+from sqlalchemy import bindparam, func, select
+
+FIELDS = ('like_count', 'comment_count', 'view_count')
+VISIBLE = ('like_count', 'comment_count')
+
+
+class Counters:
+    """Flask extension: in-memory deltas flushed by a background task."""
+
+    def __init__(self):
+        self.app = None
+        self._pending = {}   # post_id -> {field: delta}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('COUNTER_FLUSH_INTERVAL', 2)
+        app.extensions['counters'] = self
+
+    def incr(self, post_id, field, delta=1):
+        if field not in FIELDS:
+            raise ValueError(f"Unknown counter: {field}")
+        self._ensure_started()
+        with self._lock:
+            deltas = self._pending.setdefault(post_id, {})
+            deltas[field] = deltas.get(field, 0) + delta
+
+    def pending(self, post_id):
+        """Deltas for post_id not written yet (by this process)."""
+        with self._lock:
+            return dict(self._pending.get(post_id, ()))
+
+    def flush(self):
+        """Write all pending deltas, one UPDATE per post."""
+        from app import db, cache
+        from app.models import Post
+
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            # Posts changing the same counters share one executemany; ordered
+            # by id so two workers flushing at once lock rows in the same order
+            groups = {}
+            for post_id in sorted(pending):
+                deltas = {field: n for field, n in pending[post_id].items() if n}
+                if deltas:
+                    groups.setdefault(tuple(sorted(deltas)), []).append(
+                        dict({f'd_{field}': n for field, n in deltas.items()}, b_id=post_id))
+            table = Post.__table__
+            with self.app.app_context():
+                try:
+                    for fields, rows in groups.items():
+                        stmt = (table.update().where(table.c.id == bindparam('b_id'))
+                                .values({field: table.c[field] + bindparam(f'd_{field}') for field in fields}))
+                        db.session.execute(stmt, rows)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self._restore(pending)
+                    raise
+                for post_id, deltas in pending.items():
+                    if any(deltas.get(field) for field in VISIBLE):
+                        cache.invalidate_tags(f"post:{post_id}")
+
+    def _restore(self, pending):
+        # Put deltas back so the next flush retries them
+        with self._lock:
+            for post_id, deltas in pending.items():
+                current = self._pending.setdefault(post_id, {})
+                for field, n in deltas.items():
+                    current[field] = current.get(field, 0) + n
+
+    def _ensure_started(self):
+        # Started lazily from a request so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+        atexit.register(self.flush)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('counters',))
+                self.app.logger.exception('Failed to write counters')
+
+
+def recount():
+    """Recompute like and comment totals from their tables. Returns the number of posts."""
+    from app import db
+    from app.models import Post, PostLike, Comment
+
+    table = Post.__table__
+    result = db.session.execute(table.update().values(
+        like_count=select(func.count()).where(PostLike.post_id == table.c.id).scalar_subquery(),
+        comment_count=select(func.count()).where(Comment.post_id == table.c.id).scalar_subquery()))
+    db.session.commit()
+    return result.rowcount
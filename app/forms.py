@@ -39,6 +39,10 @@ class PostForm(FlaskForm):
     submit = SubmitField('Post')
 
 # NEW FORM for updating user account
+class CommentForm(FlaskForm):
+    body = TextAreaField('Comment', validators=[DataRequired(), Length(max=500)])
+    submit = SubmitField('Comment')
+
 class UpdateAccountForm(FlaskForm):
     username = StringField('Username',
                            validators=[DataRequired(), Length(min=2, max=20)])
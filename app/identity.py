@@ -0,0 +1,109 @@
+"""
+Cached identity for the Flask-Login user loader.
+
+Flask-Login resolves current_user on every request and every Socket.IO
+event, which used to be one SELECT each time. The loader now returns a
+UserIdentity built from a cached (id, username, image_file) snapshot, so
+the chat and signalling handlers never touch the database to know who
+is talking.
+
+Snapshots are kept in a per-process LRU with a short TTL and, when
+Config.IDENTITY_CACHE_REDIS_URL is set, in a shared Redis cache as well.
+Changing a profile calls identity_cache.invalidate(user_id); other worker
+processes see the change once their local entry expires.
+"""
+from flask_login import UserMixin
+
+from app.cache import MemoryCache, RedisCache, NullCache
+
+
+def identity_key(user_id):
+    return f"identity:{user_id}"
+
+
+class UserIdentity(UserMixin):
+    """
+    Lightweight stand-in for User in current_user.
+
+    Anything beyond id, username and image_file (e.g. email, posts) loads
+    the full User row on first access, once per request.
+    """
+
+    def __init__(self, id, username, image_file):
+        self.id = id
+        self.username = username
+        self.image_file = image_file
+        self._record = None
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.image_file)
+
+    def snapshot(self):
+        return (self.id, self.username, self.image_file)
+
+    @property
+    def record(self):
+        """The full User row, for writes and rarely used columns."""
+        if self._record is None:
+            from app.models import User
+            self._record = User.query.get(self.id)
+        return self._record
+
+    def __getattr__(self, name):
+        # Only called for attributes not on the snapshot
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.record, name)
+
+    def __eq__(self, other):
+        from app.models import User
+        if isinstance(other, (UserIdentity, User)):
+            return self.id == other.id
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"UserIdentity({self.id}, '{self.username}')"
+
+
+class IdentityCache:
+    def __init__(self):
+        self.local = NullCache()
+        self.shared = NullCache()
+
+    def init_app(self, app):
+        if app.config.get('IDENTITY_CACHE_ENABLED', True):
+            self.local = MemoryCache(app.config.get('IDENTITY_CACHE_TTL', 30),
+                                     app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 4096))
+            redis_url = app.config.get('IDENTITY_CACHE_REDIS_URL')
+            if redis_url:
+                self.shared = RedisCache(redis_url, app.config.get('IDENTITY_CACHE_SHARED_TTL', 300))
+        app.extensions['identity_cache'] = self
+
+    def load(self, user_id):
+        """UserIdentity for user_id, or None if there is no such user."""
+        key = identity_key(user_id)
+        snapshot = self.local.get(key)
+        if snapshot is None:
+            snapshot = self.shared.get(key)
+            if snapshot is None:
+                from app.models import User
+                user = User.query.get(user_id)
+                if user is None:
+                    return None
+                snapshot = UserIdentity.from_user(user).snapshot()
+                self.shared.set(key, snapshot)
+            self.local.set(key, snapshot)
+        return UserIdentity(*snapshot)
+
+    def invalidate(self, user_id):
+        key = identity_key(user_id)
+        self.local.delete(key)
+        self.shared.delete(key)
@@ -0,0 +1,181 @@
+"""
+Profile picture processing.
+
+Uploads are checked cheaply in the request (byte size and the pixel count
+from the image header), then decoded and resized in a separate process
+so the web worker never spends CPU on it. Each picture is stored once per
+size in WebP and JPEG under a content-hash name, e.g.
+profile_pics/3f2a9c0d1b7e4a55_64.webp, so identical uploads share files
+and the URLs can be cached forever. When processing finishes the user's
+image_file is switched to the new name. That happens in a background task
+of the server (polling the pool's futures), never on the pool's own
+callback thread, so the database is used under the server's async mode.
+
+Pictures uploaded before this existed are plain filenames with an
+extension ('default.jpg', '793df557f3450245.jpg') and are served as-is.
+"""
+import hashlib
+import io
+import os
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from PIL import Image, ImageOps
+from flask import url_for, current_app
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def is_legacy(image_file):
+    return '.' in image_file
+
+
+def variant_filename(name, size, fmt):
+    return f"{name}_{size}.{fmt}"
+
+
+def render_avatar_variants(data, dest_dir, name, sizes, max_pixels, quality=85):
+    """
+    Decode an upload and write a square WebP and JPEG for every size.
+    Runs in a worker process. Files that already exist are skipped.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with warnings.catch_warnings():
+        # Treat "possible decompression bomb" warnings as hard errors
+        warnings.simplefilter('error', Image.DecompressionBombWarning)
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    for size in sizes:
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for fmt, pil_format in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+            path = os.path.join(dest_dir, variant_filename(name, size, fmt))
+            if os.path.exists(path):
+                continue
+            # Write then rename so a half-written file is never served
+            tmp_path = path + '.tmp'
+            variant.save(tmp_path, pil_format, quality=quality)
+            os.replace(tmp_path, path)
+    return name
+
+
+class AvatarProcessor:
+    POLL_INTERVAL = 0.2   # seconds between checks for finished pictures
+
+    def __init__(self):
+        self.app = None
+        self._pool = None
+        self._in_flight = []   # (user_id, future) still being processed
+        self._lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.sizes = tuple(app.config.get('AVATAR_SIZES', (32, 64, 125, 256)))
+        self.max_bytes = app.config.get('AVATAR_MAX_BYTES', 5 * 1024 * 1024)
+        self.max_pixels = app.config.get('AVATAR_MAX_PIXELS', 20_000_000)
+        self.workers = app.config.get('AVATAR_WORKERS', 1)
+        self.dest_dir = os.path.join(app.root_path, 'static', 'profile_pics')
+        app.extensions['avatar_processor'] = self
+        app.add_template_global(avatar_url)
+        app.add_template_global(is_legacy, 'avatar_is_legacy')
+
+    def submit(self, user_id, data):
+        """
+        Validate an upload and start processing it. Returns the new image name.
+        The user's image_file is updated once all sizes have been written.
+        Raises InvalidImage if the upload is rejected.
+        """
+        if len(data) > self.max_bytes:
+            raise InvalidImage(f'Pictures must be smaller than {self.max_bytes // (1024 * 1024)} MB.')
+        try:
+            # Only parses the header, so this is cheap even for huge images
+            width, height = Image.open(io.BytesIO(data)).size
+        except (Image.DecompressionBombError, OSError):
+            raise InvalidImage('That file is not a picture we can read.')
+        if width * height > self.max_pixels:
+            raise InvalidImage('That picture is too large.')
+
+        name = hashlib.sha256(data).hexdigest()[:16]
+        if self._all_variants_exist(name):
+            # Same picture uploaded before: nothing to process
+            self._finish(user_id, name)
+            return name
+
+        args = (data, self.dest_dir, name, self.sizes, self.max_pixels)
+        if not self.workers:
+            render_avatar_variants(*args)
+            self._finish(user_id, name)
+            return name
+
+        future = self._get_pool().submit(render_avatar_variants, *args)
+        with self._lock:
+            self._in_flight.append((user_id, future))
+        self._ensure_started()
+        return name
+
+    def _get_pool(self):
+        if self._pool is None:
+            # 'spawn' so the workers don't inherit eventlet/gevent patching
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _all_variants_exist(self, name):
+        return all(os.path.exists(os.path.join(self.dest_dir, variant_filename(name, size, fmt)))
+                   for size in self.sizes for fmt in ('webp', 'jpg'))
+
+    def collect(self):
+        """Switch users to their pictures that have finished processing."""
+        with self._lock:
+            done = [(user_id, future) for user_id, future in self._in_flight if future.done()]
+            self._in_flight = [item for item in self._in_flight if item not in done]
+        for user_id, future in done:
+            try:
+                name = future.result()
+                with self.app.app_context():
+                    self._finish(user_id, name)
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('avatars',))
+                self.app.logger.exception("Failed to process picture for user %s", user_id)
+
+    def _ensure_started(self):
+        # Started lazily from a request so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            socketio.sleep(self.POLL_INTERVAL)
+            self.collect()
+
+    def _finish(self, user_id, name):
+        from app import db, cache, identity_cache
+        from app.models import User
+        from app.cache import invalidate_user
+
+        user = User.query.get(user_id)
+        if user is None:
+            return
+        user.image_file = name
+        db.session.commit()
+        identity_cache.invalidate(user.id)
+        invalidate_user(cache, user)
+
+
+def avatar_url(image_file, size=125, fmt='jpg'):
+    """URL of a profile picture at the closest generated size at or above `size`."""
+    if is_legacy(image_file):
+        return url_for('static', filename='profile_pics/' + image_file)
+    sizes = current_app.extensions['avatar_processor'].sizes
+    size = min((s for s in sizes if s >= size), default=max(sizes))
+    return url_for('static', filename='profile_pics/' + variant_filename(image_file, size, fmt))
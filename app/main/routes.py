@@ -1,25 +1,103 @@
-import os
-import secrets
-from PIL import Image
-from flask import render_template, url_for, flash, redirect, request, Blueprint, abort, current_app
-from app import db, bcrypt, socketio
-from app.forms import RegistrationForm, LoginForm, PostForm, UpdateAccountForm
-from app.models import User, Post, Message
+from datetime import datetime
+from flask import (render_template, url_for, flash, redirect, request, Blueprint, abort, current_app,
+                   jsonify, session)
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from app import (db, socketio, cache, message_writer, call_rooms, avatar_processor, identity_cache,
+                 password_hasher, presence, chat_rooms, notifier, timelines, counters, metrics, replicas, wire)
+from app.cache import (feed_key, api_feed_key, post_key, post_comments_key, user_posts_key, user_post_count_key,
+                       page_tags, invalidate_new_post, invalidate_post, invalidate_deleted_post,
+                       invalidate_user)
+from app.forms import RegistrationForm, LoginForm, PostForm, CommentForm, UpdateAccountForm
+from app.models import User, Post, Message, Conversation, PostLike, Comment
+from app.images import InvalidImage
+from app.passwords import HasherBusy
+from app.chat_rooms import RateLimited, chat_room, private_room
+from app.call_rooms import call_room
+from app.search import search_posts, search_messages
+from app.replicas import replica_reads
+from app.pagination import (feed_page, message_page, inbox_page, comment_page, post_to_dict,
+                            message_to_dict, comment_to_dict, InvalidCursor)
 from flask_login import login_user, current_user, logout_user, login_required
-from flask_socketio import send, emit, join_room, leave_room
-from sqlalchemy import or_
+from flask_socketio import emit, join_room, leave_room, close_room, rooms
 
 main = Blueprint('main', __name__)
-user_sids = {}
-call_rooms = {}
+
+# Most recent chat counterparts remembered in the session cookie
+MAX_CHAT_PEERS = 20
+
+# Private chat rooms each connected sid has joined in this process:
+# sid -> {room: (peer_id, peer_username)}. Sending and read receipts are
+# only accepted for rooms in here, so they cost a dict lookup, not a query.
+sid_private_rooms = {}
+
+# Signal types video_call.html sends; anything else is counted as 'other'
+SIGNAL_TYPES = ('offer', 'answer', 'candidates')
 
 # -------------------- ROUTES --------------------
 
 @main.route("/")
 @main.route("/home")
+@replica_reads
 def home():
-    posts = Post.query.order_by(Post.date_posted.desc()).all()
-    return render_template('home.html', posts=posts)
+    cursor = request.args.get('cursor')
+    post_list = cache.get(feed_key(cursor))
+    if post_list is None:
+        try:
+            posts, next_cursor = feed_page(cursor, current_app.config['FEED_PAGE_SIZE'])
+        except InvalidCursor:
+            abort(400)
+        post_list = render_template('_post_list.html', posts=posts, next_cursor=next_cursor,
+                                    next_url=url_for('main.home', cursor=next_cursor))
+        cache.set(feed_key(cursor), post_list, timeout=replicas.cache_timeout(), tags=page_tags(posts))
+    return render_template('home.html', post_list=Markup(post_list))
+
+# Posts by the people the current user follows (see app/timelines.py).
+# Not cached: each page is one index range scan on the user's own entries.
+@main.route("/timeline")
+@login_required
+@replica_reads
+def timeline():
+    cursor = request.args.get('cursor')
+    try:
+        posts, next_cursor = timelines.page(current_user.id, cursor, current_app.config['FEED_PAGE_SIZE'])
+    except InvalidCursor:
+        abort(400)
+    return render_template('timeline.html', title='Following', posts=posts, next_cursor=next_cursor,
+                           next_url=url_for('main.timeline', cursor=next_cursor))
+
+@main.route("/api/timeline")
+@login_required
+@replica_reads
+def api_timeline():
+    cursor = request.args.get('cursor')
+    try:
+        posts, next_cursor = timelines.page(current_user.id, cursor, current_app.config['FEED_PAGE_SIZE'])
+    except InvalidCursor:
+        abort(400)
+    return jsonify({
+        'posts': [post_to_dict(p) for p in posts],
+        'next_cursor': next_cursor
+    })
+
+# JSON version of the home feed, paginated with the same opaque cursor
+@main.route("/api/feed")
+@replica_reads
+def api_feed():
+    cursor = request.args.get('cursor')
+    page = cache.get(api_feed_key(cursor))
+    if page is None:
+        try:
+            posts, next_cursor = feed_page(cursor, current_app.config['FEED_PAGE_SIZE'])
+        except InvalidCursor:
+            abort(400)
+        page = {
+            'posts': [post_to_dict(p) for p in posts],
+            'next_cursor': next_cursor
+        }
+        cache.set(api_feed_key(cursor), page, timeout=replicas.cache_timeout(), tags=page_tags(posts))
+    return jsonify(page)
 
 @main.route("/register", methods=['GET', 'POST'])
 def register():
@@ -27,7 +105,11 @@ def register():
         return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        try:
+            hashed_password = password_hasher.hash(form.password.data, request.remote_addr)
+        except HasherBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.', 'warning')
+            return render_template('register.html', title='Register', form=form), 429
         user = User(username=form.username.data, email=form.email.data, password_hash=hashed_password)
         db.session.add(user)
         db.session.commit()
@@ -42,7 +124,20 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password_hash, form.password.data):
+        try:
+            valid = user is not None and password_hasher.check(user.password_hash, form.password.data,
+                                                               request.remote_addr)
+        except HasherBusy:
+            flash('Too many sign-in attempts right now. Please try again in a moment.', 'warning')
+            return render_template('login.html', title='Login', form=form), 429
+        if valid:
+            if password_hasher.needs_rehash(user.password_hash):
+                # BCRYPT_LOG_ROUNDS changed since this hash was made
+                try:
+                    user.password_hash = password_hasher.hash(form.password.data, request.remote_addr)
+                    db.session.commit()
+                except HasherBusy:
+                    pass  # try again next login
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('main.home'))
@@ -60,29 +155,98 @@ def logout():
 def new_post():
     form = PostForm()
     if form.validate_on_submit():
-        post = Post(title=form.title.data, content=form.content.data, author=current_user)
+        post = Post(title=form.title.data, content=form.content.data, author=current_user.record)
         db.session.add(post)
+        db.session.flush()
+        # Followers are notified once it is on their timeline (queued for those offline)
+        published = timelines.publish(post, {'text': f"New post from {current_user.username}: {post.title}",
+                                             'author': current_user.username, 'title': post.title,
+                                             'url': url_for('main.post', post_id=post.id)})
         db.session.commit()
+        timelines.fan_out_later(published)
+        invalidate_new_post(cache, post)
         flash('Your post has been created!', 'success')
         return redirect(url_for('main.home'))
     return render_template('create_post.html', title='New Post', form=form, legend='New Post')
 
 @main.route("/post/<int:post_id>")
+@replica_reads
 def post(post_id):
+    post = cache.get(post_key(post_id))
+    if post is None:
+        post = post_to_dict(Post.query.get_or_404(post_id))
+        cache.set(post_key(post_id), post, timeout=replicas.cache_timeout(),
+                  tags=(f"post:{post_id}", f"user:{post['author']['id']}"))
+    counters.incr(post_id, 'view_count')
+    # Our own clicks that have not been written yet, so a like shows up at once
+    for field, delta in counters.pending(post_id).items():
+        post = dict(post, **{field: post.get(field, 0) + delta})
+
+    before = request.args.get('before')
+    comments = cache.get(post_comments_key(post_id)) if before is None else None
+    if comments is None:
+        try:
+            rows, next_cursor = comment_page(post_id, before, current_app.config['COMMENT_PAGE_SIZE'])
+        except InvalidCursor:
+            abort(400)
+        comments = {'comments': [comment_to_dict(c) for c in reversed(rows)], 'next_cursor': next_cursor}
+        if before is None:
+            cache.set(post_comments_key(post_id), comments, timeout=replicas.cache_timeout(),
+                      tags={f"post:{post_id}"} | {f"user:{c.user_id}" for c in rows})
+    liked = current_user.is_authenticated and \
+        db.session.get(PostLike, (current_user.id, post_id)) is not None
+    return render_template('post.html', title=post['title'], post=post, liked=liked,
+                           comments=comments['comments'], comments_next_cursor=comments['next_cursor'],
+                           form=CommentForm() if current_user.is_authenticated else None)
+
+@main.route("/post/<int:post_id>/like", methods=['POST'])
+@login_required
+def like_post(post_id):
+    # The like row is per user, so only the shared total needs coalescing
+    Post.query.with_entities(Post.id).filter_by(id=post_id).first_or_404()
+    if db.session.get(PostLike, (current_user.id, post_id)) is None:
+        try:
+            db.session.add(PostLike(user_id=current_user.id, post_id=post_id))
+            db.session.commit()
+            counters.incr(post_id, 'like_count')
+        except IntegrityError:
+            db.session.rollback()  # double click; the first one counted
+    return redirect(url_for('main.post', post_id=post_id))
+
+@main.route("/post/<int:post_id>/unlike", methods=['POST'])
+@login_required
+def unlike_post(post_id):
+    if PostLike.query.filter_by(user_id=current_user.id, post_id=post_id).delete():
+        db.session.commit()
+        counters.incr(post_id, 'like_count', -1)
+    return redirect(url_for('main.post', post_id=post_id))
+
+@main.route("/post/<int:post_id>/comment", methods=['POST'])
+@login_required
+def comment_post(post_id):
     post = Post.query.get_or_404(post_id)
-    return render_template('post.html', title=post.title, post=post)
+    form = CommentForm()
+    if form.validate_on_submit():
+        db.session.add(Comment(post_id=post.id, user_id=current_user.id, body=form.body.data.strip()))
+        db.session.commit()
+        counters.incr(post.id, 'comment_count')
+        cache.delete(post_comments_key(post.id))
+    else:
+        flash('Comments must be between 1 and 500 characters.', 'danger')
+    return redirect(url_for('main.post', post_id=post.id))
 
 @main.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
 @login_required
 def update_post(post_id):
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    if post.user_id != current_user.id:
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
         post.title = form.title.data
         post.content = form.content.data
         db.session.commit()
+        invalidate_post(cache, post)
         flash('Your post has been updated!', 'success')
         return redirect(url_for('main.post', post_id=post.id))
     elif request.method == 'GET':
@@ -93,90 +257,152 @@ def update_post(post_id):
 @main.route("/post/<int:post_id>/delete", methods=['POST'])
 @login_required
 def delete_post(post_id):
-    post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    # Author is needed for cache invalidation after the row is gone
+    post = Post.query.options(joinedload(Post.author)).get_or_404(post_id)
+    if post.user_id != current_user.id:
         abort(403)
+    timelines.remove(post)
+    PostLike.query.filter_by(post_id=post.id).delete(synchronize_session=False)
+    Comment.query.filter_by(post_id=post.id).delete(synchronize_session=False)
     db.session.delete(post)
     db.session.commit()
+    invalidate_deleted_post(cache, post)
     flash('Your post has been deleted!', 'success')
     return redirect(url_for('main.home'))
 
+# -------------------- METRICS --------------------
+
+# Prometheus scrape target; see app/metrics.py
+@main.route("/metrics")
+def metrics_endpoint():
+    if not metrics.enabled:
+        abort(404)
+    if metrics.token and request.headers.get('Authorization') != f"Bearer {metrics.token}":
+        abort(401)
+    return current_app.response_class(metrics.collect(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# -------------------- SEARCH --------------------
+
+def _run_search():
+    """Shared by the HTML and JSON search routes."""
+    q = request.args.get('q', '').strip()
+    kind = request.args.get('type', 'posts')
+    page = request.args.get('page', 1, type=int)
+    max_pages = current_app.config['SEARCH_MAX_PAGES']
+    if not 1 <= page <= max_pages or kind not in ('posts', 'messages'):
+        abort(400)
+    if kind == 'messages' and not current_user.is_authenticated:
+        abort(401)
+    per_page = current_app.config['SEARCH_PAGE_SIZE']
+    results = []
+    if q:
+        if kind == 'posts':
+            results = search_posts(db.session, q, page, per_page)
+        else:
+            results = search_messages(db.session, current_user.id, q, page, per_page)
+    return q, kind, page, results, len(results) == per_page and page < max_pages
+
+@main.route("/search")
+def search():
+    q, kind, page, results, has_more = _run_search()
+    return render_template('search.html', title='Search', q=q, kind=kind, page=page,
+                           results=results, has_more=has_more)
+
+@main.route("/api/search")
+def api_search():
+    q, kind, page, results, has_more = _run_search()
+    to_dict = post_to_dict if kind == 'posts' else message_to_dict
+    return jsonify({
+        'results': [to_dict(r) for r in results],
+        'page': page,
+        'has_more': has_more
+    })
+
 # -------------------- CHAT ROUTES --------------------
 
 @main.route("/chat")
+@main.route("/chat/<string:room>")
 @login_required
-def chat():
-    return render_template('chat.html', title='Chat')
+def chat(room=None):
+    if room is None:
+        return redirect(url_for('main.chat', room=chat_rooms.rooms[0]))
+    if room not in chat_rooms.rooms:
+        abort(404)
+    return render_template('chat.html', title=f'#{room}', room=room, rooms=chat_rooms.rooms)
 
 # -------------------- SOCKET.IO HANDLERS --------------------
 
-@socketio.on('message')
-def handle_message(msg):
-    print(f'Message received: {msg}')
-    send(msg, broadcast=True)
+@socketio.on('join_chat')
+def handle_join_chat(data):
+    """Join a public chat room and get its recent history in one frame."""
+    room = data.get('room')
+    if room not in chat_rooms.rooms:
+        return
+    join_room(chat_room(room))
+    wire.chat_history(room, chat_rooms.recent(room))
 
 @socketio.on('json')
-def handle_json(json):
-    print('Received json:', json)
-    payload = {
-        'message': json['message'],
-        'username': getattr(current_user, 'username', 'Anonymous')
-    }
-    emit('message_response', payload, broadcast=True)
+def handle_json(data):
+    """A message for a public chat room; only members of that room receive it."""
+    room = data.get('room')
+    message_body = str(data.get('message', '')).strip()[:500]
+    if not message_body or room not in chat_rooms.rooms or chat_room(room) not in rooms():
+        return
+    try:
+        message = chat_rooms.post(room, current_user.id, current_user.username, message_body,
+                                  datetime.utcnow())
+    except RateLimited as e:
+        emit('chat_error', {'room': room, 'message': str(e)})
+        return
+    wire.chat_message(chat_room(room), message)
 
 @socketio.on('connect')
 def handle_connect():
-    if current_user.is_authenticated:
-        username = getattr(current_user, 'username', 'User')
-        print(f'{username} connected.')
-        emit('message_response', {'message': f'{username} has joined the chat.', 'username': 'System'}, broadcast=True)
-    else:
+    if not current_user.is_authenticated:
         return False  # Reject unauthenticated connections
+    current_app.logger.debug('%s connected', current_user.username)
+    presence.connected(current_user.id, request.sid)
+    notifier.connected(current_user.id, request.sid)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     username = getattr(current_user, 'username', 'User') if current_user.is_authenticated else 'User'
-    print(f'{username} disconnected.')
-    
-    # Handle general chat disconnect
+    current_app.logger.debug('%s disconnected', username)
+
+    # Only the watchers of this user hear about it, and only if no other tab is open
     if current_user.is_authenticated:
-        emit('message_response', {'message': f'{username} has left the chat.', 'username': 'System'}, broadcast=True)
-    
-    # Handle video call room cleanup
-    sid_to_remove = request.sid
-    rooms_to_clean = []
-    
-    for room, sids in call_rooms.items():
-        if sid_to_remove in sids:
-            rooms_to_clean.append(room)
-    
-    for room in rooms_to_clean:
-        # Remove the disconnected user
-        call_rooms[room].remove(sid_to_remove)
-        
-        # Notify remaining peers
-        if call_rooms[room]:
-            emit('peer_left', {'peer': username}, room=room)
-        
-        # Clean up empty room
-        if not call_rooms[room]:
-            del call_rooms[room]
-            
-        print(f"Cleaned up call room {room} after user {sid_to_remove} disconnected.")
-
-# HELPER FUNCTION to save uploaded pictures
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static/profile_pics', picture_fn)
-
-    output_size = (125, 125)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-
-    return picture_fn
+        presence.disconnected(current_user.id, request.sid)
+    sid_private_rooms.pop(request.sid, None)
+
+    # End any call this sid was in; the reverse index avoids scanning all calls
+    for room in call_rooms.rooms_for(request.sid):
+        if call_rooms.end(room, 'disconnect'):
+            emit('peer_left', {'peer': username}, room=room, skip_sid=request.sid)
+            close_room(room)
+        current_app.logger.debug('Cleaned up call room %s after %s disconnected', room, request.sid)
+
+@socketio.on('heartbeat')
+def handle_heartbeat():
+    if current_user.is_authenticated:
+        presence.heartbeat(current_user.id, request.sid)
+
+@socketio.on('watch_presence')
+def handle_watch_presence(data):
+    """
+    Subscribe to online/offline changes of the users shown on this page.
+    Only people the user has a conversation with, or a private chat open
+    with, can be watched; anyone else is left out of the reply.
+    """
+    if not current_user.is_authenticated:
+        return {}
+    try:
+        user_ids = list(dict.fromkeys(int(user_id) for user_id in data.get('user_ids', [])))
+    except (TypeError, ValueError):
+        return {}
+    user_ids = user_ids[:presence.max_watch]
+    open_chats = set(session.get('chat_peers', {}).values())
+    allowed = open_chats | Conversation.counterparts(current_user.id, set(user_ids) - open_chats)
+    return presence.watch(request.sid, [user_id for user_id in user_ids if user_id in allowed])
 
 # UPDATED ROUTE: Account management
 @main.route("/account", methods=['GET', 'POST'])
@@ -185,35 +411,101 @@ def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+            # Resized off-request; image_file switches over when it's done
+            try:
+                avatar_processor.submit(current_user.id, form.picture.data.read())
+            except InvalidImage as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('main.account'))
+        user = current_user.record
+        user.username = form.username.data
+        user.email = form.email.data
         db.session.commit()
+        identity_cache.invalidate(user.id)
+        invalidate_user(cache, user)
         flash('Your account has been updated!', 'success')
         return redirect(url_for('main.account'))
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template('account.html', title='Account', image_file=image_file, form=form)
+    return render_template('account.html', title='Account', form=form)
 
 # NEW ROUTE: User's public profile page with their posts
 @main.route("/user/<string:username>")
+@replica_reads
 def user_posts(username):
+    cursor = request.args.get('cursor')
+    post_list = cache.get(user_posts_key(username, cursor))
+    post_count = cache.get(user_post_count_key(username))
+    user = None
+    if post_list is None or post_count is None:
+        user = User.query.filter_by(username=username).first_or_404()
+        if post_list is None:
+            try:
+                posts, next_cursor = feed_page(cursor, current_app.config['FEED_PAGE_SIZE'],
+                                               query=Post.query.filter_by(user_id=user.id))
+            except InvalidCursor:
+                abort(400)
+            post_list = render_template('_post_list.html', posts=posts, next_cursor=next_cursor,
+                                        next_url=url_for('main.user_posts', username=username,
+                                                         cursor=next_cursor))
+            cache.set(user_posts_key(username, cursor), post_list, timeout=replicas.cache_timeout(),
+                      tags=page_tags(posts) | {f"user:{user.id}"})
+        if post_count is None:
+            post_count = Post.query.filter_by(user_id=user.id).count()
+            cache.set(user_post_count_key(username), post_count, timeout=replicas.cache_timeout(),
+                      tags=(f"user:{user.id}",))
+    # Follow button and follower count depend on the viewer, so they stay out of the cache
+    profile, following = None, False
+    if current_user.is_authenticated:
+        # Already loaded on a cache miss; only a full cache hit needs the query
+        profile = user or User.query.filter_by(username=username).first_or_404()
+        following = timelines.is_following(current_user.id, profile.id)
+    return render_template('user_posts.html', username=username, post_count=post_count,
+                           post_list=Markup(post_list), profile=profile, following=following)
+
+@main.route("/user/<string:username>/follow", methods=['POST'])
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    if user.id == current_user.id:
+        flash('You cannot follow yourself.', 'danger')
+        return redirect(url_for('main.user_posts', username=username))
+    try:
+        if timelines.follow(current_user.id, user.id):
+            db.session.commit()
+            flash(f'You are now following {username}.', 'success')
+    except IntegrityError:
+        db.session.rollback()  # followed twice at once; the other request won
+    return redirect(url_for('main.user_posts', username=username))
+
+@main.route("/user/<string:username>/unfollow", methods=['POST'])
+@login_required
+def unfollow(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user)\
-                .order_by(Post.date_posted.desc())\
-                .all()
-    return render_template('user_posts.html', posts=posts, user=user)
+    if timelines.unfollow(current_user.id, user.id):
+        db.session.commit()
+        flash(f'You are no longer following {username}.', 'info')
+    return redirect(url_for('main.user_posts', username=username))
 
 @main.route("/messages")
 @login_required
+@replica_reads
 def messages():
-    users = User.query.filter(User.id != current_user.id).all()
-    return render_template('messages.html', title='Messages', users=users)
-
-# NEW ROUTE: Private chat page
+    # "Start a new conversation" form submits the counterpart's username here
+    to = request.args.get('to', '').strip()
+    if to:
+        return redirect(url_for('main.private_chat', username=to))
+    try:
+        conversations, next_cursor = inbox_page(current_user.id, request.args.get('cursor'),
+                                                current_app.config['INBOX_PAGE_SIZE'])
+    except InvalidCursor:
+        abort(400)
+    return render_template('messages.html', title='Messages',
+                           conversations=conversations, next_cursor=next_cursor)
+
+# NEW ROUTE: Private chat page. Reads the primary: it marks the newest
+# messages read, which a lagging replica might not have yet.
 @main.route("/messages/<username>")
 @login_required
 def private_chat(username):
@@ -222,61 +514,127 @@ def private_chat(username):
         flash('You cannot chat with yourself.', 'danger')
         return redirect(url_for('main.messages'))
     
-    # Fetch message history
-    messages = Message.query.filter(
-        or_(
-            (Message.sender_id == current_user.id) & (Message.recipient_id == recipient.id),
-            (Message.sender_id == recipient.id) & (Message.recipient_id == current_user.id)
-        )
-    ).order_by(Message.timestamp.asc()).all()
-    
-    return render_template('private_chat.html', title=f'Chat with {username}', recipient=recipient, messages=messages)
+    # Remember the counterpart's id for the private_message socket handler
+    chat_peers = session.get('chat_peers', {})
+    if recipient.username not in chat_peers:
+        if len(chat_peers) >= MAX_CHAT_PEERS:
+            chat_peers.pop(next(iter(chat_peers)))
+        chat_peers[recipient.username] = recipient.id
+        session['chat_peers'] = chat_peers
+
+    # Fetch the newest page of history; older pages come from api_messages
+    messages, before = [], None
+    conversation = Conversation.between(current_user.id, recipient.id)
+    if conversation:
+        messages, before = message_page(conversation.id,
+                                        per_page=current_app.config['MESSAGE_PAGE_SIZE'])
+        messages.reverse()
+        if conversation.unread_for(current_user.id):
+            conversation.mark_read(current_user.id)
+            db.session.commit()
+
+    return render_template('private_chat.html', title=f'Chat with {username}', recipient=recipient,
+                           messages=messages, before=before, room=private_room(current_user.id, recipient.id))
+
+# JSON history for "load older" in private chat, newest first
+@main.route("/api/messages/<username>")
+@login_required
+@replica_reads
+def api_messages(username):
+    recipient = User.query.filter_by(username=username).first_or_404()
+    conversation = Conversation.between(current_user.id, recipient.id)
+    if conversation is None:
+        return jsonify({'messages': [], 'before': None})
+    try:
+        messages, before = message_page(conversation.id, request.args.get('before'),
+                                        current_app.config['MESSAGE_PAGE_SIZE'])
+    except InvalidCursor:
+        abort(400)
+    return jsonify({
+        'messages': [message_to_dict(m) for m in messages],
+        'before': before
+    })
 
 
 # --- SocketIO Event Handlers for Private Chat ---
 
 @socketio.on('join')
 def on_join(data):
-    """User joins a private chat room"""
-    username = data['username']
-    room = data['room']
+    """
+    User joins the private chat with data['username']. The room is derived
+    from the two user ids, never taken from the client, and returned.
+    """
+    peer_username = data.get('username')
+    # Set in the session when private_chat was rendered; fall back to a lookup
+    peer_id = session.get('chat_peers', {}).get(peer_username)
+    if peer_id is None:
+        peer = User.query.filter_by(username=peer_username).first()
+        if peer is None:
+            return None
+        peer_id = peer.id
+    if peer_id == current_user.id:
+        return None
+    room = private_room(current_user.id, peer_id)
     join_room(room)
-    print(f'{username} has entered the room: {room}')
+    sid_private_rooms.setdefault(request.sid, {})[room] = (peer_id, peer_username)
+    current_app.logger.debug('%s has entered the room: %s', current_user.username, room)
+    return {'room': room}
 
 @socketio.on('leave')
 def on_leave(data):
     """User leaves a private chat room"""
-    username = data['username']
-    room = data['room']
-    leave_room(room)
-    print(f'{username} has left the room: {room}')
+    room = data.get('room')
+    if sid_private_rooms.get(request.sid, {}).pop(room, None) is not None:
+        leave_room(room)
+        current_app.logger.debug('%s has left the room: %s', current_user.username, room)
 
 @socketio.on('private_message')
 def handle_private_message(data):
     """Handles sending and storing private messages."""
-    room = data['room']
-    message_body = data['message']
-    
-    sender = User.query.filter_by(username=data['sender']).first()
-    recipient = User.query.filter_by(username=data['recipient']).first()
-
-    if not sender or not recipient:
-        return # Should not happen
-
-    # Save message to database
-    msg = Message(author=sender, recipient=recipient, body=message_body)
-    db.session.add(msg)
-    db.session.commit()
+    room = data.get('room')
+    message_body = str(data.get('message', '')).strip()[:500]
+
+    # Only rooms this sid joined through on_join are accepted; the sender is
+    # the logged-in user and the recipient comes from the join.
+    joined = sid_private_rooms.get(request.sid, {}).get(room)
+    if joined is None:
+        emit('private_message_error', {'message': 'You are not in this conversation. Please reload the page.'})
+        return
+    if not message_body:
+        return
+    recipient_id, recipient_username = joined
+
+    # Save message to database (now, or queued for the next batch)
+    timestamp = datetime.utcnow()
+    if not message_writer.submit(current_user.id, recipient_id, message_body, timestamp):
+        emit('private_message_error', {'message': 'Server busy, message not sent. Please retry.'})
+        return
+    # Written in the background, so the history page must not read a lagging replica yet
+    replicas.stick(current_user.id)
 
     # Emit message to the room
-    payload = {
-        'message': message_body,
-        'sender': sender.username,
-        'recipient': recipient.username,
-        'timestamp': msg.timestamp.strftime('%b %d, %I:%M %p')
-    }
-    emit('new_private_message', payload, room=room)
-    print(f"Message sent from {sender.username} to {recipient.username} in room {room}")
+    wire.private_message(room, current_user, recipient_username, message_body, timestamp)
+    notifier.notify(recipient_id, 'message', {
+        'text': f"{current_user.username}: {message_body[:80]}",
+        'url': url_for('main.private_chat', username=current_user.username)
+    })
+    current_app.logger.debug('Message sent from %s to %s in room %s', current_user.username, recipient_username, room)
+
+@socketio.on('mark_read')
+def on_mark_read(data):
+    """The reader has seen everything in the conversation; clear unread and send a receipt."""
+    room = data.get('room')
+    joined = sid_private_rooms.get(request.sid, {}).get(room)
+    if joined is None:
+        return
+    conversation = Conversation.between(current_user.id, joined[0])
+    if not conversation:
+        return
+    read_at = datetime.utcnow()
+    conversation.mark_read(current_user.id, read_at)
+    db.session.commit()
+    emit('messages_read', {'reader': current_user.username,
+                           'read_at': read_at.strftime('%b %d, %I:%M %p')}, room=room)
 
 # Video call page route
 @main.route("/call/<username>")
@@ -287,66 +645,83 @@ def video_call(username):
     if recipient == current_user:
         flash("You cannot start a call with yourself.", "danger")
         return redirect(url_for('main.messages'))
-    return render_template('video_call.html', title=f'Video Call with {username}', recipient=recipient)
+    return render_template('video_call.html', title=f'Video Call with {username}', recipient=recipient,
+                           ice_batch_ms=call_rooms.ice_batch_ms)
 
 
-# --- SocketIO Event Handlers for WebRTC Signaling (IMPROVED LOGIC) ---
+# --- SocketIO Event Handlers for WebRTC Signaling ---
 
 @socketio.on('join_call')
 def on_join_call(data):
     """
-    A user joins a room for a specific video call.
-    This new logic ensures two peers are connected before starting the offer process.
+    Join the call with data['username']. The room is derived from both user
+    ids; the reply carries it along with the ICE servers to use. When the
+    second peer arrives both get 'peers_connected' and the first joiner
+    makes the offer.
     """
-    room = data['room']
+    peer_username = data.get('username')
+    peer_id = session.get('chat_peers', {}).get(peer_username)
+    if peer_id is None:
+        peer = User.query.filter_by(username=peer_username).first()
+        if peer is None:
+            return None
+        peer_id = peer.id
+    if peer_id == current_user.id:
+        return None
+    room = call_room(current_user.id, peer_id)
+
+    # Add peer to the shared call state (atomic across workers)
+    members = call_rooms.join(room, request.sid)
+    if len(members) > 2:
+        call_rooms.leave(room, request.sid)
+        return {'error': 'This call already has two participants.'}
     join_room(room)
-    
-    # Add peer to our room state
-    if room not in call_rooms:
-        call_rooms[room] = []
-    call_rooms[room].append(request.sid)
 
-    print(f"{current_user.username} (SID: {request.sid}) has joined the call room: {room}")
+    current_app.logger.debug('%s (SID: %s) has joined the call room: %s', current_user.username, request.sid, room)
 
     # When two peers have joined, signal them to get ready.
-    if len(call_rooms[room]) == 2:
-        # Emit to both peers that they are connected and can start preparing.
-        emit('peers_connected', {'peer1': call_rooms[room][0], 'peer2': call_rooms[room][1]}, room=room)
-        print(f"Two peers connected in room {room}. Signalling them to prepare.")
+    if len(members) == 1:
+        # Ring the other user wherever they are; queued as a missed call if offline
+        notifier.notify(peer_id, 'call', {
+            'text': f"Video call from {current_user.username}",
+            'url': url_for('main.video_call', username=current_user.username)
+        })
+    if len(members) == 2:
+        emit('peers_connected', {'peer1': members[0], 'peer2': members[1]}, room=room)
+        current_app.logger.debug('Two peers connected in room %s', room)
+
+    return {'room': room,
+            'state': call_rooms.state(room),
+            'ice_servers': call_rooms.ice_servers(current_user.id)}
 
 @socketio.on('webrtc_signal')
 def on_webrtc_signal(data):
     """
-    Generic handler to relay any WebRTC signal (offer, answer, ice-candidate)
-    to the other peer in the room.
+    Relay a WebRTC signal (offer, answer or a batch of ICE candidates) to
+    the other peer in the call. Only members of the call may signal in it.
     """
-    room = data['room']
-    signal = data['signal']
-    
-    # Find the other peer's SID
-    if room in call_rooms and len(call_rooms[room]) == 2:
-        peer1_sid, peer2_sid = call_rooms[room]
-        target_sid = peer2_sid if request.sid == peer1_sid else peer1_sid
+    room = data.get('room')
+    signal = data.get('signal')
+    kind = signal.get('type') if isinstance(signal, dict) else None
+    if kind not in SIGNAL_TYPES:
+        kind = 'other'
+    frames = len(signal.get('candidates') or ()) if kind == 'candidates' else 1
+
+    members = call_rooms.relay(room, request.sid, frames)
+    if len(members) == 2 and request.sid in members:
+        target_sid = members[1] if request.sid == members[0] else members[0]
         emit('webrtc_signal', signal, room=target_sid)
-        # print(f"Relaying signal from {request.sid} to {target_sid} in room {room}")
+        metrics.inc('flasksocial_call_signals_relayed_total', (kind,), frames)
 
 @socketio.on('leave_call')
 def on_leave_call(data):
-    """A user intentionally leaves a video call room."""
-    room = data['room']
-    leave_room(room)
-    
-    # Notify the other peer that the user has left
-    if room in call_rooms:
+    """A user intentionally leaves (hangs up) a video call."""
+    room = data.get('room')
+    if room not in call_rooms.rooms_for(request.sid):
+        return
+    # Notify the other peer that the user has left, then drop the call state
+    if call_rooms.end(room, 'hangup'):
         emit('peer_left', {'peer': current_user.username}, room=room, skip_sid=request.sid)
-        # Clean up the room state
-        if room in call_rooms:
-            del call_rooms[room]
+        close_room(room)
 
-    print(f"{current_user.username} has left the call room: {room}")
-
-@socketio.on('disconnect')
-def handle_disconnect():
-    username = getattr(current_user, 'username', 'User')
-    print(f'{username} disconnected.')
-    emit('message_response', {'message': f'{username} has left the chat.', 'username': 'System'}, broadcast=True)
+    current_app.logger.debug('%s has left the call room: %s', current_user.username, room)
@@ -0,0 +1,428 @@
+"""
+Request, Socket.IO and database instrumentation, served on /metrics in
+the Prometheus text format.
+
+Recorded for every blueprint route and every Socket.IO event:
+  * latency histograms (per endpoint / per event)
+  * number of SQL statements and time spent in them (engine events)
+  * frames emitted, per event name
+and for each engine's connection pool (primary and any read replicas):
+how long checkouts waited and how many timed out, plus gauges of its
+size, its limit with overflow and connections in use, read when scraped.
+Application code counts through Metrics.inc / Metrics.observe (WebRTC
+signals relayed per type and per call, background task failures and
+dropped items per task), which do nothing when disabled.
+
+Metrics live in this process. With several workers set METRICS_DIR to a
+directory they share: each worker writes a snapshot there every
+METRICS_SNAPSHOT_INTERVAL seconds and /metrics adds them all up, so any
+worker can answer a scrape. A snapshot not rewritten for three intervals
+is from a worker that has gone away: its counters and histograms are
+folded into _archive.json, which stays in the sum so totals never go
+down (Prometheus would read that as a reset), and its gauges are dropped.
+
+With METRICS_PROFILE_SLOW_MS > 0, requests and events run under cProfile
+and any that take longer than that are dumped to METRICS_PROFILE_DIR as
+.prof files (open with `python -m pstats` or snakeviz). Only one runs
+under the profiler at a time; under eventlet/gevent a dump can include
+other green threads that ran on the same OS thread meanwhile.
+"""
+import cProfile
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CALL_SIGNAL_BUCKETS = (0, 10, 25, 50, 100, 250, 500, 1000)
+# Worker snapshots not rewritten for this many intervals are archived
+STALE_SNAPSHOT_INTERVALS = 3
+ARCHIVE_SNAPSHOT = '_archive.json'   # exited workers' counters and histograms
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 20.0)
+
+
+class Registry:
+    """Counters, histograms and gauges keyed by label values, in this process."""
+
+    def __init__(self):
+        self._metrics = {}   # name -> {'type', 'help', 'labels', 'buckets', 'series': {labels: value}}
+        self._lock = threading.Lock()
+
+    def define(self, name, kind, help, labels=(), buckets=None):
+        self._metrics[name] = {'type': kind, 'help': help, 'labels': list(labels),
+                               'buckets': list(buckets) if buckets else None, 'series': {}}
+
+    def inc(self, name, labels=(), amount=1):
+        with self._lock:
+            series = self._metrics[name]['series']
+            series[labels] = series.get(labels, 0) + amount
+
+    def set(self, name, labels=(), value=0):
+        with self._lock:
+            self._metrics[name]['series'][labels] = value
+
+    def observe(self, name, value, labels=()):
+        metric = self._metrics[name]
+        with self._lock:
+            # [per-bucket counts..., +Inf count, sum]
+            data = metric['series'].get(labels)
+            if data is None:
+                data = metric['series'][labels] = [0] * (len(metric['buckets']) + 2)
+            data[bisect_left(metric['buckets'], value)] += 1
+            data[-1] += value
+
+    def snapshot(self):
+        """JSON-able copy of every metric."""
+        with self._lock:
+            return {name: dict(metric, series=[[list(labels), value if not isinstance(value, list) else list(value)]
+                                               for labels, value in metric['series'].items()])
+                    for name, metric in self._metrics.items()}
+
+
+def merge(snapshots):
+    """Add up snapshots from several processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, series={}))
+            for labels, value in metric['series']:
+                key = tuple(labels)
+                current = target['series'].get(key)
+                if current is None:
+                    target['series'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['series'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['series'][key] = current + value
+    return merged
+
+
+def as_snapshot(metrics):
+    """merge() output back in the JSON-able form of Registry.snapshot()."""
+    return {name: dict(metric, series=[[list(labels), value] for labels, value in metric['series'].items()])
+            for name, metric in metrics.items()}
+
+
+def _pid_alive(pid):
+    # A worker stalled for a few intervals still has its totals to write;
+    # archiving its snapshot now would count them twice
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass   # alive, run by another user
+    return True
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render(metrics):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric['series'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_label_text(metric['labels'], labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_label_text(metric['labels'], labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(metric['labels'], labels)} {value[-1]}")
+            lines.append(f"{name}_count{_label_text(metric['labels'], labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Flask extension: hooks requests, Socket.IO events and the engine into a Registry."""
+
+    def __init__(self):
+        self.app = None
+        self.registry = Registry()
+        self._current = threading.local()   # per thread / green thread: stats of the running request
+        self._profile_lock = threading.Lock()
+        self._pools = {}   # engine name -> pool
+        self._started = False
+        self.enabled = False
+
+    def init_app(self, app):
+        from app import db
+        self.app = app
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.token = app.config.get('METRICS_TOKEN')
+        self.directory = app.config.get('METRICS_DIR')
+        self.snapshot_interval = app.config.get('METRICS_SNAPSHOT_INTERVAL', 5)
+        self.slow_ms = app.config.get('METRICS_PROFILE_SLOW_MS', 0)
+        self.profile_dir = app.config.get('METRICS_PROFILE_DIR', 'profiles')
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        r = self.registry
+        r.define('flasksocial_http_request_duration_seconds', 'histogram',
+                 'Time spent handling HTTP requests.', ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+        r.define('flasksocial_socketio_event_duration_seconds', 'histogram',
+                 'Time spent handling Socket.IO events.', ('event',), LATENCY_BUCKETS)
+        r.define('flasksocial_db_queries', 'histogram',
+                 'SQL statements run per request or event.', ('handler',), QUERY_COUNT_BUCKETS)
+        r.define('flasksocial_db_query_duration_seconds', 'histogram',
+                 'Time spent in SQL per request or event.', ('handler',), LATENCY_BUCKETS)
+        r.define('flasksocial_db_pool_wait_seconds', 'histogram',
+                 'Time spent waiting for a database connection from the pool.', ('engine',), POOL_WAIT_BUCKETS)
+        r.define('flasksocial_db_pool_timeouts_total', 'counter',
+                 'Connection checkouts that gave up after pool_timeout.', ('engine',))
+        r.define('flasksocial_db_pool_size', 'gauge', 'Configured connection pool size.', ('engine',))
+        r.define('flasksocial_db_pool_max_connections', 'gauge',
+                 'Connections the pool may open, overflow included.', ('engine',))
+        r.define('flasksocial_db_pool_checked_out', 'gauge',
+                 'Connections currently checked out of the pool.', ('engine',))
+        r.define('flasksocial_socketio_frames_emitted_total', 'counter',
+                 'Socket.IO emit calls, by event name.', ('event',))
+        r.define('flasksocial_slow_requests_profiled_total', 'counter',
+                 'Requests/events over METRICS_PROFILE_SLOW_MS that were dumped to a profile.')
+        r.define('flasksocial_call_signals_relayed_total', 'counter',
+                 'WebRTC signalling frames forwarded between call peers, ICE candidates counted one by one.',
+                 ('type',))
+        r.define('flasksocial_background_failures_total', 'counter',
+                 'Runs of a background task that raised; the traceback is in the log.', ('task',))
+        r.define('flasksocial_background_items_dropped_total', 'counter',
+                 'Items a background task gave up on: turned away by a full queue or never writable.',
+                 ('task',))
+        r.define('flasksocial_call_signals', 'histogram',
+                 'Signalling frames relayed per call, observed when the call ends.', ('reason',),
+                 CALL_SIGNAL_BUCKETS)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            for key, engine in db.engines.items():
+                self.instrument_engine(engine, 'primary' if key is None else key)
+
+    # -------------------- HOOKS --------------------
+
+    def instrument_engine(self, engine, name='primary'):
+        """Count statements per handler and time pool checkouts for one engine."""
+        from sqlalchemy import event
+        from sqlalchemy.exc import TimeoutError
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info['metrics_started'].pop()
+            stats = getattr(self._current, 'stats', None)
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - started
+
+        # Pool has no "about to wait" event, so time the call that hands out connections
+        pool = engine.pool
+        connect = pool.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            except TimeoutError:
+                self.registry.inc('flasksocial_db_pool_timeouts_total', (name,))
+                raise
+            finally:
+                self.registry.observe('flasksocial_db_pool_wait_seconds', time.perf_counter() - started, (name,))
+
+        pool.connect = timed_connect
+        self._pools[name] = pool
+
+    def inc(self, name, labels=(), amount=1):
+        """Count from application code; does nothing with metrics disabled."""
+        if self.enabled:
+            self.registry.inc(name, labels, amount)
+
+    def observe(self, name, value, labels=()):
+        """Observe from application code; does nothing with metrics disabled."""
+        if self.enabled:
+            self.registry.observe(name, value, labels)
+
+    def instrument_socketio(self, socketio):
+        """Wrap every registered event handler and count emits. Call after the handlers are registered."""
+        if not self.enabled:
+            return
+        server = socketio.server
+        for namespace, handlers in server.handlers.items():
+            for event_name, handler in list(handlers.items()):
+                handlers[event_name] = self._timed_handler(event_name, handler)
+
+        emit = server.emit
+
+        def counted_emit(event_name, *args, **kwargs):
+            self.registry.inc('flasksocial_socketio_frames_emitted_total', (event_name,))
+            return emit(event_name, *args, **kwargs)
+
+        server.emit = counted_emit
+
+    def _timed_handler(self, event_name, handler):
+        def timed(*args):
+            token = self._begin()
+            try:
+                return handler(*args)
+            finally:
+                elapsed, queries, query_time = self._end(token, f"event:{event_name}")
+                self.registry.observe('flasksocial_socketio_event_duration_seconds', elapsed, (event_name,))
+                self._observe_db(f"event:{event_name}", queries, query_time)
+        return timed
+
+    def _before_request(self):
+        from flask import g, request
+        if request.endpoint != 'static':
+            g.metrics_token = self._begin()
+
+    def _after_request(self, response):
+        from flask import g, request
+        token = g.pop('metrics_token', None)
+        if token is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        elapsed, queries, query_time = self._end(token, endpoint)
+        self.registry.observe('flasksocial_http_request_duration_seconds', elapsed,
+                              (endpoint, request.method, str(response.status_code)))
+        self._observe_db(endpoint, queries, query_time)
+        return response
+
+    def _observe_db(self, handler, queries, query_time):
+        self.registry.observe('flasksocial_db_queries', queries, (handler,))
+        self.registry.observe('flasksocial_db_query_duration_seconds', query_time, (handler,))
+
+    # -------------------- PER-REQUEST STATE --------------------
+
+    def _begin(self):
+        self._ensure_started()
+        previous = getattr(self._current, 'stats', None)
+        self._current.stats = [0, 0.0]
+        profiler = None
+        if self.slow_ms and self._profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:   # another profiler is active on this thread
+                self._profile_lock.release()
+                profiler = None
+        return (time.perf_counter(), previous, profiler)
+
+    def _end(self, token, name):
+        started, previous, profiler = token
+        elapsed = time.perf_counter() - started
+        queries, query_time = self._current.stats
+        self._current.stats = previous
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+            if elapsed * 1000 >= self.slow_ms:
+                self._dump_profile(profiler, name, elapsed)
+        return elapsed, queries, query_time
+
+    def _dump_profile(self, profiler, name, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() else '_' for c in name)
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{int(elapsed * 1000)}ms.prof")
+        profiler.dump_stats(path)
+        self.registry.inc('flasksocial_slow_requests_profiled_total')
+        self.app.logger.warning('%s took %.0f ms, profile written to %s', name, elapsed * 1000, path)
+
+    # -------------------- EXPOSITION --------------------
+
+    def collect(self):
+        """Text for /metrics: this process, or every worker's snapshot when METRICS_DIR is set."""
+        self._update_gauges()
+        if not self.directory:
+            return render(merge([self.registry.snapshot()]))
+        self.write_snapshot()
+        # Live workers rewrite theirs every snapshot_interval; anything much
+        # older whose process is gone belongs to a worker that has exited
+        stale_before = time.time() - STALE_SNAPSHOT_INTERVALS * self.snapshot_interval
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith('.json') and filename != ARCHIVE_SNAPSHOT:
+                try:
+                    if os.path.getmtime(path) < stale_before and not _pid_alive(filename[:-len('.json')]):
+                        self._archive_snapshot(path)
+                except OSError:
+                    continue   # archived by another worker meanwhile
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue   # being replaced or archived right now, or a dead worker's partial file
+        return render(merge(snapshots))
+
+    def _archive_snapshot(self, path):
+        """Fold an exited worker's counters and histograms into the archive and remove its snapshot."""
+        archive = os.path.join(self.directory, ARCHIVE_SNAPSHOT)
+        with open(os.path.join(self.directory, 'archive.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)   # one worker at a time, so nothing is folded in twice
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                return   # another worker got there first
+            except ValueError:
+                snapshot = {}   # partial file from a worker killed mid-write
+            snapshots = [{name: metric for name, metric in snapshot.items() if metric['type'] != 'gauge'}]
+            if os.path.exists(archive):
+                with open(archive) as f:
+                    snapshots.append(json.load(f))
+            tmp = archive + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(as_snapshot(merge(snapshots)), f)
+            os.replace(tmp, archive)
+            os.remove(path)
+
+    def write_snapshot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(tmp, path)
+
+    def _update_gauges(self):
+        for name, pool in self._pools.items():
+            if not hasattr(pool, 'size'):
+                continue   # SQLite's single-connection pools have no size
+            self.registry.set('flasksocial_db_pool_size', (name,), pool.size())
+            self.registry.set('flasksocial_db_pool_max_connections', (name,), pool.size() + max(pool._max_overflow, 0))
+            self.registry.set('flasksocial_db_pool_checked_out', (name,), pool.checkedout())
+
+    def _ensure_started(self):
+        # Snapshot writer, started from the first request under the server's async mode
+        if self._started or not self.directory:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            socketio.sleep(self.snapshot_interval)
+            try:
+                self._update_gauges()
+                self.write_snapshot()
+            except Exception:
+                self.inc('flasksocial_background_failures_total', ('metrics_snapshot',))
+                self.app.logger.exception('Failed to write metrics snapshot')
@@ -1,10 +1,13 @@
-from app import db, login_manager
+from app import db, login_manager, identity_cache
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import and_, or_, select, union_all
+from sqlalchemy.orm import joinedload
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Cached snapshot, so most requests and socket events skip the users table
+    return identity_cache.load(int(user_id))
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +15,8 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
     password_hash = db.Column(db.String(60), nullable=False)
+    # Denormalized; decides whether this user's posts are fanned out (see app/timelines.py)
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy=True)
     
     # Relationships for private messages
@@ -33,13 +38,310 @@ class Post(db.Model):
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # Denormalized engagement totals, written in coalesced batches (see app/counters.py)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    view_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Composite indexes backing keyset pagination of the feed and of one
+    # author's posts (see app/pagination.py)
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+    )
+
+class PostLike(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_post_like_post_id', 'post_id'),
+    )
+
+class Comment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    body = db.Column(db.String(500), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    author = db.relationship('User', lazy='joined')
+
+    # Keyset pagination of a post's comments
+    __table_args__ = (
+        db.Index('ix_comment_post_id_timestamp_id', 'post_id', 'timestamp', 'id'),
+    )
+
+class Follow(db.Model):
+    follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # The primary key answers "who do I follow"; this one "who follows me" for fan-out
+    __table_args__ = (
+        db.Index('ix_follow_followed_id_follower_id', 'followed_id', 'follower_id'),
+    )
+
+# One post in one user's personal timeline, written when the post is
+# published (fan-out on write). date_posted is copied from the post so a
+# timeline page is a range scan on a single index.
+class TimelineEntry(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    date_posted = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_timeline_entry_user_id_date_posted_post_id', 'user_id', 'date_posted', 'post_id'),
+        # For removing a deleted post from every timeline
+        db.Index('ix_timeline_entry_post_id', 'post_id'),
+    )
+
+# A private conversation between two users, stored as an ordered pair
+# (user1_id < user2_id) so each pair maps to exactly one row.
+# It also keeps a denormalized inbox summary (last message, unread counts,
+# read receipts) that is updated as messages are sent and read.
+class Conversation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user1_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user2_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    last_message_at = db.Column(db.DateTime)
+    last_message_preview = db.Column(db.String(100))
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user1_unread = db.Column(db.Integer, nullable=False, default=0)
+    user2_unread = db.Column(db.Integer, nullable=False, default=0)
+    user1_last_read_at = db.Column(db.DateTime)
+    user2_last_read_at = db.Column(db.DateTime)
+
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic')
+    user1 = db.relationship('User', foreign_keys=[user1_id])
+    user2 = db.relationship('User', foreign_keys=[user2_id])
+
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id', name='uq_conversation_pair'),
+        db.CheckConstraint('user1_id < user2_id', name='ck_conversation_ordered'),
+        # One index per side; an inbox page merges an ordered range scan of each
+        db.Index('ix_conversation_user1_last_message', 'user1_id', 'last_message_at', 'id'),
+        db.Index('ix_conversation_user2_last_message', 'user2_id', 'last_message_at', 'id'),
+    )
+
+    @staticmethod
+    def pair(user_a_id, user_b_id):
+        return (user_a_id, user_b_id) if user_a_id < user_b_id else (user_b_id, user_a_id)
+
+    @classmethod
+    def between(cls, user_a_id, user_b_id):
+        user1_id, user2_id = cls.pair(user_a_id, user_b_id)
+        return cls.query.filter_by(user1_id=user1_id, user2_id=user2_id).first()
+
+    @classmethod
+    def get_or_create(cls, user_a_id, user_b_id):
+        """Return the conversation for this pair, adding it to the session if new."""
+        conversation = cls.between(user_a_id, user_b_id)
+        if conversation is None:
+            user1_id, user2_id = cls.pair(user_a_id, user_b_id)
+            conversation = cls(user1_id=user1_id, user2_id=user2_id)
+            db.session.add(conversation)
+            db.session.flush()
+        return conversation
+
+    @classmethod
+    def counterparts(cls, user_id, candidate_ids):
+        """The ids among candidate_ids that user_id has a conversation with."""
+        candidate_ids = list(candidate_ids)
+        if not candidate_ids:
+            return set()
+        rows = db.session.execute(select(cls.user1_id, cls.user2_id).where(or_(
+            and_(cls.user1_id == user_id, cls.user2_id.in_(candidate_ids)),
+            and_(cls.user2_id == user_id, cls.user1_id.in_(candidate_ids))
+        )))
+        return {user2_id if user1_id == user_id else user1_id for user1_id, user2_id in rows}
+
+    def other_user(self, user_id):
+        return self.user2 if user_id == self.user1_id else self.user1
+
+    def unread_for(self, user_id):
+        return self.user1_unread if user_id == self.user1_id else self.user2_unread
+
+    def last_read_at_for(self, user_id):
+        return self.user1_last_read_at if user_id == self.user1_id else self.user2_last_read_at
+
+    def record_messages(self, msgs):
+        """Update the inbox summary for newly sent messages, oldest first."""
+        last = msgs[-1]
+        self.last_message_at = last.timestamp
+        self.last_message_preview = last.body[:100]
+        self.last_sender_id = last.sender_id
+        # Increment in SQL so concurrent senders don't lose updates
+        to_user1 = sum(1 for m in msgs if m.recipient_id == self.user1_id)
+        to_user2 = len(msgs) - to_user1
+        if to_user1:
+            self.user1_unread = Conversation.user1_unread + to_user1
+        if to_user2:
+            self.user2_unread = Conversation.user2_unread + to_user2
+
+    def mark_read(self, user_id, when=None):
+        """Clear user_id's unread count and record when they last read."""
+        when = when or datetime.utcnow()
+        if user_id == self.user1_id:
+            self.user1_unread = 0
+            self.user1_last_read_at = when
+        else:
+            self.user2_unread = 0
+            self.user2_last_read_at = when
+
+    @classmethod
+    def inbox_query(cls, user_id, before=None, limit=20):
+        """
+        Up to `limit` conversations with at least one message that user_id
+        takes part in, most recently active first, older than `before`
+        ((last_message_at, id)) if given.
+
+        user_id can be on either side of the pair, and OR-ing the two can't
+        be answered in order from one index. Each side is its own ordered,
+        limited range scan instead, and only those rows are merged.
+        """
+        sides = []
+        for column in (cls.user1_id, cls.user2_id):
+            side = select(cls.id).where(column == user_id, cls.last_message_at.isnot(None))
+            if before is not None:
+                when, row_id = before
+                side = side.where(or_(cls.last_message_at < when,
+                                      and_(cls.last_message_at == when, cls.id < row_id)))
+            side = side.order_by(cls.last_message_at.desc(), cls.id.desc()).limit(limit)
+            sides.append(select(side.subquery()))
+        ids = union_all(*sides).subquery()
+        return cls.query.join(ids, cls.id == ids.c.id)\
+                        .options(joinedload(cls.user1), joinedload(cls.user2))\
+                        .order_by(cls.last_message_at.desc(), cls.id.desc()).limit(limit)
+
+    def __repr__(self):
+        return f"Conversation({self.user1_id}, {self.user2_id})"
+
 # NEW MODEL for private messages
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     body = db.Column(db.String(500), nullable=False)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # On Postgres also the key `message` is partitioned by, month by month;
+    # the primary key there is (id, timestamp) (see app/retention.py)
+    timestamp = db.Column(db.DateTime, index=True, nullable=False, default=datetime.utcnow)
+
+    # History pages are range scans on this index (see app/pagination.py)
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
-        return f'Message: {self.body}'
\ No newline at end of file
+        return f'Message: {self.body}'
+
+
+class MessageArchive(db.Model):
+    """A compressed run of one conversation's old messages (see app/retention.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    # (timestamp, id) of the oldest and newest message in the chunk
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    first_id = db.Column(db.Integer, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)   # zlib-compressed JSON rows, oldest first
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Chunks never overlap, so older history pages walk this index backwards
+    __table_args__ = (
+        db.Index('ix_message_archive_conversation_first', 'conversation_id', 'first_timestamp', 'first_id'),
+    )
+
+    def __repr__(self):
+        return f'MessageArchive: {self.message_count} messages of conversation {self.conversation_id}'
+
+
+class ChatMessage(db.Model):
+    """A message in a public chat room (see app/chat_rooms.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    room = db.Column(db.String(32), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    body = db.Column(db.String(500), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    author = db.relationship('User', lazy='joined')
+
+    # Seeding a room's history reads its newest rows
+    __table_args__ = (
+        db.Index('ix_chat_message_room_timestamp_id', 'room', 'timestamp', 'id'),
+    )
+
+    def __repr__(self):
+        return f'ChatMessage: #{self.room} {self.body}'
+
+
+class Notification(db.Model):
+    """A notification queued for a user who was offline when it happened (see app/notifications.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.Text, nullable=False)   # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Delivered oldest first, then deleted
+    __table_args__ = (
+        db.Index('ix_notification_user_id_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'Notification: {self.kind} for {self.user_id}'
+
+
+def backfill_conversations(batch_size=1000):
+    """
+    Attach every message without a conversation_id to the conversation for
+    its sender/recipient pair, creating conversations as needed. Messages
+    missing a sender or recipient, or sent to oneself, belong to no
+    conversation and are left alone. Safe to re-run; returns the number of
+    messages (updated, skipped). Once everything is linked a run is a
+    single EXISTS query and returns (0, 0).
+    """
+    linkable = select(Message.id).where(
+        Message.conversation_id.is_(None), Message.sender_id.isnot(None),
+        Message.recipient_id.isnot(None), Message.sender_id != Message.recipient_id)
+    if not db.session.scalar(select(linkable.exists())):
+        return 0, 0
+
+    updated = skipped = 0
+    last_id = 0
+    touched = set()
+    known = {}   # (user1_id, user2_id) -> conversation id, looked up as pairs come up
+    while True:
+        batch = Message.query.filter(Message.conversation_id.is_(None), Message.id > last_id)\
+                             .order_by(Message.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for msg in batch:
+            if msg.sender_id is None or msg.recipient_id is None or msg.sender_id == msg.recipient_id:
+                skipped += 1
+                continue
+            key = Conversation.pair(msg.sender_id, msg.recipient_id)
+            if key not in known:
+                known[key] = Conversation.get_or_create(*key).id
+            msg.conversation_id = known[key]
+            touched.add(known[key])
+            updated += 1
+        db.session.commit()
+
+    # Fill in the inbox summary; existing history is treated as already read
+    for conversation_id in touched:
+        conversation = Conversation.query.get(conversation_id)
+        last = conversation.messages.order_by(Message.timestamp.desc(), Message.id.desc()).first()
+        conversation.last_message_at = last.timestamp
+        conversation.last_message_preview = last.body[:100]
+        conversation.last_sender_id = last.sender_id
+        conversation.user1_last_read_at = conversation.user2_last_read_at = last.timestamp
+    db.session.commit()
+    return updated, skipped
@@ -0,0 +1,92 @@
+"""
+Per-user notification channel.
+
+Every authenticated socket joins 'user:<id>' when it connects, so anything
+meant for a user (a new private message, an incoming call, a post by
+someone they follow) is a single emit to that room and reaches all of
+their tabs, whatever page they are on.
+
+If the user has no live connection (according to presence) the
+notification is also written to the notification table, in the
+background by NotificationWriter. On the next connect the newest
+NOTIFICATION_BATCH_MAX of them are sent in one 'notifications' frame and
+the user's queue is cleared; anything older is only counted.
+"""
+import json
+from datetime import datetime
+
+from app.write_behind import NotificationWriter
+
+
+def user_room(user_id):
+    """Socket.IO room every connection of a user is in."""
+    return f"user:{user_id}"
+
+
+def notification_to_dict(kind, payload, created_at):
+    return dict(payload, kind=kind, created_at=created_at.strftime('%b %d, %I:%M %p'))
+
+
+class Notifier:
+    """Flask extension: live delivery plus the offline queue."""
+
+    def __init__(self):
+        self.writer = NotificationWriter()
+        self.batch_max = 50
+
+    def init_app(self, app):
+        self.batch_max = app.config.get('NOTIFICATION_BATCH_MAX', 50)
+        self.writer.init_app(app)
+        app.extensions['notifier'] = self
+
+    def notify(self, user_id, kind, payload, queue=True):
+        """
+        Send payload ({'text': ..., 'url': ...}) to every connection of
+        user_id, and queue it for their next connect if they have none.
+        """
+        self.notify_many([user_id], kind, payload, queue)
+
+    def notify_many(self, user_ids, kind, payload, queue=True):
+        """notify() for several users: one emit and one presence lookup."""
+        from app import socketio, presence
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        created_at = datetime.utcnow()
+        socketio.emit('notification', notification_to_dict(kind, payload, created_at),
+                      to=[user_room(user_id) for user_id in user_ids])
+        if not queue:
+            return
+        online = presence.store.online(user_ids)
+        offline = [user_id for user_id in user_ids if user_id not in online]
+        for i, user_id in enumerate(offline):
+            if not self.writer.submit(user_id, kind, payload, created_at):
+                # Full: the rest would each wait out the put timeout as well
+                from app import metrics
+                metrics.inc('flasksocial_background_items_dropped_total', (self.writer.task,),
+                            len(offline) - i - 1)
+                self.writer.app.logger.warning('Notification queue full, dropped %s for %d offline users',
+                                               kind, len(offline) - i)
+                break
+
+    def connected(self, user_id, sid):
+        """Join the user's room and deliver anything queued while they were away."""
+        from flask_socketio import join_room
+        join_room(user_room(user_id), sid=sid)
+        self.deliver_pending(user_id, sid)
+
+    def deliver_pending(self, user_id, sid):
+        from app import db, socketio
+        from app.models import Notification
+
+        rows = (Notification.query.filter_by(user_id=user_id)
+                .order_by(Notification.id.desc()).limit(self.batch_max).all())
+        if not rows:
+            return
+        items = [notification_to_dict(n.kind, json.loads(n.payload), n.created_at) for n in reversed(rows)]
+        # Clears the delivered rows and anything older that did not fit in the batch
+        cleared = (Notification.query
+                   .filter(Notification.user_id == user_id, Notification.id <= rows[0].id)
+                   .delete(synchronize_session=False))
+        db.session.commit()
+        socketio.emit('notifications', {'items': items, 'dropped': cleared - len(rows)}, to=sid)
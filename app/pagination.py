@@ -0,0 +1,143 @@
+import base64
+from datetime import datetime
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
+from app.models import Post, Message, Conversation, Comment
+from app.retention import archived_page
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(when, row_id):
+    """Turn the (timestamp, id) of the last row on a page into an opaque token."""
+    raw = f"{when.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises InvalidCursor for anything malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        date_part, id_part = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def keyset_page(query, time_col, id_col, cursor, per_page):
+    """
+    Return one page of rows ordered newest first by (time_col, id_col), plus
+    the cursor for the next (older) page or None if this is the last one.
+
+    Each page is a single range scan on a (time_col, id_col) index, so the
+    cost stays the same no matter how deep the reader scrolls.
+    """
+    if cursor:
+        when, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            time_col < when,
+            and_(time_col == when, id_col < row_id)
+        ))
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(time_col.desc(), id_col.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, time_col.key), getattr(last, id_col.key))
+    return rows, next_cursor
+
+
+def feed_page(cursor=None, per_page=10, query=None):
+    """
+    One page of posts for the feed, newest first, with authors eager-loaded
+    so templates can read post.author without extra queries.
+    """
+    if query is None:
+        query = Post.query
+    query = query.options(joinedload(Post.author))
+    return keyset_page(query, Post.date_posted, Post.id, cursor, per_page)
+
+
+def message_page(conversation_id, before=None, per_page=50):
+    """
+    One page of a conversation's history, newest first. Pass the returned
+    cursor back as `before` to load older messages. Once the message table
+    runs out the page carries on into the archive (see app/retention.py).
+    """
+    query = Message.query.filter_by(conversation_id=conversation_id)\
+                         .options(joinedload(Message.author))
+    messages, next_cursor = keyset_page(query, Message.timestamp, Message.id, before, per_page)
+    if next_cursor is None:
+        # Archived messages are all older than the ones left in the table
+        if messages:
+            older_than = (messages[-1].timestamp, messages[-1].id)
+        else:
+            older_than = decode_cursor(before) if before else None
+        messages += archived_page(conversation_id, older_than, per_page + 1 - len(messages))
+        if len(messages) > per_page:
+            messages = messages[:per_page]
+            next_cursor = encode_cursor(messages[-1].timestamp, messages[-1].id)
+    return messages, next_cursor
+
+
+def comment_page(post_id, before=None, per_page=20):
+    """One page of a post's comments, newest first; pass the cursor back as `before` for older ones."""
+    query = Comment.query.filter_by(post_id=post_id)
+    return keyset_page(query, Comment.timestamp, Comment.id, before, per_page)
+
+
+def inbox_page(user_id, cursor=None, per_page=20):
+    """
+    One page of user_id's conversations, most recently active first, read
+    straight from the denormalized summary on Conversation.
+    """
+    before = decode_cursor(cursor) if cursor else None
+    # One extra row to know whether another page exists
+    conversations = Conversation.inbox_query(user_id, before, per_page + 1).all()
+    next_cursor = None
+    if len(conversations) > per_page:
+        conversations = conversations[:per_page]
+        last = conversations[-1]
+        next_cursor = encode_cursor(last.last_message_at, last.id)
+    return conversations, next_cursor
+
+
+def post_to_dict(post):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'content': post.content,
+        'date_posted': post.date_posted.isoformat(),
+        'like_count': post.like_count,
+        'comment_count': post.comment_count,
+        'view_count': post.view_count,
+        'author': {
+            'id': post.user_id,
+            'username': post.author.username,
+            'image_file': post.author.image_file,
+        },
+    }
+
+
+def comment_to_dict(comment):
+    return {
+        'id': comment.id,
+        'body': comment.body,
+        'author': comment.author.username,
+        'timestamp': comment.timestamp.strftime('%b %d, %I:%M %p'),
+    }
+
+
+def message_to_dict(message):
+    return {
+        'id': message.id,
+        'message': message.body,
+        'sender': message.author.username,
+        'recipient': message.recipient.username,
+        'timestamp': message.timestamp.strftime('%b %d, %I:%M %p'),
+    }
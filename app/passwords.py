@@ -0,0 +1,105 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (~0.1-0.4 s at 12 rounds) and, run inline in
+an eventlet/gevent worker, freezes every connected socket while it works.
+PasswordHasher runs it on real OS threads instead (bcrypt releases the
+GIL), using the thread pool that matches the server's async mode:
+  * eventlet  - eventlet.tpool
+  * gevent    - a gevent ThreadPool
+  * threading - a ThreadPoolExecutor
+
+At most PASSWORD_HASH_WORKERS hashes run at once and at most
+PASSWORD_HASH_QUEUE_MAX more may wait; beyond that, and beyond
+PASSWORD_HASH_PER_IP concurrent hashes from one client, calls raise
+HasherBusy instead of piling up. With PASSWORD_HASH_WORKERS = 0 hashing
+runs inline.
+
+The cost comes from BCRYPT_LOG_ROUNDS. Hashes made with a different cost
+are replaced on the next successful login (see needs_rehash).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HasherBusy(RuntimeError):
+    """Too many hashes are queued, globally or for one client."""
+
+
+def hash_rounds(pw_hash):
+    """Cost factor of a bcrypt hash such as '$2b$12$...'."""
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.workers = 0
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pending_by_ip = {}
+
+    def init_app(self, app):
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 2)
+        self.queue_max = app.config.get('PASSWORD_HASH_QUEUE_MAX', 32)
+        self.per_ip = app.config.get('PASSWORD_HASH_PER_IP', 2)
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1))
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password, client=None):
+        from app import bcrypt
+        return self._run(client, lambda: bcrypt.generate_password_hash(password, self.rounds).decode('utf-8'))
+
+    def check(self, pw_hash, password, client=None):
+        from app import bcrypt
+        return self._run(client, lambda: bcrypt.check_password_hash(pw_hash, password))
+
+    def needs_rehash(self, pw_hash):
+        return hash_rounds(pw_hash) != self.rounds
+
+    def _run(self, client, fn):
+        if not self.workers:
+            return fn()
+
+        with self._lock:
+            if self._pending >= self.workers + self.queue_max:
+                raise HasherBusy('Password hashing queue is full')
+            if client is not None and self._pending_by_ip.get(client, 0) >= self.per_ip:
+                raise HasherBusy(f'Too many concurrent password checks from {client}')
+            self._pending += 1
+            if client is not None:
+                self._pending_by_ip[client] = self._pending_by_ip.get(client, 0) + 1
+        try:
+            with self._slots:
+                return self._execute(fn)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                if client is not None:
+                    remaining = self._pending_by_ip[client] - 1
+                    if remaining:
+                        self._pending_by_ip[client] = remaining
+                    else:
+                        del self._pending_by_ip[client]
+
+    def _execute(self, fn):
+        from app import socketio
+        async_mode = socketio.server.eio.async_mode
+        if async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(fn)
+        with self._lock:
+            if self._pool is None:
+                if async_mode == 'gevent':
+                    from gevent.threadpool import ThreadPool
+                    self._pool = ThreadPool(self.workers)
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='password-hash')
+        if async_mode == 'gevent':
+            return self._pool.apply(fn)
+        return self._pool.submit(fn).result()
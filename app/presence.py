@@ -0,0 +1,234 @@
+"""
+Who is online, delivered only to the pages that show it.
+
+Each user has a set of live Socket.IO sids with a last-seen time; the
+user is online while the set is non-empty. Sids are added on connect,
+refreshed by the client's 'heartbeat' event and removed on disconnect or
+when no heartbeat arrived for PRESENCE_TIMEOUT seconds (a worker that
+died never sends its disconnects).
+
+Pages that show a presence dot (the inbox, a private chat) emit
+'watch_presence' with the user ids they display and join one room per
+user, 'presence:<id>'. Changes are collected for PRESENCE_DEBOUNCE_MS and
+then emitted once per user to that room, and only if the state actually
+differs from where the window started, so a reload (disconnect followed
+by connect) sends nothing.
+
+Selected with Config.PRESENCE_STORE, like the call room store:
+  * 'memory' - dicts in this process; only correct with a single worker
+  * 'redis'  - sorted sets in a Redis-compatible server shared by workers
+"""
+import threading
+import time
+
+
+def presence_room(user_id):
+    return f"presence:{user_id}"
+
+
+class MemoryPresenceStore:
+    def __init__(self):
+        self._sids = {}   # user_id -> {sid: last_seen}
+        self._lock = threading.Lock()
+
+    def connect(self, user_id, sid, now):
+        """Record a live sid. Returns True if the user just came online."""
+        with self._lock:
+            sids = self._sids.setdefault(user_id, {})
+            came_online = not sids
+            sids[sid] = now
+            return came_online
+
+    heartbeat = connect
+
+    def disconnect(self, user_id, sid):
+        """Forget a sid. Returns True if that was the user's last one."""
+        with self._lock:
+            sids = self._sids.get(user_id)
+            if not sids or sids.pop(sid, None) is None:
+                return False
+            if not sids:
+                del self._sids[user_id]
+                return True
+            return False
+
+    def expire(self, cutoff):
+        """Drop sids not seen since cutoff; returns users that went offline."""
+        offline = []
+        with self._lock:
+            for user_id, sids in list(self._sids.items()):
+                for sid, last_seen in list(sids.items()):
+                    if last_seen < cutoff:
+                        del sids[sid]
+                if not sids:
+                    del self._sids[user_id]
+                    offline.append(user_id)
+        return offline
+
+    def online(self, user_ids):
+        with self._lock:
+            return {user_id for user_id in user_ids if self._sids.get(user_id)}
+
+
+class RedisPresenceStore:
+    # KEYS: user's sid zset, global "user|sid" zset. ARGV: sid, now, user_id
+    CONNECT_SCRIPT = """
+    local before = redis.call('ZCARD', KEYS[1])
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3] .. '|' .. ARGV[1])
+    if before == 0 then return 1 end
+    return 0
+    """
+
+    DISCONNECT_SCRIPT = """
+    local removed = redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[2] .. '|' .. ARGV[1])
+    if removed == 1 and redis.call('ZCARD', KEYS[1]) == 0 then return 1 end
+    return 0
+    """
+
+    # KEYS: global zset. ARGV: cutoff, user key prefix
+    EXPIRE_SCRIPT = """
+    local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+    local offline = {}
+    for _, entry in ipairs(stale) do
+        local sep = string.find(entry, '|', 1, true)
+        local user_id = string.sub(entry, 1, sep - 1)
+        local user_key = ARGV[2] .. user_id
+        redis.call('ZREM', KEYS[1], entry)
+        if redis.call('ZREM', user_key, string.sub(entry, sep + 1)) == 1
+                and redis.call('ZCARD', user_key) == 0 then
+            table.insert(offline, user_id)
+        end
+    end
+    return offline
+    """
+
+    def __init__(self, url, key_prefix='flasksocial:presence:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("PRESENCE_STORE='redis' requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self._all_key = key_prefix + 'sids'
+        self._connect = self._client.register_script(self.CONNECT_SCRIPT)
+        self._disconnect = self._client.register_script(self.DISCONNECT_SCRIPT)
+        self._expire = self._client.register_script(self.EXPIRE_SCRIPT)
+        for script in (self._connect, self._disconnect, self._expire):
+            self._client.script_load(script.script)
+
+    def _user_key(self, user_id):
+        return f"{self.key_prefix}user:{user_id}"
+
+    def connect(self, user_id, sid, now):
+        return bool(self._connect(keys=[self._user_key(user_id), self._all_key],
+                                  args=[sid, now, user_id]))
+
+    heartbeat = connect
+
+    def disconnect(self, user_id, sid):
+        return bool(self._disconnect(keys=[self._user_key(user_id), self._all_key],
+                                     args=[sid, user_id]))
+
+    def expire(self, cutoff):
+        offline = self._expire(keys=[self._all_key], args=[cutoff, self._user_key('')])
+        return [int(user_id) for user_id in offline]
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        pipe = self._client.pipeline()
+        for user_id in user_ids:
+            pipe.zcard(self._user_key(user_id))
+        return {user_id for user_id, count in zip(user_ids, pipe.execute()) if count}
+
+
+class Presence:
+    """Flask extension: store selection, debounced delivery and expiry."""
+
+    def __init__(self):
+        self.app = None
+        self.store = MemoryPresenceStore()
+        self._pending = {}   # user_id -> online state when the window opened
+        self._lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        store_type = app.config.get('PRESENCE_STORE', 'memory')
+        if store_type == 'memory':
+            self.store = MemoryPresenceStore()
+        elif store_type == 'redis':
+            self.store = RedisPresenceStore(app.config['PRESENCE_REDIS_URL'])
+        else:
+            raise ValueError(f"Unknown PRESENCE_STORE: {store_type}")
+        self.heartbeat_interval = app.config.get('PRESENCE_HEARTBEAT_INTERVAL', 25)
+        self.timeout = app.config.get('PRESENCE_TIMEOUT', 70)
+        self.debounce = app.config.get('PRESENCE_DEBOUNCE_MS', 2000) / 1000.0
+        self.max_watch = app.config.get('PRESENCE_MAX_WATCH', 100)
+        app.extensions['presence'] = self
+
+    def connected(self, user_id, sid):
+        self._ensure_started()
+        if self.store.connect(user_id, sid, time.time()):
+            self._changed(user_id, True)
+
+    def disconnected(self, user_id, sid):
+        if self.store.disconnect(user_id, sid):
+            self._changed(user_id, False)
+
+    def heartbeat(self, user_id, sid):
+        # Also revives a sid that was expired while the client was stalled
+        if self.store.heartbeat(user_id, sid, time.time()):
+            self._changed(user_id, True)
+
+    def watch(self, sid, user_ids):
+        """Subscribe sid to presence changes of user_ids; returns their current state."""
+        from flask_socketio import join_room
+        user_ids = list(dict.fromkeys(user_ids))[:self.max_watch]
+        for user_id in user_ids:
+            join_room(presence_room(user_id), sid=sid)
+        online = self.store.online(user_ids)
+        return {user_id: user_id in online for user_id in user_ids}
+
+    def _changed(self, user_id, online):
+        with self._lock:
+            self._pending.setdefault(user_id, not online)
+
+    def _ensure_started(self):
+        # Started lazily from an event so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        next_expiry = time.monotonic() + self.heartbeat_interval
+        while True:
+            socketio.sleep(self.debounce)
+            try:
+                if time.monotonic() >= next_expiry:
+                    next_expiry = time.monotonic() + self.heartbeat_interval
+                    for user_id in self.store.expire(time.time() - self.timeout):
+                        self._changed(user_id, False)
+                self.flush()
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('presence',))
+                self.app.logger.exception('Presence update failed')
+
+    def flush(self):
+        """Emit the changes collected since the last flush."""
+        from app import socketio
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        online = self.store.online(pending)
+        for user_id, was_online in pending.items():
+            now_online = user_id in online
+            if now_online != was_online:
+                socketio.emit('presence', {'user_id': user_id, 'online': now_online},
+                              to=presence_room(user_id))
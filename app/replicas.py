@@ -0,0 +1,114 @@
+"""
+Read replicas.
+
+With DATABASE_REPLICA_URLS set, each replica is a Flask-SQLAlchemy bind
+('replica0', 'replica1', ...) with its own pool, and RoutingSession sends a
+statement to a random replica when all of these hold:
+  * the view is marked @replica_reads and the request is a GET or HEAD
+  * the statement is a SELECT, outside a flush
+  * the session hasn't written anything yet in this request
+  * the client hasn't written anything in the last DB_REPLICA_STICKY_SECONDS
+Everything else goes to DATABASE_URL, the primary.
+
+Read-your-writes: the first write in an HTTP request stamps the session
+cookie, so the same browser reads from the primary for a while whichever
+worker it lands on. Writes made in Socket.IO events also remember the user
+in this process; handlers that hand their write to a background writer
+call stick() themselves.
+
+A page cached from a replica read can be stale for as long as it is
+cached: a write invalidates its tags, and the next miss may refill them
+from a replica that hasn't caught up yet. So entries filled in a request
+that read from a replica are cached for at most DB_REPLICA_STICKY_SECONDS
+(cache_timeout()), which the replica's lag has to stay well below anyway.
+
+To try it locally with SQLite, copy instance/site.db to
+instance/replica.db and set DATABASE_REPLICA_URLS=sqlite:///replica.db.
+Nothing copies writes to it, so whatever comes from the replica stays
+visibly stale.
+"""
+import math
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+STICKY_KEY = '_db_primary_until'
+
+
+def replica_reads(view):
+    """Let the view's queries go to a replica (GET/HEAD only)."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        replicas = current_app.extensions['replicas']
+        if replicas.keys and request.method in ('GET', 'HEAD') and not replicas.is_sticky():
+            g.replica_reads = True
+        return view(*args, **kwargs)
+    return wrapped
+
+
+class RoutingSession(Session):
+    """db.session class: SELECTs in @replica_reads views go to a replica, the rest to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                if not self.info.get('wrote'):
+                    self.info['wrote'] = True
+                    if has_request_context():
+                        user = g.get('_login_user')
+                        current_app.extensions['replicas'].stick(
+                            user.id if user is not None and user.is_authenticated else None)
+            elif g.get('replica_reads') and isinstance(clause, Select) and not self.info.get('wrote'):
+                g.read_from_replica = True
+                return current_app.extensions['replicas'].engine()
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+class Replicas:
+    """Flask extension: replica engines and read-your-writes stickiness."""
+
+    def __init__(self):
+        self.keys = []
+        self._sticky = {}   # user_id -> time until which their reads use the primary
+
+    def init_app(self, app):
+        self.keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                           if str(key).startswith('replica'))
+        self.sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS', 5)
+        app.extensions['replicas'] = self
+
+    def engine(self):
+        from app import db
+        return db.engines[random.choice(self.keys)]
+
+    def stick(self, user_id=None):
+        """Send this client's (and user's) reads to the primary for DB_REPLICA_STICKY_SECONDS."""
+        if not self.keys:
+            return
+        now = time.time()
+        until = now + self.sticky_seconds
+        if has_request_context():
+            session[STICKY_KEY] = until
+        if user_id is not None:
+            if len(self._sticky) > 10000:
+                self._sticky = {uid: t for uid, t in self._sticky.items() if t > now}
+            self._sticky[user_id] = until
+
+    def cache_timeout(self, timeout=None):
+        """TTL for a cache entry filled in this request: at most DB_REPLICA_STICKY_SECONDS after a replica read."""
+        if has_request_context() and g.get('read_from_replica'):
+            cap = math.ceil(self.sticky_seconds)   # whole seconds, as Redis expiries are
+            return cap if timeout is None else min(timeout, cap)
+        return timeout
+
+    def is_sticky(self):
+        from flask_login import current_user
+        now = time.time()
+        if session.get(STICKY_KEY, 0) > now:
+            return True
+        return current_user.is_authenticated and self._sticky.get(current_user.id, 0) > now
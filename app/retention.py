@@ -0,0 +1,321 @@
+"""
+Retention of private messages.
+
+The `message` table only keeps the last MESSAGE_RETENTION_DAYS of history
+(0 keeps everything). Older messages are moved, oldest first, into
+`message_archive`: each row there is a run of up to MESSAGE_ARCHIVE_CHUNK
+messages from one conversation, stored as zlib-compressed JSON together
+with the (timestamp, id) range it covers. Chunks of a conversation never
+overlap, so they are ordered just like the messages in them.
+
+Messages that belong to no conversation (no sender or recipient, or sent
+to oneself; see models.backfill_conversations) are shown in no history,
+so past the cutoff they are deleted rather than archived. Messages that
+could be linked but haven't been yet are left for the backfill and
+reported, since they hold their partition open until it runs.
+
+Every chunk is moved in its own transaction: insert the archive row,
+delete the hot rows, drop them from the search index. If another worker
+deleted some of those rows first the delete comes up short and the chunk
+is rolled back, so every worker can run the job, every
+MESSAGE_ARCHIVE_INTERVAL seconds, without coordinating. Cron can run
+`flask messages-archive` instead.
+
+On Postgres `message` is also range-partitioned on `timestamp`, one
+partition per month (message_pYYYYMM, see the migration), plus a default
+partition for anything outside them. The same job creates the partitions
+up to MESSAGE_PARTITION_MONTHS_AHEAD months ahead, and drops those that
+end before the cutoff once archiving has emptied them, so the space of
+old messages is returned at once rather than left to vacuum. It runs
+on Postgres even with retention off, to keep partitions ahead. A
+database stamped rather than migrated (see app/schema.py) keeps a plain
+table and is left alone.
+
+History pages (pagination.message_page) read the hot table first and carry
+on into the archive with the same cursors, so scrolling back in a private
+chat works as before. Archived messages are read-only and no longer
+searchable.
+"""
+import json
+import re
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, text
+
+PARTITION_NAME = re.compile(r'^message_p(\d{4})(\d{2})$')
+
+
+class ArchivedMessage:
+    """Read-only stand-in for a Message that has been archived."""
+
+    __slots__ = ('id', 'conversation_id', 'sender_id', 'recipient_id', 'timestamp', 'body')
+
+    def __init__(self, conversation_id, id, sender_id, recipient_id, timestamp, body):
+        self.conversation_id = conversation_id
+        self.id = id
+        self.sender_id = sender_id
+        self.recipient_id = recipient_id
+        self.timestamp = datetime.fromisoformat(timestamp)
+        self.body = body
+
+    # Looked up through the session's identity map, so a page costs at
+    # most one query per participant
+    @property
+    def author(self):
+        from app import db
+        from app.models import User
+        return db.session.get(User, self.sender_id)
+
+    @property
+    def recipient(self):
+        from app import db
+        from app.models import User
+        return db.session.get(User, self.recipient_id)
+
+    def __repr__(self):
+        return f'ArchivedMessage: {self.body}'
+
+
+def pack(rows):
+    """Compress messages (oldest first) into a chunk's data."""
+    data = [[row.id, row.sender_id, row.recipient_id, row.timestamp.isoformat(), row.body] for row in rows]
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def unpack(chunk):
+    """A chunk's messages as ArchivedMessage, oldest first."""
+    return [ArchivedMessage(chunk.conversation_id, *row) for row in json.loads(zlib.decompress(chunk.data))]
+
+
+def archive_messages(cutoff, chunk_size=500, max_chunks=None):
+    """
+    Move messages sent before cutoff into the archive, up to chunk_size per
+    chunk and max_chunks chunks (None for all). Returns the number moved.
+    """
+    from app import db
+    from app.models import Message, MessageArchive
+    from app.search import remove_messages
+
+    moved = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        chunks += 1
+        # The oldest message due picks the conversation (timestamp index)
+        conversation_id = db.session.scalar(
+            select(Message.conversation_id)
+            .where(Message.timestamp < cutoff, Message.conversation_id.isnot(None))
+            .order_by(Message.timestamp).limit(1))
+        if conversation_id is None:
+            break
+        rows = db.session.execute(
+            select(Message.id, Message.sender_id, Message.recipient_id, Message.timestamp, Message.body)
+            .where(Message.conversation_id == conversation_id, Message.timestamp < cutoff)
+            .order_by(Message.timestamp, Message.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            continue
+        ids = [row.id for row in rows]
+        try:
+            db.session.add(MessageArchive(
+                conversation_id=conversation_id,
+                first_timestamp=rows[0].timestamp, first_id=rows[0].id,
+                last_timestamp=rows[-1].timestamp, last_id=rows[-1].id,
+                message_count=len(rows), data=pack(rows)))
+            table = Message.__table__
+            # The timestamp bound lets Postgres prune to the old partitions
+            deleted = db.session.execute(table.delete().where(
+                table.c.id.in_(ids), table.c.timestamp < cutoff)).rowcount
+            if deleted != len(ids):
+                # Another worker archived (some of) these first
+                db.session.rollback()
+                continue
+            remove_messages(db.session, ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        moved += len(ids)
+    return moved
+
+
+def purge_unlinkable(cutoff, batch_size=500):
+    """
+    Delete messages sent before cutoff that can never belong to a
+    conversation, batch_size per transaction. Returns (deleted, number of
+    linkable messages before cutoff still waiting for the backfill).
+    """
+    from app import db
+    from app.models import Message
+    from app.search import remove_messages
+
+    due = and_(Message.timestamp < cutoff, Message.conversation_id.is_(None))
+    unlinkable = or_(Message.sender_id.is_(None), Message.recipient_id.is_(None),
+                     Message.sender_id == Message.recipient_id)
+    deleted = 0
+    while True:
+        ids = list(db.session.scalars(select(Message.id).where(due, unlinkable).limit(batch_size)))
+        if not ids:
+            break
+        try:
+            table = Message.__table__
+            deleted += db.session.execute(table.delete().where(
+                table.c.id.in_(ids), table.c.timestamp < cutoff)).rowcount
+            remove_messages(db.session, ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    waiting = db.session.scalar(select(func.count()).select_from(Message).where(due, ~unlinkable))
+    return deleted, waiting
+
+
+def month_start(when, months=0):
+    """Midnight on the first of when's month, moved by `months` months."""
+    year, month = divmod(when.year * 12 + when.month - 1 + months, 12)
+    return datetime(year, month + 1, 1)
+
+
+def maintain_partitions(cutoff=None, months_ahead=3):
+    """
+    Create the monthly partitions of `message` up to months_ahead months
+    from now and, with a cutoff, drop the ones ending before it that hold
+    no more messages. Only on Postgres with a partitioned `message`;
+    returns (created, dropped).
+    """
+    from app import db
+
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return 0, 0
+    with engine.connect() as connection:
+        if connection.scalar(text("SELECT relkind FROM pg_class WHERE oid = 'message'::regclass")) != 'p':
+            return 0, 0
+        existing = set(connection.scalars(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'message'::regclass")))
+
+    # One transaction per partition, so a worker racing this one only costs
+    # it that partition. Dropping locks `message` for a moment.
+    dropped = 0
+    for name in sorted(existing):
+        match = PARTITION_NAME.match(name)
+        if cutoff is None or not match:
+            continue
+        if month_start(datetime(int(match[1]), int(match[2]), 1), 1) > cutoff:
+            continue
+        with engine.begin() as connection:
+            if not connection.scalar(text(f'SELECT EXISTS (SELECT 1 FROM "{name}")')):
+                connection.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                dropped += 1
+
+    created = 0
+    now = datetime.utcnow()
+    for months in range(months_ahead + 1):
+        start = month_start(now, months)
+        name = f"message_p{start:%Y%m}"
+        if name in existing:
+            continue
+        with engine.begin() as connection:
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF message '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{month_start(start, 1).isoformat()}')"))
+        created += 1
+    return created, dropped
+
+
+def archived_page(conversation_id, before=None, limit=50):
+    """
+    Up to `limit` archived messages of a conversation, newest first, older
+    than `before` ((timestamp, id) of a message, or None for the newest).
+    """
+    from app.models import MessageArchive
+
+    messages = []
+    while len(messages) < limit:
+        query = MessageArchive.query.filter_by(conversation_id=conversation_id)
+        if before is not None:
+            when, row_id = before
+            query = query.filter(or_(
+                MessageArchive.first_timestamp < when,
+                and_(MessageArchive.first_timestamp == when, MessageArchive.first_id < row_id)
+            ))
+        chunk = query.order_by(MessageArchive.first_timestamp.desc(), MessageArchive.first_id.desc()).first()
+        if chunk is None:
+            break
+        messages.extend(m for m in reversed(unpack(chunk))
+                        if before is None or (m.timestamp, m.id) < before)
+        before = (chunk.first_timestamp, chunk.first_id)
+    return messages[:limit]
+
+
+class Retention:
+    """Flask extension: periodically archives messages past MESSAGE_RETENTION_DAYS and keeps partitions."""
+
+    def __init__(self):
+        self.app = None
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.retention_days = app.config.get('MESSAGE_RETENTION_DAYS', 0)
+        self.chunk_size = app.config.get('MESSAGE_ARCHIVE_CHUNK', 500)
+        self.interval = app.config.get('MESSAGE_ARCHIVE_INTERVAL', 3600)
+        self.months_ahead = app.config.get('MESSAGE_PARTITION_MONTHS_AHEAD', 3)
+        postgres = app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql')
+        if self.retention_days or postgres:
+            app.before_request(self._ensure_started)
+        app.extensions['retention'] = self
+
+    def cutoff(self, days=None):
+        return datetime.utcnow() - timedelta(days=days or self.retention_days)
+
+    def run(self):
+        """Archive everything due, one chunk per transaction. Returns the number of messages moved."""
+        from app import socketio
+        moved = 0
+        while self.retention_days:
+            with self.app.app_context():
+                count = archive_messages(self.cutoff(), self.chunk_size, max_chunks=1)
+            if not count:
+                break
+            moved += count
+            # Let requests and socket events in between chunks
+            socketio.sleep(0)
+        with self.app.app_context():
+            if self.retention_days:
+                self._purge_unlinkable()
+            created, dropped = maintain_partitions(self.cutoff() if self.retention_days else None,
+                                                   self.months_ahead)
+        if created or dropped:
+            self.app.logger.info('Created %d and dropped %d message partitions', created, dropped)
+        return moved
+
+    def _purge_unlinkable(self):
+        deleted, waiting = purge_unlinkable(self.cutoff(), self.chunk_size)
+        if deleted:
+            self.app.logger.info('Deleted %d messages past retention that belong to no conversation', deleted)
+        if waiting:
+            self.app.logger.warning('%d messages past retention are not linked to their conversation yet and '
+                                    'cannot be archived; run the conversation backfill (render_start.py)',
+                                    waiting)
+
+    def _ensure_started(self):
+        # Started lazily from a request so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            try:
+                moved = self.run()
+                if moved:
+                    self.app.logger.info('Archived %d messages', moved)
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('retention',))
+                self.app.logger.exception('Failed to archive messages')
+            socketio.sleep(self.interval)
@@ -0,0 +1,108 @@
+"""
+Database schema versioning.
+
+Migrations are committed under migrations/ and applied in-process by
+upgrade_schema(), which is what render_start.py and `flask schema-check`
+run. It reads the database's revision first and does nothing when that is
+already head, so a release whose models didn't change costs one query.
+
+Databases created before migrations were committed (by db.create_all() or
+by a migration autogenerated on the server) have no revision, or one that
+is not in migrations/. Their missing tables are created, and if what's
+left matches the models they are stamped at head; otherwise the
+differences are reported and nothing is changed.
+
+To change the schema: edit app/models.py, run
+`flask db migrate -m "<what changed>"`, review the generated file and
+commit it.
+"""
+import re
+import time
+
+# Maintained by app/search.py, not by the models
+UNMANAGED_TABLE_PREFIXES = ('post_fts', 'message_fts')
+UNMANAGED_INDEXES = ('ix_post_search', 'ix_message_search')
+# Postgres partitions of `message`, maintained by app/retention.py
+PARTITION_TABLE = re.compile(r'^message_(p\d{6}|default)$')
+
+AT_HEAD = 'at head'
+UPGRADED = 'upgraded'
+STAMPED = 'stamped'
+OUT_OF_DATE = 'out of date'
+
+
+class SchemaMismatch(RuntimeError):
+    """The database has no known revision and differs from the models."""
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Alembic filter: leave the search tables and indexes, and message partitions, alone."""
+    if type_ == 'table' and (name.startswith(UNMANAGED_TABLE_PREFIXES) or PARTITION_TABLE.match(name)):
+        return False
+    if type_ == 'index' and (name in UNMANAGED_INDEXES or PARTITION_TABLE.match(obj.table.name)):
+        return False
+    return True
+
+
+def _alembic_config():
+    from flask import current_app
+    return current_app.extensions['migrate'].migrate.get_config()
+
+
+def schema_revisions():
+    """(revisions in the database, head revisions in migrations/)."""
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from app import db
+
+    heads = set(ScriptDirectory.from_config(_alembic_config()).get_heads())
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current, heads
+
+
+def _differences():
+    """Differences between the database and the models, ignoring unmanaged objects."""
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from app import db
+
+    with db.engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={
+            'include_object': include_object, 'compare_type': True})
+        return compare_metadata(context, db.metadata)
+
+
+def upgrade_schema(check_only=False):
+    """
+    Bring the database to the head revision; returns (status, seconds).
+    With check_only nothing is changed and the status is AT_HEAD or
+    OUT_OF_DATE. Raises SchemaMismatch for an unversioned database that
+    differs from the models.
+    """
+    from alembic import command
+    from alembic.script import ScriptDirectory
+    from sqlalchemy import inspect
+    from app import db
+
+    started = time.perf_counter()
+    current, heads = schema_revisions()
+    if current == heads:
+        return AT_HEAD, time.perf_counter() - started
+    if check_only:
+        return OUT_OF_DATE, time.perf_counter() - started
+
+    config = _alembic_config()
+    known = {script.revision for script in ScriptDirectory.from_config(config).walk_revisions()}
+    if current <= known and (current or not inspect(db.engine).has_table('user')):
+        # Versioned (or empty) database: apply the missing migrations
+        command.upgrade(config, 'head')
+        return UPGRADED, time.perf_counter() - started
+
+    db.create_all()
+    differences = _differences()
+    if differences:
+        raise SchemaMismatch("Database schema differs from the models and has no known revision:\n" +
+                             "\n".join(f"  {diff}" for diff in differences))
+    command.stamp(config, 'head', purge=True)
+    return STAMPED, time.perf_counter() - started
@@ -0,0 +1,235 @@
+"""
+Full-text search over posts and private messages.
+
+One interface, two inverted-index backends picked from the database dialect:
+  * SQLite   - FTS5 virtual tables (post_fts, message_fts) keyed by rowid,
+               kept current by mapper hooks on Post and Message
+  * Postgres - GIN indexes on to_tsvector() expressions, which Postgres
+               maintains itself on every write
+
+Message search is always restricted to conversations the searcher is in,
+and only covers messages still in the hot table (see app/retention.py).
+Results are ranked, so pages are LIMIT/OFFSET and capped at
+SEARCH_MAX_PAGES. `flask search-reindex` rebuilds everything from the
+base tables.
+"""
+import re
+
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload
+
+from app.models import Post, Message
+
+
+def fts5_query(q):
+    """Turn free text into a safe FTS5 query: every word must match, last one as a prefix."""
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    terms = ['"%s"' % w.replace('"', '""') for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class SqliteSearch:
+    SCHEMA = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, content)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(body)",
+    )
+
+    def ensure_schema(self, connection):
+        for statement in self.SCHEMA:
+            connection.execute(text(statement))
+
+    def index_post(self, connection, post):
+        connection.execute(text(
+            "INSERT OR REPLACE INTO post_fts(rowid, title, content) VALUES (:id, :title, :content)"
+        ), {'id': post.id, 'title': post.title, 'content': post.content})
+
+    def remove_post(self, connection, post_id):
+        connection.execute(text("DELETE FROM post_fts WHERE rowid = :id"), {'id': post_id})
+
+    def index_message(self, connection, message):
+        connection.execute(text(
+            "INSERT OR REPLACE INTO message_fts(rowid, body) VALUES (:id, :body)"
+        ), {'id': message.id, 'body': message.body})
+
+    def remove_message(self, connection, message_id):
+        connection.execute(text("DELETE FROM message_fts WHERE rowid = :id"), {'id': message_id})
+
+    def search_posts(self, connection, q, limit, offset):
+        match = fts5_query(q)
+        if match is None:
+            return []
+        rows = connection.execute(text(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH :q "
+            "ORDER BY bm25(post_fts, 2.0, 1.0) LIMIT :limit OFFSET :offset"
+        ), {'q': match, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def search_messages(self, connection, user_id, q, limit, offset):
+        match = fts5_query(q)
+        if match is None:
+            return []
+        rows = connection.execute(text(
+            "SELECT m.id FROM message_fts "
+            "JOIN message m ON m.id = message_fts.rowid "
+            "JOIN conversation c ON c.id = m.conversation_id "
+            "WHERE message_fts MATCH :q AND (c.user1_id = :user_id OR c.user2_id = :user_id) "
+            "ORDER BY bm25(message_fts) LIMIT :limit OFFSET :offset"
+        ), {'q': match, 'user_id': user_id, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def reindex(self, connection):
+        connection.execute(text("DROP TABLE IF EXISTS post_fts"))
+        connection.execute(text("DROP TABLE IF EXISTS message_fts"))
+        self.ensure_schema(connection)
+        connection.execute(text(
+            "INSERT INTO post_fts(rowid, title, content) SELECT id, title, content FROM post"))
+        connection.execute(text(
+            "INSERT INTO message_fts(rowid, body) SELECT id, body FROM message"))
+
+
+class PostgresSearch:
+    POST_VECTOR = "to_tsvector('english', coalesce(title, '') || ' ' || content)"
+    MESSAGE_VECTOR = "to_tsvector('english', message.body)"
+    SCHEMA = (
+        f"CREATE INDEX IF NOT EXISTS ix_post_search ON post USING GIN ({POST_VECTOR})",
+        f"CREATE INDEX IF NOT EXISTS ix_message_search ON message USING GIN ({MESSAGE_VECTOR})",
+    )
+
+    def ensure_schema(self, connection):
+        for statement in self.SCHEMA:
+            connection.execute(text(statement))
+
+    # The expression indexes are maintained by Postgres on every write
+    def index_post(self, connection, post):
+        pass
+
+    def remove_post(self, connection, post_id):
+        pass
+
+    def index_message(self, connection, message):
+        pass
+
+    def remove_message(self, connection, message_id):
+        pass
+
+    def search_posts(self, connection, q, limit, offset):
+        rows = connection.execute(text(
+            f"SELECT id FROM post, websearch_to_tsquery('english', :q) query "
+            f"WHERE {self.POST_VECTOR} @@ query "
+            f"ORDER BY ts_rank({self.POST_VECTOR}, query) DESC, id DESC LIMIT :limit OFFSET :offset"
+        ), {'q': q, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def search_messages(self, connection, user_id, q, limit, offset):
+        rows = connection.execute(text(
+            f"SELECT message.id FROM message JOIN conversation c ON c.id = message.conversation_id, "
+            f"websearch_to_tsquery('english', :q) query "
+            f"WHERE {self.MESSAGE_VECTOR} @@ query "
+            f"AND (c.user1_id = :user_id OR c.user2_id = :user_id) "
+            f"ORDER BY ts_rank({self.MESSAGE_VECTOR}, query) DESC, message.id DESC "
+            f"LIMIT :limit OFFSET :offset"
+        ), {'q': q, 'user_id': user_id, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def reindex(self, connection):
+        self.ensure_schema(connection)
+        connection.execute(text("REINDEX INDEX ix_post_search"))
+        connection.execute(text("REINDEX INDEX ix_message_search"))
+
+
+BACKENDS = {'sqlite': SqliteSearch(), 'postgresql': PostgresSearch()}
+
+
+def backend_for(connection):
+    try:
+        return BACKENDS[connection.dialect.name]
+    except KeyError:
+        raise RuntimeError(f"Search is not supported on {connection.dialect.name}")
+
+
+# -------------------- INDEX HOOKS --------------------
+
+_ready = set()  # engines whose search schema exists in this process
+
+def _backend(connection):
+    backend = backend_for(connection)
+    if connection.engine not in _ready:
+        backend.ensure_schema(connection)
+        _ready.add(connection.engine)
+    return backend
+
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_update')
+def _post_saved(mapper, connection, post):
+    _backend(connection).index_post(connection, post)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    _backend(connection).remove_post(connection, post.id)
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_saved(mapper, connection, message):
+    _backend(connection).index_message(connection, message)
+
+
+@event.listens_for(Message, 'after_delete')
+def _message_deleted(mapper, connection, message):
+    _backend(connection).remove_message(connection, message.id)
+
+
+def remove_messages(session, message_ids):
+    """Unindex messages deleted in bulk, which the mapper hooks don't see."""
+    connection = session.connection()
+    backend = _backend(connection)
+    for message_id in message_ids:
+        backend.remove_message(connection, message_id)
+
+
+# -------------------- QUERIES --------------------
+
+def _offset(page, per_page):
+    # Ranked results can't be keyset-paginated cheaply: page N ranks and
+    # discards every earlier match, so only the first few pages are served
+    max_pages = current_app.config.get('SEARCH_MAX_PAGES', 10)
+    if not 1 <= page <= max_pages:
+        raise ValueError(f"Search pages go from 1 to {max_pages}")
+    return (page - 1) * per_page
+
+
+def search_posts(session, q, page=1, per_page=10):
+    """Posts matching q, best match first."""
+    connection = session.connection()
+    ids = _backend(connection).search_posts(connection, q, per_page, _offset(page, per_page))
+    return _in_order(Post, ids)
+
+
+def search_messages(session, user_id, q, page=1, per_page=10):
+    """Messages matching q from user_id's own conversations, best match first."""
+    connection = session.connection()
+    ids = _backend(connection).search_messages(connection, user_id, q, per_page, _offset(page, per_page))
+    return _in_order(Message, ids)
+
+
+def ensure_schema(session):
+    _backend(session.connection())
+
+
+def reindex(session):
+    connection = session.connection()
+    backend_for(connection).reindex(connection)
+    _ready.add(connection.engine)
+
+
+def _in_order(model, ids):
+    if not ids:
+        return []
+    rows = model.query.filter(model.id.in_(ids)).options(joinedload(model.author)).all()
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id]
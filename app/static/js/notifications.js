@@ -0,0 +1,47 @@
+// Per-user notifications (new messages, incoming calls, posts).
+// Live ones arrive as 'notification'; anything queued while we were offline
+// arrives once, as a single 'notifications' batch right after connecting.
+// Nothing is shown for the page the user is already looking at, nor for
+// kinds the page shows itself (an element with data-notification-kind).
+function trackNotifications(socket, container) {
+    const show = function(items, footer) {
+        const toast = document.createElement('div');
+        toast.className = 'toast';
+        toast.setAttribute('role', 'status');
+        const body = document.createElement('div');
+        body.className = 'toast-body';
+        items.forEach(function(item) {
+            const line = document.createElement(item.url ? 'a' : 'div');
+            line.className = 'd-block';
+            if (item.url) line.href = item.url;
+            line.textContent = item.text;
+            body.appendChild(line);
+        });
+        if (footer) {
+            const more = document.createElement('small');
+            more.className = 'text-muted';
+            more.textContent = footer;
+            body.appendChild(more);
+        }
+        toast.appendChild(body);
+        container.appendChild(toast);
+        toast.addEventListener('hidden.bs.toast', function() { toast.remove(); });
+        new bootstrap.Toast(toast, { delay: 8000 }).show();
+    };
+
+    const relevant = function(item) {
+        return item.url !== location.pathname &&
+            !document.querySelector(`[data-notification-kind="${item.kind}"]`);
+    };
+
+    socket.on('notification', function(item) {
+        if (relevant(item)) show([item]);
+    });
+
+    socket.on('notifications', function(data) {
+        const items = data.items.filter(relevant);
+        if (items.length || data.dropped) {
+            show(items, data.dropped ? `and ${data.dropped} older notifications` : null);
+        }
+    });
+}
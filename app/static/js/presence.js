@@ -0,0 +1,35 @@
+// Online presence for the current page.
+// Every element with data-presence-user="<user id>" gets the "online" class
+// while that user has a live connection. The server only sends changes for
+// the users this page asked about, and the heartbeat keeps our own
+// connection counted as online.
+function trackPresence(socket, heartbeatMs) {
+    const update = function(userId, online) {
+        document.querySelectorAll(`[data-presence-user="${userId}"]`).forEach(function(el) {
+            el.classList.toggle('online', online);
+            el.title = online ? 'Online' : 'Offline';
+        });
+    };
+
+    socket.on('connect', function() {
+        const ids = new Set();
+        document.querySelectorAll('[data-presence-user]').forEach(function(el) {
+            ids.add(Number(el.dataset.presenceUser));
+        });
+        if (ids.size) {
+            socket.emit('watch_presence', { user_ids: Array.from(ids) }, function(states) {
+                Object.keys(states).forEach(function(userId) { update(userId, states[userId]); });
+            });
+        }
+    });
+
+    socket.on('presence', function(data) {
+        update(data.user_id, data.online);
+    });
+
+    setInterval(function() {
+        if (socket.connected) {
+            socket.emit('heartbeat');
+        }
+    }, heartbeatMs);
+}
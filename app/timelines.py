@@ -0,0 +1,220 @@
+"""
+Personal timelines: posts by the people a user follows, newest first.
+
+Fan-out on write: when a post is published its id is copied into the
+timeline_entry rows of every follower by a background task
+(TimelineWriter), so reading a timeline page is one range scan on
+(user_id, date_posted, post_id) no matter how many people the reader
+follows or how many posts exist. The author's own entry is written with
+the post, so it is on their timeline straight away.
+
+Authors with TIMELINE_FANOUT_LIMIT or more followers are not fanned out;
+copying one post into that many timelines costs more than it saves.
+Their posts are merged in when a follower reads (fan-out on read), from
+the (user_id, date_posted, id) index on post.
+
+`flask timeline-rebuild` regenerates every timeline from the follow graph
+and recounts followers, e.g. after importing users, posts or follows.
+"""
+from sqlalchemy import and_, or_, select, literal
+from sqlalchemy.orm import joinedload
+
+from app.write_behind import TimelineWriter
+
+
+def insert_ignoring_duplicates(table, rows):
+    """INSERT rows, skipping any whose primary key is already there (SQLite/PostgreSQL)."""
+    from app import db
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    db.session.execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+def _page_keys(query, time_col, id_col, cursor, limit):
+    """(time, id) of the first `limit` rows older than cursor, newest first."""
+    from app.pagination import decode_cursor
+    if cursor:
+        when, row_id = decode_cursor(cursor)
+        query = query.filter(or_(time_col < when, and_(time_col == when, id_col < row_id)))
+    return [tuple(row) for row in query.with_entities(time_col, id_col)
+            .order_by(time_col.desc(), id_col.desc()).limit(limit)]
+
+
+class Timelines:
+    """Flask extension: publishing, following and reading timelines."""
+
+    def __init__(self):
+        self.writer = TimelineWriter()
+        self.fanout_limit = 5000
+
+    def init_app(self, app):
+        self.fanout_limit = app.config.get('TIMELINE_FANOUT_LIMIT', 5000)
+        self.follow_backfill = app.config.get('TIMELINE_FOLLOW_BACKFILL', 50)
+        self.rebuild_depth = app.config.get('TIMELINE_REBUILD_DEPTH', 500)
+        self.writer.init_app(app)
+        app.extensions['timelines'] = self
+
+    # -------------------- WRITING --------------------
+
+    def publish(self, post, notice):
+        """
+        Add a new (flushed) post to its author's timeline, in the caller's
+        transaction. Returns what fan_out_later() needs once it is committed;
+        notice is the 'post' notification payload sent to followers.
+        """
+        from app import db
+        from app.models import TimelineEntry
+        db.session.add(TimelineEntry(user_id=post.user_id, post_id=post.id, date_posted=post.date_posted))
+        return (post.id, post.user_id, post.date_posted, notice)
+
+    def fan_out_later(self, published):
+        """Queue the fan-out of a post returned by publish(); call after the commit."""
+        if not self.writer.submit(*published):
+            self.writer.app.logger.warning('Timeline queue full, post %s only reaches followers on rebuild',
+                                           published[0])
+
+    def fan_out(self, batch):
+        """
+        Copy posts into their followers' timelines. Runs on the writer task;
+        returns (notice, follower ids) for each post that was fanned out.
+        """
+        from app import db
+        from app.models import User, Post, Follow, TimelineEntry
+
+        post_ids = [post_id for post_id, _, _, _ in batch]
+        # Skip posts deleted before we got to them
+        live = set(db.session.scalars(select(Post.id).where(Post.id.in_(post_ids))))
+        author_ids = {author_id for _, author_id, _, _ in batch}
+        small = set(db.session.scalars(select(User.id).where(
+            User.id.in_(author_ids), User.follower_count < self.fanout_limit)))
+
+        delivered = []
+        for post_id, author_id, date_posted, notice in batch:
+            if post_id not in live or author_id not in small:
+                continue
+            followers = list(db.session.scalars(
+                select(Follow.follower_id).where(Follow.followed_id == author_id)))
+            for start in range(0, len(followers), 1000):
+                insert_ignoring_duplicates(TimelineEntry.__table__, [
+                    {'user_id': follower_id, 'post_id': post_id, 'date_posted': date_posted}
+                    for follower_id in followers[start:start + 1000]])
+            delivered.append((notice, followers))
+        return delivered
+
+    def remove(self, post):
+        """Drop a post from every timeline, before deleting it."""
+        from app.models import TimelineEntry
+        TimelineEntry.query.filter_by(post_id=post.id).delete(synchronize_session=False)
+
+    def follow(self, follower_id, followed_id):
+        """
+        Follow a user and copy their recent posts into the follower's
+        timeline. Returns False if already following. The caller commits.
+        """
+        from app import db
+        from app.models import User, Post, Follow, TimelineEntry
+
+        if db.session.get(Follow, (follower_id, followed_id)) is not None:
+            return False
+        db.session.add(Follow(follower_id=follower_id, followed_id=followed_id))
+        # Single UPDATE, so concurrent follows can't lose a count
+        db.session.execute(User.__table__.update().where(User.id == followed_id)
+                           .values(follower_count=User.follower_count + 1))
+        followed = db.session.get(User, followed_id)
+        db.session.refresh(followed, ['follower_count'])
+        if followed.follower_count < self.fanout_limit:
+            recent = db.session.execute(
+                select(Post.id, Post.date_posted).where(Post.user_id == followed_id)
+                .order_by(Post.date_posted.desc(), Post.id.desc()).limit(self.follow_backfill)).all()
+            if recent:
+                insert_ignoring_duplicates(TimelineEntry.__table__, [
+                    {'user_id': follower_id, 'post_id': post_id, 'date_posted': date_posted}
+                    for post_id, date_posted in recent])
+        return True
+
+    def unfollow(self, follower_id, followed_id):
+        """Stop following and drop the user's posts from the timeline. The caller commits."""
+        from app import db
+        from app.models import User, Post, Follow, TimelineEntry
+
+        if not Follow.query.filter_by(follower_id=follower_id, followed_id=followed_id).delete():
+            return False
+        db.session.execute(User.__table__.update().where(User.id == followed_id)
+                           .values(follower_count=User.follower_count - 1))
+        TimelineEntry.query.filter(
+            TimelineEntry.user_id == follower_id,
+            TimelineEntry.post_id.in_(select(Post.id).where(Post.user_id == followed_id))
+        ).delete(synchronize_session=False)
+        return True
+
+    # -------------------- READING --------------------
+
+    def page(self, user_id, cursor=None, per_page=10):
+        """
+        One page of user_id's timeline, newest first, with authors
+        eager-loaded, plus the cursor for the next page (same format as
+        feed_page). Raises InvalidCursor for a bad cursor.
+        """
+        from app.models import User, Post, Follow, TimelineEntry
+        from app.pagination import encode_cursor
+
+        keys = _page_keys(TimelineEntry.query.filter_by(user_id=user_id),
+                          TimelineEntry.date_posted, TimelineEntry.post_id, cursor, per_page + 1)
+        # Followed authors too big to fan out, read from their own post index
+        large = [author_id for (author_id,) in
+                 Follow.query.join(User, User.id == Follow.followed_id)
+                 .filter(Follow.follower_id == user_id, User.follower_count >= self.fanout_limit)
+                 .with_entities(Follow.followed_id)]
+        if large:
+            keys = sorted(set(keys) | set(_page_keys(Post.query.filter(Post.user_id.in_(large)),
+                                                     Post.date_posted, Post.id, cursor, per_page + 1)),
+                          reverse=True)
+
+        next_cursor = None
+        if len(keys) > per_page:
+            keys = keys[:per_page]
+            next_cursor = encode_cursor(*keys[-1])
+        if not keys:
+            return [], None
+        ids = [post_id for _, post_id in keys]
+        by_id = {post.id: post for post in
+                 Post.query.options(joinedload(Post.author)).filter(Post.id.in_(ids))}
+        return [by_id[post_id] for post_id in ids if post_id in by_id], next_cursor
+
+    def is_following(self, follower_id, followed_id):
+        from app import db
+        from app.models import Follow
+        return db.session.get(Follow, (follower_id, followed_id)) is not None
+
+    # -------------------- MAINTENANCE --------------------
+
+    def rebuild(self, batch_size=500):
+        """Recount followers and regenerate every timeline. Returns the number of users."""
+        from app import db
+        from app.models import User, Post, Follow, TimelineEntry
+
+        db.session.execute(User.__table__.update().values(follower_count=(
+            select(db.func.count()).where(Follow.followed_id == User.id).scalar_subquery())))
+        db.session.commit()
+
+        done = 0
+        last_id = 0
+        while True:
+            user_ids = list(db.session.scalars(select(User.id).where(User.id > last_id)
+                                               .order_by(User.id).limit(batch_size)))
+            if not user_ids:
+                return done
+            for user_id in user_ids:
+                fanned_out = (select(Follow.followed_id).join(User, User.id == Follow.followed_id)
+                              .where(Follow.follower_id == user_id, User.follower_count < self.fanout_limit))
+                recent = (select(literal(user_id), Post.id, Post.date_posted)
+                          .where(or_(Post.user_id == user_id, Post.user_id.in_(fanned_out)))
+                          .order_by(Post.date_posted.desc(), Post.id.desc()).limit(self.rebuild_depth))
+                TimelineEntry.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+                db.session.execute(TimelineEntry.__table__.insert().from_select(
+                    ['user_id', 'post_id', 'date_posted'], recent))
+            db.session.commit()
+            done += len(user_ids)
+            last_id = user_ids[-1]
@@ -0,0 +1,166 @@
+"""
+Wire format of chat and private messages sent over Socket.IO.
+
+Selected with Config.SOCKETIO_WIRE_FORMAT:
+  * 'json'    - one verbose dict per message ('message_response' /
+                'new_private_message'), usernames and formatted times included
+  * 'compact' - 'chat_batch' / 'private_batch' frames carrying a list of
+                [user id, epoch seconds, body] rows; a chat frame names each
+                user once in 'users', and private chat pages already know both
+  * 'msgpack' - the compact frames packed with MessagePack and sent as a
+                binary attachment (needs the msgpack package)
+
+With SOCKETIO_BATCH_MS > 0 compact frames are held for that long and a
+burst in one room goes out as a single frame per client, rather than one
+frame per message; the sender's own echo waits just as long.
+
+Websocket frames are compressed by the server (permessage-deflate) when
+the browser offers it, which all current browsers do. Long-polling
+responses are compressed above SOCKETIO_COMPRESSION_THRESHOLD bytes.
+`python benchmarks/wire_format.py` compares the formats.
+"""
+import calendar
+import threading
+
+FORMATS = ('json', 'compact', 'msgpack')
+
+
+def epoch(timestamp):
+    """Naive UTC datetime -> whole seconds since the epoch."""
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+def chat_frame(room, messages):
+    """Compact frame for chat records (see chat_rooms.chat_message_to_dict)."""
+    return {
+        'room': room,
+        'users': {str(m['user_id']): m['username'] for m in messages if m.get('user_id') is not None},
+        'messages': [[m.get('user_id'), m.get('ts'), m['message']] for m in messages],
+    }
+
+
+def verbose_chat(message):
+    """The 'json' format of a chat record, as sent before compact frames existed."""
+    return {key: message[key] for key in ('room', 'username', 'message', 'timestamp')}
+
+
+def private_frame(socket_room, rows):
+    """Compact frame for private messages given as (sender id, timestamp, body)."""
+    return {'room': socket_room,
+            'messages': [[sender_id, epoch(timestamp), body] for sender_id, timestamp, body in rows]}
+
+
+def verbose_private(sender_username, recipient_username, body, timestamp):
+    """The 'json' format of a private message."""
+    return {
+        'message': body,
+        'sender': sender_username,
+        'recipient': recipient_username,
+        'timestamp': timestamp.strftime('%b %d, %I:%M %p')
+    }
+
+
+class Wire:
+    """Flask extension: encodes chat frames and batches them per room."""
+
+    def __init__(self):
+        self.app = None
+        self.format = 'json'
+        self.batch_ms = 0
+        self._pending = {}   # (event, room) -> frame being filled
+        self._lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.format = app.config.get('SOCKETIO_WIRE_FORMAT', 'json')
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown SOCKETIO_WIRE_FORMAT: {self.format}")
+        if self.format == 'msgpack':
+            try:
+                import msgpack
+            except ImportError as e:
+                raise RuntimeError("SOCKETIO_WIRE_FORMAT='msgpack' requires the 'msgpack' package") from e
+            self._packb = msgpack.packb
+        self.batch_ms = app.config.get('SOCKETIO_BATCH_MS', 0)
+        app.extensions['wire'] = self
+
+    @property
+    def compact(self):
+        return self.format != 'json'
+
+    def encode(self, frame):
+        return self._packb(frame) if self.format == 'msgpack' else frame
+
+    # -------------------- PUBLIC CHAT --------------------
+
+    def chat_message(self, socket_room, message):
+        """Send one chat record to everyone in socket_room."""
+        from app import socketio
+        if not self.compact:
+            socketio.emit('message_response', verbose_chat(message), to=socket_room)
+            return
+        self._send('chat_batch', socket_room, chat_frame(message['room'], [message]))
+
+    def chat_history(self, room, messages):
+        """Replay a room's recent records to the client handling this event."""
+        from flask_socketio import emit
+        if not self.compact:
+            emit('chat_history', {'room': room, 'messages': [verbose_chat(m) for m in messages]})
+            return
+        emit('chat_batch', self.encode(dict(chat_frame(room, messages), history=True)))
+
+    # -------------------- PRIVATE MESSAGES --------------------
+
+    def private_message(self, socket_room, sender, recipient_username, body, timestamp):
+        """Send a private message to both ends of the conversation."""
+        from app import socketio
+        if not self.compact:
+            socketio.emit('new_private_message', verbose_private(sender.username, recipient_username, body, timestamp),
+                          to=socket_room)
+            return
+        self._send('private_batch', socket_room, private_frame(socket_room, [(sender.id, timestamp, body)]))
+
+    # -------------------- BATCHING --------------------
+
+    def _send(self, event, socket_room, frame):
+        from app import socketio
+        if not self.batch_ms:
+            socketio.emit(event, self.encode(frame), to=socket_room)
+            return
+        self._ensure_started()
+        with self._lock:
+            pending = self._pending.get((event, socket_room))
+            if pending is None:
+                self._pending[(event, socket_room)] = frame
+            else:
+                pending['messages'].extend(frame['messages'])
+                if 'users' in frame:
+                    pending['users'].update(frame['users'])
+
+    def flush(self):
+        """Emit every frame collected since the last flush."""
+        from app import socketio
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for (event, socket_room), frame in pending.items():
+            socketio.emit(event, self.encode(frame), to=socket_room)
+
+    def _ensure_started(self):
+        # Started lazily from an event so it runs under the server's async mode
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+
+    def _run(self):
+        from app import socketio
+        while True:
+            socketio.sleep(self.batch_ms / 1000)
+            try:
+                self.flush()
+            except Exception:
+                from app import metrics
+                metrics.inc('flasksocial_background_failures_total', ('wire',))
+                self.app.logger.exception('Failed to send batched frames')
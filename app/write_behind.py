@@ -0,0 +1,294 @@
+"""
+Write-behind persistence for chat messages.
+
+In 'sync' mode (Config.MESSAGE_WRITE_MODE) every private message is
+committed before it is emitted, exactly like before. In 'batched' mode
+the socket handler emits straight away and hands the message to a
+background task that coalesces inserts into one commit every
+MESSAGE_BATCH_INTERVAL_MS or MESSAGE_BATCH_SIZE messages, whichever comes
+first. The queue is bounded: when it is full, submit() waits up to
+MESSAGE_QUEUE_TIMEOUT seconds and then reports failure so the sender can
+be told. Anything still queued is flushed when the process exits.
+
+A batch that fails to commit goes back to the front of the pending list
+and is retried, waiting twice as long after each failure up to
+MESSAGE_RETRY_MAX_INTERVAL seconds; the queue stays bounded meanwhile, so
+senders are told once it fills up. After MESSAGE_WRITE_RETRIES failures
+in a row the items are written one at a time: if some succeed, those that
+don't can never be written and are dropped (and logged); if none do, the
+database is down and the whole batch keeps waiting.
+
+Public chat room messages always use the batched path (ChatMessageWriter);
+they are already in the room's history buffer when emitted. So do
+notifications queued for offline users (NotificationWriter) and the
+copying of new posts into followers' timelines (TimelineWriter).
+"""
+import atexit
+import json
+import queue
+import threading
+import time
+
+
+class BatchWriter:
+    """Bounded queue drained into batched commits by a background task."""
+
+    what = 'items'   # for log messages
+    task = 'batch_writer'   # task label on the failure and drop counters
+
+    def __init__(self):
+        self.app = None
+        self.mode = 'sync'
+        self._queue = None
+        self._started = False
+        self._pending = []           # taken off the queue, not yet written
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def configure(self, app, mode):
+        self.app = app
+        self.mode = mode
+        if self.mode not in ('sync', 'batched'):
+            raise ValueError(f"Unknown MESSAGE_WRITE_MODE: {self.mode}")
+        self.batch_size = app.config.get('MESSAGE_BATCH_SIZE', 100)
+        self.batch_interval = app.config.get('MESSAGE_BATCH_INTERVAL_MS', 50) / 1000.0
+        self.put_timeout = app.config.get('MESSAGE_QUEUE_TIMEOUT', 1.0)
+        self.max_retries = app.config.get('MESSAGE_WRITE_RETRIES', 5)
+        self.max_retry_interval = app.config.get('MESSAGE_RETRY_MAX_INTERVAL', 30)
+        self._queue = queue.Queue(maxsize=app.config.get('MESSAGE_QUEUE_MAX', 5000))
+
+    def submit_item(self, item):
+        """Persist an item now (sync) or queue it (batched). Returns False if the queue is full."""
+        if self.mode == 'sync':
+            self._write([item])
+            return True
+        self._ensure_started()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self._count('flasksocial_background_items_dropped_total')
+            return False
+        return True
+
+    def flush(self):
+        """Write everything pending or queued. Called on shutdown."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except (queue.Empty, AttributeError):
+                break
+            self._add_pending(item)
+        self._write_pending()
+
+    def _ensure_started(self):
+        # Started lazily from a request/event so it runs under whatever async
+        # mode (eventlet, threading) the server was patched into.
+        if self._started:
+            return
+        self._started = True
+        from app import socketio
+        socketio.start_background_task(self._run)
+        atexit.register(self.flush)
+
+    def _run(self):
+        from app import socketio
+        failures = 0
+        while True:
+            if failures:
+                # Retry what failed even if nothing new arrives
+                socketio.sleep(min(self.batch_interval * 2 ** failures, self.max_retry_interval))
+                count = self._pending_count()
+            else:
+                count = self._add_pending(self._queue.get())
+            deadline = time.monotonic() + self.batch_interval
+            while count < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    count = self._add_pending(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if failures >= self.max_retries:
+                    self._write_each()
+                else:
+                    self._write_pending()
+                failures = 0
+            except Exception:
+                failures += 1
+                self._count('flasksocial_background_failures_total')
+                self.app.logger.exception("Failed to write %d %s (attempt %d), will retry",
+                                          self._pending_count(), self.what, failures)
+
+    def _add_pending(self, item):
+        with self._pending_lock:
+            self._pending.append(item)
+            return len(self._pending)
+
+    def _pending_count(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def _restore(self, items):
+        # Back in front of anything that arrived since, so order is kept
+        with self._pending_lock:
+            self._pending[:0] = items
+
+    def _write_pending(self):
+        # Hold the write lock while taking the batch so a shutdown flush
+        # waits for an in-progress write instead of racing it.
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            for start in range(0, len(batch), self.batch_size):
+                try:
+                    self._write(batch[start:start + self.batch_size])
+                except Exception:
+                    self._restore(batch[start:])
+                    raise
+
+    def _write_each(self):
+        """Write pending items one at a time, dropping the ones that fail if any others succeed."""
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            failed = []
+            for item in batch:
+                try:
+                    self._write([item])
+                except Exception:
+                    failed.append(item)
+            if failed and len(failed) == len(batch):
+                self._restore(failed)
+                raise RuntimeError(f"none of {len(batch)} {self.what} could be written")
+            if failed:
+                self._count('flasksocial_background_items_dropped_total', len(failed))
+                self.app.logger.error("Dropped %d %s that could not be written", len(failed), self.what)
+
+    def _count(self, name, amount=1):
+        from app import metrics
+        metrics.inc(name, (self.task,), amount)
+
+    def _write(self, batch):
+        raise NotImplementedError
+
+
+class MessageWriter(BatchWriter):
+    """Private messages, grouped into their conversations."""
+
+    what = 'private messages'
+    task = 'message_writer'
+
+    def init_app(self, app):
+        self.configure(app, app.config.get('MESSAGE_WRITE_MODE', 'sync'))
+        app.extensions['message_writer'] = self
+
+    def submit(self, sender_id, recipient_id, body, timestamp):
+        return self.submit_item((sender_id, recipient_id, body, timestamp))
+
+    def _write(self, batch):
+        from app import db
+        from app.models import Message, Conversation
+
+        with self.app.app_context():
+            try:
+                by_pair = {}
+                for sender_id, recipient_id, body, timestamp in batch:
+                    by_pair.setdefault(Conversation.pair(sender_id, recipient_id), []).append(
+                        Message(sender_id=sender_id, recipient_id=recipient_id,
+                                body=body, timestamp=timestamp))
+                for pair, messages in by_pair.items():
+                    conversation = Conversation.get_or_create(*pair)
+                    for msg in messages:
+                        msg.conversation_id = conversation.id
+                    db.session.add_all(messages)
+                    conversation.record_messages(messages)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+class ChatMessageWriter(BatchWriter):
+    """Public chat room messages."""
+
+    what = 'chat messages'
+    task = 'chat_message_writer'
+
+    def init_app(self, app):
+        self.configure(app, 'batched')
+        app.extensions['chat_message_writer'] = self
+
+    def submit(self, room, user_id, body, timestamp):
+        return self.submit_item((room, user_id, body, timestamp))
+
+    def _write(self, batch):
+        from app import db
+        from app.models import ChatMessage
+
+        with self.app.app_context():
+            try:
+                db.session.add_all([ChatMessage(room=room, user_id=user_id, body=body, timestamp=timestamp)
+                                    for room, user_id, body, timestamp in batch])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+class NotificationWriter(BatchWriter):
+    """Notifications for users who were offline when they were sent."""
+
+    what = 'notifications'
+    task = 'notification_writer'
+
+    def init_app(self, app):
+        self.configure(app, 'batched')
+        app.extensions['notification_writer'] = self
+
+    def submit(self, user_id, kind, payload, created_at):
+        return self.submit_item((user_id, kind, payload, created_at))
+
+    def _write(self, batch):
+        from app import db
+        from app.models import Notification
+
+        with self.app.app_context():
+            try:
+                db.session.add_all([Notification(user_id=user_id, kind=kind, payload=json.dumps(payload),
+                                                 created_at=created_at)
+                                    for user_id, kind, payload, created_at in batch])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+class TimelineWriter(BatchWriter):
+    """Fan-out of new posts into followers' timelines (see app/timelines.py)."""
+
+    what = 'timeline fan-outs'
+    task = 'timeline_writer'
+
+    def init_app(self, app):
+        self.configure(app, 'batched')
+        app.extensions['timeline_writer'] = self
+
+    def submit(self, post_id, author_id, date_posted, notice):
+        return self.submit_item((post_id, author_id, date_posted, notice))
+
+    def _write(self, batch):
+        from app import db, notifier, timelines
+
+        with self.app.app_context():
+            try:
+                delivered = timelines.fan_out(batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        # Only once it is committed, so a follower who reloads sees the post;
+        # followers who are offline get it from the notification queue
+        for notice, followers in delivered:
+            notifier.notify_many(followers, 'post', notice)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Reproducible load test for the main HTTP routes and Socket.IO events.
+
+Seeds a fresh database through create_app() with the chosen Config (N
+users, M posts, K private messages, follows), starts the app in a
+subprocess patched like run.py, then runs each scenario in turn:
+
+  HTTP    home, home_page2, timeline, post, inbox, private_chat, api_feed
+          --http-clients sessions requesting in a loop for --duration s
+  socket  private_message   sender -> its own echo of 'new_private_message'
+          webrtc_signal     caller -> callee relay of a 'webrtc_signal'
+          --socket-pairs pairs of clients sending for --duration s
+
+For every scenario it reports p50/p99/mean latency, throughput, errors,
+SQL statements per request (from the server's /metrics) and the server's
+RSS. Results are printed and, with --output, written as JSON; --compare
+prints the change between two saved runs.
+
+    python benchmarks/load_test.py --users 1000 --posts 20000 --messages 50000 --output before.json
+    python benchmarks/load_test.py ... --output after.json
+    python benchmarks/load_test.py --compare before.json after.json
+
+Config overrides go through the environment, as in production:
+    python benchmarks/load_test.py --env CACHE_TYPE=null --env FEED_PAGE_SIZE=20
+
+Set DATABASE_URL to benchmark against PostgreSQL instead of a temporary
+SQLite file (the database must be empty). Needs the python-socketio
+client extras and requests: pip install "python-socketio[client]" requests
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from socket_capacity import ROOT, SECRET_KEY, percentile, free_port, wait_for_port
+
+METRICS_TOKEN = 'benchmark-metrics'
+HTTP_SCENARIOS = ('home', 'home_page2', 'timeline', 'post', 'inbox', 'private_chat', 'api_feed')
+SOCKET_SCENARIOS = ('private_message', 'webrtc_signal')
+# Handler label in flasksocial_db_queries for each scenario
+HANDLERS = {
+    'home': 'main.home', 'home_page2': 'main.home', 'timeline': 'main.timeline', 'post': 'main.post',
+    'inbox': 'main.messages', 'private_chat': 'main.private_chat', 'api_feed': 'main.api_feed',
+    'private_message': 'event:private_message', 'webrtc_signal': 'event:webrtc_signal',
+}
+
+
+def load_config(path):
+    """'module:ClassName' -> the class."""
+    module, _, name = path.partition(':')
+    sys.path.insert(0, ROOT)
+    return getattr(importlib.import_module(module), name or 'Config')
+
+
+def serve(port, config_path):
+    """Subprocess entry point: patch like run.py, build the app with the config and serve it."""
+    sys.path.insert(0, ROOT)
+    from config import Config
+    from patching import monkey_patch
+    mode = Config.ASYNC_MODE
+    monkey_patch(mode)
+    from app import create_app, socketio
+    app = create_app(load_config(config_path))
+    kwargs = {'allow_unsafe_werkzeug': True} if mode == 'threading' else {}
+    socketio.run(app, host='127.0.0.1', port=port, debug=False, log_output=False, **kwargs)
+
+
+def seed(args):
+    """Fill the database and return what the scenarios need: cookies, post ids and chat pairs."""
+    config = load_config(args.config)
+    from sqlalchemy import insert
+    from app import create_app, db, bcrypt, timelines
+    from app.models import User, Post, Message, Follow, backfill_conversations
+
+    rng = random.Random(args.seed)
+    app = create_app(config)
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        pw_hash = bcrypt.generate_password_hash('benchmark-password').decode('utf-8')
+        db.session.execute(insert(User), [
+            {'username': f'load{i}', 'email': f'load{i}@example.com', 'password_hash': pw_hash}
+            for i in range(args.users)])
+        user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+
+        now = datetime.utcnow()
+        for start in range(0, args.posts, 5000):
+            db.session.execute(insert(Post), [
+                {'title': f'Post {i}', 'content': f'Benchmark post {i} ' * 10,
+                 'user_id': rng.choice(user_ids), 'date_posted': now - timedelta(minutes=args.posts - i)}
+                for i in range(start, min(start + 5000, args.posts))])
+
+        follows = set()
+        for follower_id in user_ids:
+            for followed_id in rng.sample(user_ids, min(args.follows, len(user_ids))):
+                if followed_id != follower_id:
+                    follows.add((follower_id, followed_id))
+        if follows:
+            db.session.execute(insert(Follow), [{'follower_id': a, 'followed_id': b} for a, b in follows])
+
+        # Messages go to a fixed set of pairs so conversations get some depth
+        pairs = [tuple(rng.sample(user_ids, 2)) for _ in range(max(1, args.conversations))]
+        for start in range(0, args.messages, 5000):
+            rows = []
+            for i in range(start, min(start + 5000, args.messages)):
+                sender_id, recipient_id = pairs[i % len(pairs)]
+                if i % 2:
+                    sender_id, recipient_id = recipient_id, sender_id
+                rows.append({'sender_id': sender_id, 'recipient_id': recipient_id, 'body': f'message {i}',
+                             'timestamp': now - timedelta(seconds=args.messages - i)})
+            db.session.execute(insert(Message), rows)
+        db.session.commit()
+        backfill_conversations()
+        timelines.rebuild()
+
+        usernames = dict(db.session.query(User.id, User.username))
+        post_ids = [pid for (pid,) in db.session.query(Post.id)]
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = {uid: serializer.dumps({'_user_id': str(uid), '_fresh': True}) for uid in user_ids}
+    return {
+        'cookies': cookies,
+        'usernames': usernames,
+        'post_ids': post_ids,
+        'pairs': pairs,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def rss_kb(pid):
+    """(current, peak) resident set size of pid in KiB, from /proc (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def query_totals(base_url):
+    """{handler: (sum of statements, number of requests)} from the server's /metrics."""
+    import requests
+
+    text = requests.get(f'{base_url}/metrics', headers={'Authorization': f'Bearer {METRICS_TOKEN}'}).text
+    totals = {}
+    for line in text.splitlines():
+        for suffix, index in (('_sum', 0), ('_count', 1)):
+            prefix = f'flasksocial_db_queries{suffix}{{handler="'
+            if line.startswith(prefix):
+                handler, value = line[len(prefix):].split('"} ')
+                totals.setdefault(handler, [0, 0])[index] = float(value)
+    return totals
+
+
+def summarize(name, latencies, errors, elapsed, before, after, rss_before, rss_after):
+    def ms(pct):
+        value = percentile(latencies, pct)
+        return round(value * 1000, 2) if value is not None else None
+
+    handler = HANDLERS[name]
+    queries, requests_seen = (a - b for a, b in zip(after.get(handler, (0, 0)), before.get(handler, (0, 0))))
+    return {
+        'scenario': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(50),
+        'p99_ms': ms(99),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'queries_per_request': round(queries / requests_seen, 2) if requests_seen else None,
+        'server_rss_kb': rss_after[0],
+        'server_rss_growth_kb': rss_after[0] - rss_before[0] if rss_after[0] and rss_before[0] else None,
+        'server_peak_rss_kb': rss_after[1],
+    }
+
+
+def http_scenario(name, base_url, data, args):
+    import requests
+
+    rng = random.Random(args.seed)
+    user_ids = list(data['cookies'])
+    second_page = None
+    if name == 'home_page2':
+        first = requests.get(f'{base_url}/api/feed').json()
+        second_page = first.get('next_cursor')
+
+    def path():
+        if name in ('home', 'timeline', 'inbox'):
+            return {'home': '/', 'timeline': '/timeline', 'inbox': '/messages'}[name]
+        if name == 'home_page2':
+            return f'/?cursor={quote(second_page)}' if second_page else '/'
+        if name == 'api_feed':
+            return '/api/feed'
+        if name == 'post':
+            return f'/post/{rng.choice(data["post_ids"])}'
+        return None
+
+    def worker(i):
+        if name == 'private_chat':
+            user_id, peer_id = data['pairs'][i % len(data['pairs'])]
+        else:
+            user_id, peer_id = user_ids[i % len(user_ids)], None
+        session = requests.Session()
+        session.cookies.set('session', data['cookies'][user_id])
+        latencies, errors = [], 0
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            url = base_url + (path() or f'/messages/{data["usernames"][peer_id]}')
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, allow_redirects=False).status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.http_clients) as pool:
+        results = list(pool.map(worker, range(args.http_clients)))
+    return ([t for latencies, _ in results for t in latencies], sum(e for _, e in results),
+            time.perf_counter() - started)
+
+
+def socket_scenario(name, base_url, data, args):
+    import socketio
+
+    # Disjoint pairs, so no two pairs share a chat room or a call
+    user_ids = list(data['cookies'])
+    random.Random(args.seed).shuffle(user_ids)
+    pairs = list(zip(user_ids[0::2], user_ids[1::2]))[:args.socket_pairs]
+
+    def connect(user_id):
+        client = socketio.Client(reconnection=False)
+        client.connect(base_url, headers={'Cookie': f'session={data["cookies"][user_id]}'},
+                       transports=['websocket'], wait_timeout=args.timeout)
+        return client
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def run_pair(pair):
+        user_id, peer_id = pair
+        sender, receiver = connect(user_id), connect(peer_id)
+        arrived = threading.Event()
+        # The sender sees its own message echoed to the room (in either
+        # SOCKETIO_WIRE_FORMAT); the callee sees the relayed signal
+        if name == 'private_message':
+            for event_name in ('new_private_message', 'private_batch'):
+                sender.on(event_name, lambda *a: arrived.set())
+        else:
+            receiver.on('webrtc_signal', lambda *a: arrived.set())
+        try:
+            if name == 'private_message':
+                room = sender.call('join', {'username': data['usernames'][peer_id]}, timeout=args.timeout)['room']
+            else:
+                room = sender.call('join_call', {'username': data['usernames'][peer_id]}, timeout=args.timeout)['room']
+                receiver.call('join_call', {'username': data['usernames'][user_id]}, timeout=args.timeout)
+            deadline = time.monotonic() + args.duration
+            local = []
+            while time.monotonic() < deadline:
+                arrived.clear()
+                start = time.perf_counter()
+                if name == 'private_message':
+                    sender.emit('private_message', {'room': room, 'message': 'benchmark'})
+                else:
+                    sender.emit('webrtc_signal', {'room': room, 'signal': {'type': 'candidates', 'candidates': []}})
+                if arrived.wait(args.timeout):
+                    local.append(time.perf_counter() - start)
+                else:
+                    with lock:
+                        errors[0] += 1
+            with lock:
+                latencies.extend(local)
+        except Exception:
+            with lock:
+                errors[0] += 1
+        finally:
+            sender.disconnect()
+            receiver.disconnect()
+
+    with ThreadPoolExecutor(max_workers=args.socket_pairs) as pool:
+        list(pool.map(run_pair, pairs))
+    # Pairs send concurrently for --duration once connected; connecting isn't timed
+    return latencies, errors[0], args.duration
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = {r['scenario']: r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {r['scenario']: r for r in json.load(f)['results']}
+    print(f"{'scenario':<18}" + ''.join(f"{h:>28}" for h in ('p50 ms', 'p99 ms', 'req/s', 'queries/request')))
+    for name in new:
+        if name not in old:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p99_ms', 'throughput_per_s', 'queries_per_request'):
+            a, b = old[name].get(key), new[name].get(key)
+            change = f" ({(b - a) / a * 100:+.0f}%)" if a and b is not None else ''
+            cells.append(f"{a} -> {b}{change}")
+        print(f"{name:<18}" + ''.join(f"{cell:>28}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default='config:Config', help='Config class as module:Class')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='environment variable for the config (repeatable)')
+    parser.add_argument('--mode', default='eventlet', help='ASYNC_MODE for the server')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--conversations', type=int, default=50, help='user pairs the messages are spread over')
+    parser.add_argument('--follows', type=int, default=20, help='users each user follows')
+    parser.add_argument('--scenarios', nargs='+', default=list(HTTP_SCENARIOS + SOCKET_SCENARIOS),
+                        choices=HTTP_SCENARIOS + SOCKET_SCENARIOS)
+    parser.add_argument('--http-clients', type=int, default=20)
+    parser.add_argument('--socket-pairs', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=1, help='random seed for data and request order')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two JSON results and exit')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.serve:
+        serve(args.port, args.config)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SECRET_KEY=SECRET_KEY, ASYNC_MODE=args.mode, METRICS_TOKEN=METRICS_TOKEN,
+                   METRICS_ENABLED='1', METRICS_DIR='')
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        env.update(item.split('=', 1) for item in args.env)
+        os.environ.update(env)
+        data = seed(args)
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, __file__, '--serve', '--port', str(port),
+                                   '--config', args.config],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        results = []
+        try:
+            wait_for_port(port)
+            base_url = f'http://127.0.0.1:{port}'
+            for name in args.scenarios:
+                before, rss_before = query_totals(base_url), rss_kb(server.pid)
+                run = http_scenario if name in HTTP_SCENARIOS else socket_scenario
+                latencies, errors, elapsed = run(name, base_url, data, args)
+                result = summarize(name, latencies, errors, elapsed, before, query_totals(base_url),
+                                   rss_before, rss_kb(server.pid))
+                print(json.dumps(result))
+                results.append(result)
+        finally:
+            server.terminate()
+            server.wait()
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        'commit': commit,
+        'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'mode': args.mode,
+        'config': args.config,
+        'env': args.env,
+        'seed': {'users': args.users, 'posts': args.posts, 'messages': args.messages,
+                 'conversations': args.conversations, 'follows': args.follows, 'seconds': data['seconds']},
+        'load': {'http_clients': args.http_clients, 'socket_pairs': args.socket_pairs,
+                 'duration': args.duration},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
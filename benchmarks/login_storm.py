@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Socket.IO latency while a burst of logins is being hashed.
+
+For each PASSWORD_HASH_WORKERS setting it starts the app in a subprocess
+(patched exactly like run.py), keeps one Socket.IO client sending an
+acknowledged event every --interval seconds, and then fires --logins
+concurrent logins. It reports the event round-trip percentiles before
+and during the storm, plus login outcomes. With workers=0 bcrypt runs
+inline and the round trips during the storm show the event loop stalls.
+
+    python benchmarks/login_storm.py --workers 0 2 --logins 50 --rounds 12
+
+Needs the python-socketio client extras and requests:
+pip install "python-socketio[client]" requests
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from socket_capacity import ROOT, SECRET_KEY, percentile, free_port, wait_for_port
+
+PASSWORD = 'benchmark-password'
+
+
+def serve(port):
+    """Subprocess entry point: patch, build the app and serve it."""
+    sys.path.insert(0, ROOT)
+    import run  # monkey-patches for ASYNC_MODE, then creates the app
+    kwargs = {'allow_unsafe_werkzeug': True} if run.ASYNC_MODE == 'threading' else {}
+    run.socketio.run(run.app, host='127.0.0.1', port=port, debug=False, log_output=False, **kwargs)
+
+
+def seed(users):
+    """Create users sharing one password; return a session cookie for the probe client."""
+    sys.path.insert(0, ROOT)
+    from app import create_app, db, bcrypt
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        pw_hash = bcrypt.generate_password_hash(PASSWORD).decode('utf-8')
+        db.session.add_all([User(username=f'storm{i}', email=f'storm{i}@example.com',
+                                 password_hash=pw_hash) for i in range(users + 1)])
+        db.session.commit()
+        probe_id = User.query.filter_by(username=f'storm{users}').first().id
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'_user_id': str(probe_id), '_fresh': True})
+
+
+def login(base_url, i):
+    import requests
+
+    client = requests.Session()
+    page = client.get(f'{base_url}/login')
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page.text)
+    start = time.perf_counter()
+    response = client.post(f'{base_url}/login', allow_redirects=False, data={
+        'csrf_token': token.group(1) if token else '',
+        'email': f'storm{i}@example.com',
+        'password': PASSWORD,
+    })
+    return response.status_code, time.perf_counter() - start
+
+
+def run_setting(workers, cookie, args, env):
+    import socketio
+
+    port = free_port()
+    env = dict(env, PASSWORD_HASH_WORKERS=str(workers))
+    server = subprocess.Popen([sys.executable, __file__, '--serve', '--port', str(port)],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        base_url = f'http://127.0.0.1:{port}'
+        probe = socketio.Client(reconnection=False)
+        probe.connect(base_url, headers={'Cookie': f'session={cookie}'}, transports=['websocket'])
+
+        samples = []  # (sent_at, rtt)
+        stop = threading.Event()
+
+        def probe_loop():
+            while not stop.is_set():
+                sent_at = time.perf_counter()
+                try:
+                    probe.call('join', {'username': 'probe', 'room': 'storm-probe'}, timeout=30)
+                    samples.append((sent_at, time.perf_counter() - sent_at))
+                except Exception:
+                    pass
+                stop.wait(args.interval)
+
+        prober = threading.Thread(target=probe_loop)
+        prober.start()
+        time.sleep(args.warmup)
+        storm_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.logins) as pool:
+            results = list(pool.map(lambda i: login(base_url, i), range(args.logins)))
+        storm_end = time.perf_counter()
+        stop.set()
+        prober.join()
+        probe.disconnect()
+    finally:
+        server.terminate()
+        server.wait()
+
+    before = [rtt for sent_at, rtt in samples if sent_at < storm_start]
+    during = [rtt for sent_at, rtt in samples if storm_start <= sent_at <= storm_end]
+    login_times = [t for status, t in results if status == 302]
+
+    def ms(values, pct):
+        return round(percentile(values, pct) * 1000, 2) if values else None
+
+    return {
+        'workers': workers,
+        'logins': args.logins,
+        'logged_in': sum(1 for status, _ in results if status == 302),
+        'rejected_429': sum(1 for status, _ in results if status == 429),
+        'storm_seconds': round(storm_end - storm_start, 2),
+        'login_p50_ms': ms(login_times, 50),
+        'login_p99_ms': ms(login_times, 99),
+        'rtt_before_p50_ms': ms(before, 50),
+        'rtt_before_p99_ms': ms(before, 99),
+        'rtt_during_p50_ms': ms(during, 50),
+        'rtt_during_p99_ms': ms(during, 99),
+        'rtt_during_max_ms': round(max(during) * 1000, 2) if during else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, 2],
+                        help='PASSWORD_HASH_WORKERS values to compare')
+    parser.add_argument('--mode', default='eventlet', help='ASYNC_MODE for the server')
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_LOG_ROUNDS')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between probe events')
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SECRET_KEY=SECRET_KEY, CACHE_TYPE='null', ASYNC_MODE=args.mode,
+                   BCRYPT_LOG_ROUNDS=str(args.rounds),
+                   # Every login comes from 127.0.0.1, so lift the per-client cap
+                   PASSWORD_HASH_PER_IP=str(args.logins), PASSWORD_HASH_QUEUE_MAX=str(args.logins),
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        os.environ.update(env)
+        cookie = seed(args.logins)
+        results = [run_setting(workers, cookie, args, env) for workers in args.workers]
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Concurrent-connection capacity of the Socket.IO server per ASYNC_MODE.
+
+For each mode it starts the app in a subprocess (patched exactly like
+run.py), opens --clients authenticated Socket.IO connections at once and
+then sends one acknowledged event per client. It reports how many
+connected, connect time and event round-trip percentiles.
+
+    python benchmarks/socket_capacity.py --modes eventlet gevent threading asgi --clients 500
+
+Needs the python-socketio client extras: pip install "python-socketio[client]"
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = 'benchmark-secret'
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+
+
+def serve(mode, port):
+    """Subprocess entry point: patch, build the app and serve it."""
+    os.environ['ASYNC_MODE'] = mode
+    sys.path.insert(0, ROOT)
+    import run  # monkey-patches for the mode, then creates the app
+    if mode == 'asgi':
+        import uvicorn
+        uvicorn.run(run.app, host='127.0.0.1', port=port, log_level='warning')
+        return
+    kwargs = {'allow_unsafe_werkzeug': True} if mode == 'threading' else {}
+    run.socketio.run(run.app, host='127.0.0.1', port=port, debug=False, log_output=False, **kwargs)
+
+
+def seed(users):
+    """Create users and return a signed session cookie for each."""
+    sys.path.insert(0, ROOT)
+    from app import create_app, db
+    from app.models import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(username=f'bench{i}', email=f'bench{i}@example.com',
+                                 password_hash='x') for i in range(users)])
+        db.session.commit()
+        ids = [u.id for u in User.query.order_by(User.id).all()]
+    serializer = app.session_interface.get_signing_serializer(app)
+    return [serializer.dumps({'_user_id': str(uid), '_fresh': True}) for uid in ids]
+
+
+def run_mode(mode, cookies, port, env, timeout):
+    import socketio
+
+    server = subprocess.Popen([sys.executable, __file__, '--serve', mode, '--port', str(port)],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+
+        def connect(cookie):
+            client = socketio.Client(reconnection=False)
+            start = time.perf_counter()
+            try:
+                client.connect(f'http://127.0.0.1:{port}', headers={'Cookie': f'session={cookie}'},
+                               transports=['websocket'], wait_timeout=timeout)
+            except Exception:
+                return None, None
+            return client, time.perf_counter() - start
+
+        def round_trip(args):
+            i, client = args
+            start = time.perf_counter()
+            try:
+                client.call('join', {'username': f'bench{i}', 'room': f'bench-{i}'}, timeout=timeout)
+            except Exception:
+                return None
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=len(cookies)) as pool:
+            connected = list(pool.map(connect, cookies))
+            clients = [c for c, _ in connected if c is not None]
+            connect_times = [t for _, t in connected if t is not None]
+            rtts = [t for t in pool.map(round_trip, enumerate(clients)) if t is not None]
+            list(pool.map(lambda c: c.disconnect(), clients))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'mode': mode,
+        'clients': len(cookies),
+        'connected': len(clients),
+        'connect_p50_ms': round(percentile(connect_times, 50) * 1000, 2) if connect_times else None,
+        'connect_p99_ms': round(percentile(connect_times, 99) * 1000, 2) if connect_times else None,
+        'events_ok': len(rtts),
+        'rtt_p50_ms': round(percentile(rtts, 50) * 1000, 2) if rtts else None,
+        'rtt_p99_ms': round(percentile(rtts, 99) * 1000, 2) if rtts else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['eventlet', 'gevent', 'threading', 'asgi'])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SECRET_KEY=SECRET_KEY, CACHE_TYPE='null',
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        os.environ.update(env)
+        cookies = seed(args.clients)
+        results = [run_mode(mode, cookies, free_port(), env, args.timeout) for mode in args.modes]
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cold-start time of the app, as a new worker or release sees it.
+
+Each run is a fresh interpreter that times, in order:
+  import        importing the app package (extensions, models, routes)
+  create_app    create_app() with the chosen Config, template preload included
+  first_request the first GET of --path through the test client
+  schema_check  the at-head check render_start.py runs (upgrade_schema)
+plus the wall time of `render_start.py --check-only` as a whole. The
+first run starts with an empty template cache; later runs reuse it, as
+workers after a release do.
+
+    python benchmarks/startup_time.py --runs 5 --output startup.json
+    python benchmarks/startup_time.py --env TEMPLATE_PRELOAD=0
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from socket_capacity import ROOT, SECRET_KEY
+
+PHASES = ('import', 'create_app', 'first_request', 'schema_check')
+
+
+def measure(path):
+    """Child process: time each phase and print them as JSON."""
+    timings = {}
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from app.schema import upgrade_schema
+    timings['import'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app = create_app()
+    timings['create_app'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    status = app.test_client().get(path).status_code
+    timings['first_request'] = time.perf_counter() - started
+
+    with app.app_context():
+        _, timings['schema_check'] = upgrade_schema(check_only=True)
+    print(json.dumps({'status': status, 'timings': timings}))
+
+
+def prepare(env):
+    """Bring the benchmark database to head once, as a release would."""
+    subprocess.run([sys.executable, os.path.join(ROOT, 'render_start.py')], env=env, cwd=ROOT,
+                   check=True, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/login', help='page requested first')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='environment variable for the config (repeatable)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SECRET_KEY=SECRET_KEY, ASYNC_MODE='threading', CACHE_TYPE='null',
+                   TEMPLATE_CACHE_DIR=os.path.join(tmp, 'templates'))
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        env.update(item.split('=', 1) for item in args.env)
+        prepare(env)
+        # Start cold: render_start.py filled the template cache
+        shutil.rmtree(env['TEMPLATE_CACHE_DIR'], ignore_errors=True)
+
+        runs = []
+        for _ in range(args.runs):
+            child = subprocess.run([sys.executable, __file__, '--measure', '--path', args.path],
+                                   env=env, capture_output=True, text=True, check=True)
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            started = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(ROOT, 'render_start.py'), '--check-only'],
+                           env=env, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            result['timings']['check_only_total'] = time.perf_counter() - started
+            runs.append(result)
+            print(json.dumps({phase: round(t * 1000, 1) for phase, t in result['timings'].items()}))
+
+    def ms(values):
+        return round(statistics.median(values) * 1000, 1)
+
+    report = {
+        'env': args.env,
+        'path': args.path,
+        'runs': args.runs,
+        'cold_ms': {phase: round(t * 1000, 1) for phase, t in runs[0]['timings'].items()},
+        'warm_median_ms': {phase: ms([run['timings'][phase] for run in runs[1:]])
+                           for phase in PHASES + ('check_only_total',)} if len(runs) > 1 else None,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Bytes and CPU per message for each SOCKETIO_WIRE_FORMAT and batch size.
+
+Builds the frames app/wire.py sends for a stream of synthetic private and
+public chat messages, encodes them the way python-socketio does for a
+room broadcast (once per emit) and reports, per message:
+  bytes          on the wire before compression
+  deflated       after permessage-deflate, one stream per client as a
+                 browser negotiates it (context takeover, sync flush)
+  frames         websocket frames each client receives
+  encode_us      server CPU building and encoding the frames (paid once per emit)
+  deflate_us     server CPU compressing them (paid once per client)
+
+    python benchmarks/wire_format.py --messages 5000 --batch 1 10 50 --output wire.json
+
+The 'msgpack' format is skipped unless the msgpack package is installed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from socketio import packet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.wire import FORMATS, Wire, chat_frame, private_frame, verbose_chat, verbose_private
+from app.chat_rooms import chat_message_to_dict
+
+WORDS = ('hey', 'are', 'you', 'coming', 'to', 'the', 'meeting', 'later', 'yes', 'ok', 'see', 'soon', 'lol')
+
+
+def synthetic(count, seed):
+    rng = random.Random(seed)
+    users = [(i, f'user{i:04d}') for i in range(1, 21)]
+    start = datetime(2026, 1, 1)
+    return [(rng.choice(users), ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 12))),
+             start + timedelta(seconds=i)) for i in range(count)]
+
+
+def frames_for(kind, fmt, batch, messages):
+    """(event, data) pairs sent for the messages, batch at a time in the compact formats."""
+    frames = []
+    if fmt == 'json' or batch == 0:
+        batch = 1
+    for start in range(0, len(messages), batch):
+        chunk = messages[start:start + batch]
+        if kind == 'private':
+            if fmt == 'json':
+                frames += [('new_private_message', verbose_private(name, 'peer', body, ts))
+                           for (_, name), body, ts in chunk]
+            else:
+                frames.append(('private_batch', private_frame('dm:1:2', [(uid, ts, body)
+                                                                          for (uid, _), body, ts in chunk])))
+        else:
+            records = [chat_message_to_dict('general', uid, name, body, ts) for (uid, name), body, ts in chunk]
+            if fmt == 'json':
+                frames += [('message_response', verbose_chat(record)) for record in records]
+            else:
+                frames.append(('chat_batch', chat_frame('general', records)))
+    return frames
+
+
+def measure(kind, fmt, batch, messages, wire):
+    started = time.perf_counter()
+    encoded = []
+    for event, data in frames_for(kind, fmt, batch, messages):
+        pkt = packet.Packet(packet.EVENT, namespace='/', data=[event, wire.encode(data)]).encode()
+        encoded.extend(pkt if isinstance(pkt, list) else [pkt])
+    encode_time = time.perf_counter() - started
+
+    # Engine.IO prefixes text frames with '4'; binary attachments go as they are
+    raw = [b'4' + p.encode() if isinstance(p, str) else p for p in encoded]
+    deflater = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    started = time.perf_counter()
+    deflated = sum(len(deflater.compress(p) + deflater.flush(zlib.Z_SYNC_FLUSH)) - 4 for p in raw)
+    deflate_time = time.perf_counter() - started
+
+    n = len(messages)
+    return {
+        'kind': kind,
+        'format': fmt,
+        'batch': batch if fmt != 'json' else 1,
+        'bytes': round(sum(len(p) for p in raw) / n, 1),
+        'deflated': round(deflated / n, 1),
+        'frames': round(len(raw) / n, 3),
+        'encode_us': round(encode_time / n * 1e6, 2),
+        'deflate_us': round(deflate_time / n * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 50],
+                        help='messages per compact frame (bursts collected within SOCKETIO_BATCH_MS)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    messages = synthetic(args.messages, args.seed)
+    results = []
+    for fmt in FORMATS:
+        wire = Wire()
+        wire.format = fmt
+        if fmt == 'msgpack':
+            try:
+                import msgpack
+            except ImportError:
+                print("msgpack not installed, skipping the 'msgpack' format")
+                continue
+            wire._packb = msgpack.packb
+        for kind in ('private', 'chat'):
+            for batch in ([1] if fmt == 'json' else args.batch):
+                result = measure(kind, fmt, batch, messages, wire)
+                print(json.dumps(result))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'messages': args.messages, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,19 +12,208 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL or 'sqlite:///site.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
-    # SQLAlchemy engine options to fix threading issues
+    # SQLAlchemy engine options to fix threading issues. Pool sizes are
+    # env-configurable: with green threads many handlers can wait on the DB
+    # at once, so the default allows some overflow.
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
-        'pool_recycle': 300,
-        'pool_timeout': 20,
-        'max_overflow': 0,
-        'pool_size': 5
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5))
     }
+
+    # Optional read replicas (comma-separated URLs), one bind each with its
+    # own pool. Reads in read-only pages go to them; a client's reads stay
+    # on the primary for DB_REPLICA_STICKY_SECONDS after it writes.
+    DATABASE_REPLICA_URLS = [url.strip().replace('postgres://', 'postgresql://', 1)
+                             for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {
+        f'replica{i}': {'url': url,
+                        'pool_size': int(os.environ.get('DB_REPLICA_POOL_SIZE', 5)),
+                        'max_overflow': int(os.environ.get('DB_REPLICA_MAX_OVERFLOW', 10))}
+        for i, url in enumerate(DATABASE_REPLICA_URLS)
+    }
+    DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
     
+    # bcrypt cost; existing hashes are upgraded on the next login after a change
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Password hashing runs on this many OS threads (0 = inline); callers past
+    # the queue limit or the per-client limit get HTTP 429
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_MAX = int(os.environ.get('PASSWORD_HASH_QUEUE_MAX', 32))
+    PASSWORD_HASH_PER_IP = int(os.environ.get('PASSWORD_HASH_PER_IP', 2))
+
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is
+    # trusted, so per-client limits see the real client address
+    PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0))
+
+    # Number of posts per feed page (keyset-paginated)
+    FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 10))
+
+    # Personal timelines are copied to followers when a post is published,
+    # except for authors with TIMELINE_FANOUT_LIMIT+ followers, whose posts
+    # are merged in at read time. Following someone copies their newest
+    # TIMELINE_FOLLOW_BACKFILL posts; a rebuild keeps TIMELINE_REBUILD_DEPTH.
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT', 5000))
+    TIMELINE_FOLLOW_BACKFILL = int(os.environ.get('TIMELINE_FOLLOW_BACKFILL', 50))
+    TIMELINE_REBUILD_DEPTH = int(os.environ.get('TIMELINE_REBUILD_DEPTH', 500))
+
+    # Likes, comments and views are summed in memory and written to the
+    # post's totals every COUNTER_FLUSH_INTERVAL seconds
+    COUNTER_FLUSH_INTERVAL = float(os.environ.get('COUNTER_FLUSH_INTERVAL', 2))
+    # Number of comments per page under a post
+    COMMENT_PAGE_SIZE = int(os.environ.get('COMMENT_PAGE_SIZE', 20))
+
+    # Number of private messages per history page
+    MESSAGE_PAGE_SIZE = int(os.environ.get('MESSAGE_PAGE_SIZE', 50))
+
+    # Number of conversations per inbox page
+    INBOX_PAGE_SIZE = int(os.environ.get('INBOX_PAGE_SIZE', 20))
+
+    # Number of results per search page, and how many pages can be reached
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 10))
+    SEARCH_MAX_PAGES = int(os.environ.get('SEARCH_MAX_PAGES', 10))
+
+    # Private message persistence: 'sync' commits each message before it is
+    # emitted; 'batched' emits immediately and coalesces inserts in the background
+    MESSAGE_WRITE_MODE = os.environ.get('MESSAGE_WRITE_MODE', 'sync')
+    MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', 100))
+    MESSAGE_BATCH_INTERVAL_MS = int(os.environ.get('MESSAGE_BATCH_INTERVAL_MS', 50))
+    MESSAGE_QUEUE_MAX = int(os.environ.get('MESSAGE_QUEUE_MAX', 5000))
+    MESSAGE_QUEUE_TIMEOUT = float(os.environ.get('MESSAGE_QUEUE_TIMEOUT', 1.0))
+    # A batch that fails is retried with backoff up to this many seconds apart;
+    # after MESSAGE_WRITE_RETRIES failures, items that can't be written are dropped
+    MESSAGE_RETRY_MAX_INTERVAL = float(os.environ.get('MESSAGE_RETRY_MAX_INTERVAL', 30))
+    MESSAGE_WRITE_RETRIES = int(os.environ.get('MESSAGE_WRITE_RETRIES', 5))
+
+    # Page/fragment cache: 'memory' (per-process LRU), 'redis' or 'null'
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'memory')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+
+    # Cached user snapshots for the login user loader. The local TTL bounds how
+    # long other workers can show a stale username/picture after a change.
+    IDENTITY_CACHE_ENABLED = os.environ.get('IDENTITY_CACHE_ENABLED', '1') == '1'
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('IDENTITY_CACHE_MAX_ENTRIES', 4096))
+    # Optional shared layer so a new worker doesn't start cold
+    IDENTITY_CACHE_REDIS_URL = os.environ.get('IDENTITY_CACHE_REDIS_URL')
+    IDENTITY_CACHE_SHARED_TTL = int(os.environ.get('IDENTITY_CACHE_SHARED_TTL', 300))
+
+    # Server concurrency model: 'eventlet', 'gevent', 'threading' or 'asgi'.
+    # run.py monkey-patches to match before importing the app, and the
+    # gunicorn --worker-class must agree (eventlet / gevent / gthread /
+    # uvicorn_worker.UvicornWorker). Processes that weren't patched (scripts,
+    # tests) run as 'threading' (see patching.py).
+    ASYNC_MODE = os.environ.get('ASYNC_MODE') or 'eventlet'
+    # 'asgi' only: threads for Socket.IO handlers, and as many for Flask routes
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 16))
+
+    # Profile pictures: generated square sizes, upload limits, and how many
+    # processes resize them (0 = resize inside the request)
+    AVATAR_SIZES = (32, 64, 125, 256)
+    AVATAR_MAX_BYTES = int(os.environ.get('AVATAR_MAX_BYTES', 5 * 1024 * 1024))
+    AVATAR_MAX_PIXELS = int(os.environ.get('AVATAR_MAX_PIXELS', 20_000_000))
+    AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 1))
+
+    # Static files: content-hashed URLs with immutable caching, and optionally
+    # let nginx ('x-accel') or Apache ('x-sendfile') send the bytes
+    STATIC_FINGERPRINT = os.environ.get('STATIC_FINGERPRINT', '1') == '1'
+    STATIC_SENDFILE = os.environ.get('STATIC_SENDFILE', '')
+    STATIC_ACCEL_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/_static/')
+
+    # Templates are compiled when the app starts rather than on their first
+    # request. The compiled code is cached in TEMPLATE_CACHE_DIR (relative to
+    # instance/; empty disables it) so the next worker or release skips parsing.
+    TEMPLATE_PRELOAD = os.environ.get('TEMPLATE_PRELOAD', '1') == '1'
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', 'template_cache')
+
+    # Socket.IO scale-out. With a message queue (e.g. redis://host:6379/0)
+    # several worker processes/nodes can broadcast to each other's clients.
+    # Multiple workers also need CALL_ROOM_STORE/PRESENCE_STORE='redis' and, because plain
+    # gunicorn has no sticky sessions, websocket-only clients.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_WEBSOCKET_ONLY = os.environ.get('SOCKETIO_WEBSOCKET_ONLY', '') == '1'
+    # Chat/private message frames: 'json' (verbose), 'compact' or 'msgpack';
+    # compact frames can be held SOCKETIO_BATCH_MS to send bursts as one frame.
+    # Long-polling responses over SOCKETIO_COMPRESSION_THRESHOLD bytes are gzipped.
+    SOCKETIO_WIRE_FORMAT = os.environ.get('SOCKETIO_WIRE_FORMAT', 'json')
+    SOCKETIO_BATCH_MS = int(os.environ.get('SOCKETIO_BATCH_MS', 0))
+    SOCKETIO_COMPRESSION_THRESHOLD = int(os.environ.get('SOCKETIO_COMPRESSION_THRESHOLD', 1024))
+    CALL_ROOM_STORE = os.environ.get('CALL_ROOM_STORE', 'memory')
+    CALL_ROOM_REDIS_URL = os.environ.get('CALL_ROOM_REDIS_URL') or SOCKETIO_MESSAGE_QUEUE
+
+    # Video calls: unanswered calls end after CALL_RING_TIMEOUT seconds and
+    # abandoned ones after CALL_MAX_AGE. With CALL_ICE_BATCH_MS > 0 clients
+    # send trickle-ICE candidates in batches collected over that many ms.
+    CALL_RING_TIMEOUT = int(os.environ.get('CALL_RING_TIMEOUT', 60))
+    CALL_MAX_AGE = int(os.environ.get('CALL_MAX_AGE', 6 * 3600))
+    CALL_SWEEP_INTERVAL = int(os.environ.get('CALL_SWEEP_INTERVAL', 15))
+    CALL_ICE_BATCH_MS = int(os.environ.get('CALL_ICE_BATCH_MS', 50))
+
+    # ICE servers handed to the browser when it joins a call. TURN uses
+    # short-lived credentials derived from WEBRTC_TURN_SECRET (coturn's
+    # use-auth-secret / static-auth-secret).
+    WEBRTC_STUN_URLS = tuple(u for u in os.environ.get(
+        'WEBRTC_STUN_URLS', 'stun:stun.l.google.com:19302,stun:stun1.l.google.com:19302').split(',') if u)
+    WEBRTC_TURN_URLS = tuple(u for u in os.environ.get('WEBRTC_TURN_URLS', '').split(',') if u)
+    WEBRTC_TURN_SECRET = os.environ.get('WEBRTC_TURN_SECRET')
+    WEBRTC_TURN_TTL = int(os.environ.get('WEBRTC_TURN_TTL', 3600))
+
+    # Public chat rooms. Each keeps its newest CHAT_HISTORY_SIZE messages for
+    # replay on join; 'redis' shares that history between workers. Sending is
+    # limited per user per room and per room (messages/second, burst).
+    CHAT_ROOMS = tuple(r.strip() for r in os.environ.get('CHAT_ROOMS', 'general,random,help').split(',') if r.strip())
+    CHAT_HISTORY_SIZE = int(os.environ.get('CHAT_HISTORY_SIZE', 50))
+    CHAT_HISTORY_STORE = os.environ.get('CHAT_HISTORY_STORE', 'memory')
+    CHAT_HISTORY_REDIS_URL = os.environ.get('CHAT_HISTORY_REDIS_URL') or SOCKETIO_MESSAGE_QUEUE
+    CHAT_USER_RATE = float(os.environ.get('CHAT_USER_RATE', 1.0))
+    CHAT_USER_BURST = int(os.environ.get('CHAT_USER_BURST', 5))
+    CHAT_ROOM_RATE = float(os.environ.get('CHAT_ROOM_RATE', 20.0))
+    CHAT_ROOM_BURST = int(os.environ.get('CHAT_ROOM_BURST', 40))
+
+    # Online presence: clients heartbeat every PRESENCE_HEARTBEAT_INTERVAL
+    # seconds and a connection silent for PRESENCE_TIMEOUT counts as gone.
+    # Changes are coalesced for PRESENCE_DEBOUNCE_MS before being sent.
+    PRESENCE_STORE = os.environ.get('PRESENCE_STORE', 'memory')
+    PRESENCE_REDIS_URL = os.environ.get('PRESENCE_REDIS_URL') or SOCKETIO_MESSAGE_QUEUE
+    PRESENCE_HEARTBEAT_INTERVAL = int(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', 25))
+    PRESENCE_TIMEOUT = int(os.environ.get('PRESENCE_TIMEOUT', 70))
+    PRESENCE_DEBOUNCE_MS = int(os.environ.get('PRESENCE_DEBOUNCE_MS', 2000))
+    PRESENCE_MAX_WATCH = int(os.environ.get('PRESENCE_MAX_WATCH', 100))
+
+    # Notifications for offline users are queued in the database and sent
+    # in one batch on their next connect, newest NOTIFICATION_BATCH_MAX only
+    NOTIFICATION_BATCH_MAX = int(os.environ.get('NOTIFICATION_BATCH_MAX', 50))
+
+    # Private messages older than MESSAGE_RETENTION_DAYS (0 = keep them all)
+    # are moved every MESSAGE_ARCHIVE_INTERVAL seconds into compressed
+    # chunks of up to MESSAGE_ARCHIVE_CHUNK messages (see app/retention.py)
+    MESSAGE_RETENTION_DAYS = int(os.environ.get('MESSAGE_RETENTION_DAYS', 0))
+    MESSAGE_ARCHIVE_CHUNK = int(os.environ.get('MESSAGE_ARCHIVE_CHUNK', 500))
+    MESSAGE_ARCHIVE_INTERVAL = int(os.environ.get('MESSAGE_ARCHIVE_INTERVAL', 3600))
+    # On Postgres the same job keeps monthly partitions of `message` created
+    # this many months ahead, and drops them once archived
+    MESSAGE_PARTITION_MONTHS_AHEAD = int(os.environ.get('MESSAGE_PARTITION_MONTHS_AHEAD', 3))
+
+    # Prometheus metrics on /metrics (Bearer METRICS_TOKEN if set). With
+    # several workers, METRICS_DIR is a directory they share snapshots in.
+    # METRICS_PROFILE_SLOW_MS > 0 dumps a cProfile of slower requests.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_SNAPSHOT_INTERVAL = int(os.environ.get('METRICS_SNAPSHOT_INTERVAL', 5))
+    METRICS_PROFILE_SLOW_MS = int(os.environ.get('METRICS_PROFILE_SLOW_MS', 0))
+    METRICS_PROFILE_DIR = os.environ.get('METRICS_PROFILE_DIR', 'profiles')
+
     # Production settings for Render.com
     if os.environ.get('RENDER'):
         # Force HTTPS in production
         PREFERRED_URL_SCHEME = 'https'
         SESSION_COOKIE_SECURE = True
         SESSION_COOKIE_HTTPONLY = True
-        SESSION_COOKIE_SAMESITE = 'Lax'
\ No newline at end of file
+        SESSION_COOKIE_SAMESITE = 'Lax'
+        # Render's load balancer sits in front of every request
+        PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 1))
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Partition message by month
+
+On Postgres `message` becomes a table range-partitioned on `timestamp`,
+one partition per month (message_pYYYYMM) from the oldest message to a
+few months ahead, plus message_default for anything outside them. The
+primary key becomes (id, timestamp), as Postgres requires the partition
+key in it; ids still come from message_id_seq. app/retention.py keeps
+creating partitions ahead and drops them once archived.
+
+Every row is copied while the table is locked, so run it in a quiet
+window on a large database. The full-text index (ix_message_search) goes
+with the old table; render_start.py / `flask search-reindex --schema-only`
+recreate it.
+
+Everywhere else only `timestamp` becomes NOT NULL, as on Postgres.
+
+Revision ID: abf4c8e0c8e1
+Revises: c0d9e196465d
+Create Date: 2026-10-18 08:25:31.735387
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'abf4c8e0c8e1'
+down_revision = 'c0d9e196465d'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+CREATE_PARTITIONS = f"""
+DO $$
+DECLARE
+    month timestamp := date_trunc('month', coalesce((SELECT min(timestamp) FROM message),
+                                                     now() AT TIME ZONE 'utc'));
+    last timestamp := date_trunc('month', now() AT TIME ZONE 'utc') + interval '{MONTHS_AHEAD} months';
+BEGIN
+    WHILE month <= last LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF message_partitioned FOR VALUES FROM (%L) TO (%L)',
+                       'message_p' || to_char(month, 'YYYYMM'), month, month + interval '1 month');
+        month := month + interval '1 month';
+    END LOOP;
+END $$
+"""
+
+
+def _constraints_and_indexes(primary_key):
+    op.create_primary_key('message_pkey', 'message', primary_key)
+    op.create_foreign_key('message_conversation_id_fkey', 'message', 'conversation', ['conversation_id'], ['id'])
+    op.create_foreign_key('message_sender_id_fkey', 'message', 'user', ['sender_id'], ['id'])
+    op.create_foreign_key('message_recipient_id_fkey', 'message', 'user', ['recipient_id'], ['id'])
+    op.create_index('ix_message_timestamp', 'message', ['timestamp'], unique=False)
+    op.create_index('ix_message_conversation_timestamp_id', 'message', ['conversation_id', 'timestamp', 'id'],
+                    unique=False)
+
+
+def upgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        op.execute("UPDATE message SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+        return
+
+    op.execute("UPDATE message SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL")
+    op.execute("LOCK TABLE message IN EXCLUSIVE MODE")
+    op.execute("CREATE TABLE message_partitioned (LIKE message INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)")
+    op.execute("ALTER TABLE message_partitioned ALTER COLUMN timestamp SET NOT NULL")
+    op.execute(CREATE_PARTITIONS)
+    op.execute("CREATE TABLE message_default PARTITION OF message_partitioned DEFAULT")
+    op.execute("INSERT INTO message_partitioned SELECT * FROM message")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message_partitioned.id")
+    op.drop_table('message')
+    op.rename_table('message_partitioned', 'message')
+    _constraints_and_indexes(['id', 'timestamp'])
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+        return
+
+    op.execute("LOCK TABLE message IN EXCLUSIVE MODE")
+    op.execute("CREATE TABLE message_plain (LIKE message INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE message_plain ALTER COLUMN timestamp DROP NOT NULL")
+    op.execute("INSERT INTO message_plain SELECT * FROM message")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message_plain.id")
+    op.drop_table('message')   # and its partitions
+    op.rename_table('message_plain', 'message')
+    _constraints_and_indexes(['id'])
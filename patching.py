@@ -0,0 +1,57 @@
+"""
+Monkey-patching for Config.ASYNC_MODE.
+
+Under 'eventlet' or 'gevent' the standard library has to be patched before
+Flask, SQLAlchemy or psycopg2 are imported, otherwise they keep references
+to the blocking socket/thread primitives and every DB call stalls the
+whole worker. psycogreen then makes psycopg2 yield to other greenlets
+while it waits on Postgres. Only entry points that serve requests patch
+(run.py, which gunicorn and the flask CLI load, and the benchmark
+servers); create_app() falls back to 'threading' in any other process.
+
+'asgi' patches nothing, but the same rule applies: only a process that
+called monkey_patch('asgi') before importing Flask serves it (app/asgi.py),
+so scripts and the flask CLI keep a plain threading server.
+"""
+import sys
+
+_asgi = False
+
+
+def monkey_patch(mode):
+    """Patch the standard library (and psycopg2) for mode; a no-op for 'threading'."""
+    global _asgi
+    if mode not in ('eventlet', 'gevent', 'asgi'):
+        return
+    if 'flask' in sys.modules:
+        # Too late to patch safely, e.g. the flask CLI loading run.py
+        return
+    if mode == 'asgi':
+        _asgi = True
+        return
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    else:
+        from gevent import monkey
+        monkey.patch_all()
+    try:
+        if mode == 'eventlet':
+            from psycogreen.eventlet import patch_psycopg
+        else:
+            from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def is_patched(mode):
+    """Whether this process was patched for mode (always true for 'threading')."""
+    if mode == 'asgi':
+        return _asgi
+    if mode == 'eventlet':
+        # Nothing can have patched without importing it
+        return 'eventlet' in sys.modules and sys.modules['eventlet'].patcher.is_monkey_patched('socket')
+    if mode == 'gevent':
+        return 'gevent' in sys.modules and __import__('gevent.monkey').monkey.is_module_patched('socket')
+    return True
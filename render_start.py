@@ -1,86 +1,95 @@
 #!/usr/bin/env python3
 """
 Production startup script for Render.com deployment.
-This script handles database migrations and starts the application with Gunicorn.
+Brings the database to the committed migrations' head, prepares the
+search indexes and precompiles templates and static files, all in this
+one process. The server itself is started by Gunicorn (render.yaml/Procfile).
+
+    python render_start.py               # release steps
+    python render_start.py --check-only  # exit 1 if the schema isn't at head; changes nothing
 """
 
 import os
-import subprocess
 import sys
+import time
 
-# Fix for SQLAlchemy threading issues with eventlet
-import eventlet
-eventlet.monkey_patch()
+STARTED = time.perf_counter()
 
+# No monkey-patching here: this script only prepares the release, it never
+# serves requests, and patching after interpreter start-up only causes trouble.
 from app import create_app, db
 
-def run_migrations():
-    """Run database migrations if needed."""
+
+def step(label, func):
+    """Run one release step, printing how long it took."""
+    started = time.perf_counter()
+    print(f"🔧 {label}...")
+    result = func()
+    print(f"   done in {time.perf_counter() - started:.2f}s")
+    return result
+
+
+def prepare_database():
+    """Apply committed migrations (skipped at head) and finish data backfills."""
+    from app.models import backfill_conversations
+    from app.schema import upgrade_schema, SchemaMismatch
+    from app.search import ensure_schema
+
     try:
-        # Initialize migration repository if it doesn't exist
-        if not os.path.exists('migrations'):
-            print("🔧 Initializing database migrations...")
-            subprocess.run(['flask', 'db', 'init'], check=True)
-        
-        # Create migration if needed
-        print("🔧 Creating migration...")
-        result = subprocess.run(['flask', 'db', 'migrate', '-m', 'Auto migration'], 
-                              capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            print("✅ Migration created successfully")
-        else:
-            print("ℹ️ No new migrations needed")
-        
-        # Apply migrations
-        print("🔧 Applying database migrations...")
-        subprocess.run(['flask', 'db', 'upgrade'], check=True)
-        print("✅ Database migrations completed")
-        
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Migration error: {e}")
-        # Fallback: create tables directly
-        print("🔧 Fallback: Creating tables directly...")
-        try:
-            app = create_app()
-            with app.app_context():
-                db.create_all()
-            print("✅ Tables created successfully")
-        except Exception as create_error:
-            print(f"❌ Failed to create tables: {create_error}")
-            # Don't exit, let the app try to start anyway
-    except Exception as e:
-        print(f"❌ Unexpected error during migration: {e}")
-        # Don't exit, let the app try to start anyway
+        status, seconds = upgrade_schema()
+    except SchemaMismatch as e:
+        print(f"❌ {e}")
+        print("   Bring the database in line with the models (or run `flask db stamp head` "
+              "if the differences are expected) and redeploy.")
+        sys.exit(1)
+    print(f"✅ Database schema {status} ({seconds:.2f}s)")
+
+    # Link messages written before conversations existed
+    updated, skipped = step("Backfilling conversations", backfill_conversations)
+    print(f"✅ Linked {updated} messages to conversations ({skipped} without a conversation skipped)")
+
+    # Create the full-text search indexes before the first search
+    step("Preparing search indexes", lambda: (ensure_schema(db.session), db.session.commit()))
+    print("✅ Search schema ready")
+
 
 def main():
-    """Main function to start the application."""
+    """Main function to prepare the release."""
+    check_only = '--check-only' in sys.argv[1:]
+    app = create_app()
+    boot = time.perf_counter() - STARTED
+
+    if check_only:
+        from app.schema import upgrade_schema, OUT_OF_DATE
+        with app.app_context():
+            status, seconds = upgrade_schema(check_only=True)
+        print(f"{'❌' if status == OUT_OF_DATE else '✅'} Database schema {status} "
+              f"(boot {boot:.2f}s, check {seconds:.2f}s)")
+        sys.exit(1 if status == OUT_OF_DATE else 0)
+
     print("🚀 Starting Commune Flask App for Render.com")
     print("=" * 50)
-    
-    # Set Flask app environment variable
-    os.environ['FLASK_APP'] = 'run.py'
-    
-    # Check if we're in production
+    print(f"✅ App created in {boot:.2f}s")
     if os.environ.get('DATABASE_URL'):
         print("✅ Production environment detected")
-        print("✅ Database URL configured")
-        
-        # Run migrations in production
-        run_migrations()
     else:
         print("ℹ️ Development environment")
-        # Create tables for development
-        app = create_app()
-        with app.app_context():
-            db.create_all()
-    
+
+    with app.app_context():
+        prepare_database()
+
+    # Compiled templates are cached on disk for the workers to load
+    from app.assets import compile_templates, build_static_assets
+    compiled = step("Compiling templates", lambda: compile_templates(app))
+    print(f"✅ Compiled {compiled} templates")
+
+    # Fingerprint and precompress static files for far-future caching
+    manifest = step("Building static asset manifest", lambda: build_static_assets(app.static_folder))
+    print(f"✅ Fingerprinted {len(manifest)} static files")
+
     print("=" * 50)
-    print("🎉 Application ready!")
-    
-    # Start the application
-    # Note: On Render.com, this script is used for setup
-    # The actual server is started by Gunicorn via render.yaml or build command
+    print(f"🎉 Application ready in {time.perf_counter() - STARTED:.2f}s")
+
 
 if __name__ == '__main__':
     main()
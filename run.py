@@ -1,30 +1,45 @@
-from app import create_app, db, socketio
 import os
 
-app = create_app()
+# Monkey-patching has to happen before Flask, SQLAlchemy or psycopg2 are
+# imported (see patching.py); config.py itself only reads the environment.
+from config import Config
+from patching import monkey_patch
 
-# Fix for SQLAlchemy threading issues with eventlet
-import eventlet
-eventlet.monkey_patch()
+ASYNC_MODE = Config.ASYNC_MODE
+monkey_patch(ASYNC_MODE)
+
+from app import create_app, socketio
+from app.schema import upgrade_schema
+
+flask_app = app = create_app()
+if flask_app.config['ASYNC_MODE'] == 'asgi':
+    # uvicorn (or gunicorn's UvicornWorker) serves the ASGI app in its place
+    from app.asgi import asgi_app
+    app = asgi_app(flask_app)
 
 if __name__ == '__main__':
-    # Create database tables for development
-    with app.app_context():
+    # Apply any new migrations for development (a no-op at head)
+    with flask_app.app_context():
         try:
-            db.create_all()
-            print("✅ Database tables created successfully")
+            status, seconds = upgrade_schema()
+            print(f"✅ Database schema {status} ({seconds:.2f}s)")
         except Exception as e:
             print(f"⚠️  Database initialization warning: {e}")
-    
+
     # Configuration for different environments
     port = int(os.environ.get('PORT', 5000))
     debug = not os.environ.get('RENDER')  # Disable debug in production
-    
-    if os.environ.get('RENDER'):
+
+    if app is not flask_app:
+        import uvicorn
+        host = '0.0.0.0' if os.environ.get('RENDER') else '127.0.0.1'
+        print(f"🚀 Starting ASGI server on {host}:{port}")
+        uvicorn.run(app, host=host, port=port)
+    elif os.environ.get('RENDER'):
         # Production on Render.com
         print("🚀 Starting production server on Render.com")
         socketio.run(app, host='0.0.0.0', port=port, debug=False)
     else:
         # Development
         print("🔧 Starting development server")
-        socketio.run(app, host='127.0.0.1', port=port, debug=debug)
\ No newline at end of file
+        socketio.run(app, host='127.0.0.1', port=port, debug=debug)
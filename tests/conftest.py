@@ -0,0 +1,75 @@
+"""
+Shared fixtures: create_app() on an in-memory SQLite database.
+
+The extensions are module-level singletons, so each test's app
+re-initializes them; background tasks started by an earlier test keep
+running against whichever app was configured last.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config  # noqa: E402
+
+
+class TestConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLALCHEMY_BINDS = {}
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    CACHE_TYPE = 'null'
+    METRICS_ENABLED = False
+    TEMPLATE_PRELOAD = False
+    SOCKETIO_MESSAGE_QUEUE = None
+
+
+@pytest.fixture
+def make_app():
+    """Build an app with TestConfig plus overrides and an empty schema."""
+    from app import create_app, db
+
+    def make(**overrides):
+        app = create_app(type('Config', (TestConfig,), overrides))
+        with app.app_context():
+            db.create_all()
+        return app
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def add_users():
+    """Create users named by the arguments (password 'pw'); returns their ids."""
+    def add(app, *names):
+        from app import db, bcrypt
+        from app.models import User
+
+        with app.app_context():
+            password_hash = bcrypt.generate_password_hash('pw').decode()
+            users = [User(username=name, email=f'{name}@example.com', password_hash=password_hash)
+                     for name in names]
+            db.session.add_all(users)
+            db.session.commit()
+            return [user.id for user in users]
+    return add
+
+
+@pytest.fixture
+def login():
+    """A test client logged in as name."""
+    def log_in(app, name):
+        client = app.test_client()
+        response = client.post('/login', data={'email': f'{name}@example.com', 'password': 'pw'})
+        assert response.status_code == 302
+        return client
+    return log_in
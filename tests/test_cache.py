@@ -0,0 +1,81 @@
+"""Tagged cache entries and the write paths that invalidate them (CACHE_TYPE='memory')."""
+import pytest
+
+from app.cache import (MemoryCache, api_feed_key, feed_key, post_comments_key, post_key,
+                       user_post_count_key, user_posts_key)
+
+
+def test_invalidate_tags_drops_only_tagged_entries():
+    cache = MemoryCache()
+    cache.set('page', 1, tags={'post:1', 'user:7'})
+    cache.set('other', 2, tags={'post:2'})
+    cache.set('untagged', 3)
+    cache.invalidate_tags('user:7')
+    assert cache.get('page') is None
+    assert cache.get('other') == 2 and cache.get('untagged') == 3
+    # The tag was consumed; setting again starts a fresh entry
+    cache.set('page', 4, tags={'post:1'})
+    cache.invalidate_tags('user:7')
+    assert cache.get('page') == 4
+
+
+@pytest.fixture
+def site(make_app, add_users, login):
+    """A memory-cached app with two of alice's posts; yields (app, alice's client, post ids)."""
+    from app import db
+    from app.models import Post
+
+    app = make_app(CACHE_TYPE='memory', COUNTER_FLUSH_INTERVAL=3600)
+    alice, = add_users(app, 'alice')
+    with app.app_context():
+        posts = [Post(title=f'post {i}', content='x', user_id=alice) for i in range(2)]
+        db.session.add_all(posts)
+        db.session.commit()
+        ids = [post.id for post in posts]
+    client = login(app, 'alice')
+    # Fill every cached fragment
+    for url in ('/', '/api/feed', '/user/alice', f'/post/{ids[0]}', f'/post/{ids[1]}'):
+        assert client.get(url).status_code == 200
+    yield app, client, ids
+
+
+def cached(*keys):
+    from app import cache
+    return [cache.get(key) is not None for key in keys]
+
+
+def test_new_post_drops_first_pages(site):
+    app, client, (first, second) = site
+    assert cached(feed_key(None), api_feed_key(None), user_posts_key('alice', None),
+                  user_post_count_key('alice')) == [True] * 4
+    response = client.post('/post/new', data={'title': 'fresh', 'content': 'news'})
+    assert response.status_code == 302
+    assert cached(feed_key(None), api_feed_key(None), user_posts_key('alice', None),
+                  user_post_count_key('alice')) == [False] * 4
+    # Existing posts did not change
+    assert cached(post_key(first), post_key(second)) == [True, True]
+    assert b'fresh' in client.get('/api/feed').data
+
+
+def test_like_drops_the_post_once_counted(site):
+    from app import counters
+
+    app, client, (first, second) = site
+    assert client.post(f'/post/{first}/like').status_code == 302
+    counters.flush()
+    assert cached(post_key(first), api_feed_key(None), feed_key(None)) == [False] * 3
+    assert cached(post_key(second)) == [True]
+    assert client.get('/api/feed').get_json()['posts'][-1]['like_count'] == 1
+
+
+def test_comment_drops_comments_then_post(site):
+    from app import counters
+
+    app, client, (first, second) = site
+    assert cached(post_comments_key(first)) == [True]
+    assert client.post(f'/post/{first}/comment', data={'body': 'nice'}).status_code == 302
+    # The comment list goes at once, the post (with its count) on the next flush
+    assert cached(post_comments_key(first), post_key(first)) == [False, True]
+    counters.flush()
+    assert cached(post_key(first), post_key(second), post_comments_key(second)) == [False, True, True]
+    assert b'nice' in client.get(f'/post/{first}').data
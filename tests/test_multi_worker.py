@@ -0,0 +1,194 @@
+"""
+Two worker processes sharing one message queue and one Redis store.
+
+Each worker is a separate create_app() process serving Socket.IO on its
+own port, with SOCKETIO_MESSAGE_QUEUE, presence and call rooms pointed at
+a fakeredis TCP server started by the test. alice connects to one worker
+and bob to the other; everything bob receives has to cross the queue.
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = 'multi-worker-test'
+
+fakeredis = pytest.importorskip('fakeredis')
+socketio = pytest.importorskip('socketio')
+pytest.importorskip('lupa', reason='fakeredis needs lupa to run the stores\' Lua scripts')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"nothing listening on port {port}")
+
+
+# -------------------- SUBPROCESS ENTRY POINTS --------------------
+
+def seed():
+    """Create the schema, alice and bob and their conversation; print their session cookies."""
+    sys.path.insert(0, ROOT)
+    from app import create_app, db
+    from app.models import User, Conversation
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        alice = User(username='alice', email='alice@example.com', password_hash='x')
+        bob = User(username='bob', email='bob@example.com', password_hash='x')
+        db.session.add_all([alice, bob])
+        db.session.flush()
+        Conversation.get_or_create(alice.id, bob.id)
+        db.session.commit()
+        users = {'alice': alice.id, 'bob': bob.id}
+    serializer = app.session_interface.get_signing_serializer(app)
+    print(json.dumps({name: {'id': user_id, 'cookie': serializer.dumps({'_user_id': str(user_id), '_fresh': True})}
+                      for name, user_id in users.items()}))
+
+
+def serve(port):
+    """One worker: a fresh create_app() serving Socket.IO on port."""
+    sys.path.insert(0, ROOT)
+    import run
+    run.socketio.run(run.app, host='127.0.0.1', port=port, debug=False, log_output=False,
+                     allow_unsafe_werkzeug=True)
+
+
+# -------------------- FIXTURES --------------------
+
+@pytest.fixture
+def workers(tmp_path):
+    """Start the shared Redis stand-in and two workers; yields (ports, users)."""
+    redis_port = free_port()
+    server = fakeredis.TcpFakeServer(('127.0.0.1', redis_port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    redis_url = f'redis://127.0.0.1:{redis_port}/0'
+
+    env = dict(os.environ,
+               SECRET_KEY=SECRET_KEY,
+               ASYNC_MODE='threading',
+               DATABASE_URL=f"sqlite:///{tmp_path / 'test.db'}",
+               CACHE_TYPE='null',
+               METRICS_ENABLED='0',
+               SOCKETIO_MESSAGE_QUEUE=redis_url,
+               CALL_ROOM_STORE='redis',
+               PRESENCE_STORE='redis',
+               CHAT_HISTORY_STORE='redis',
+               PRESENCE_DEBOUNCE_MS='100')
+    seeded = subprocess.run([sys.executable, __file__, '--seed'], env=env, cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    users = json.loads(seeded.stdout.strip().splitlines()[-1])
+
+    ports = [free_port(), free_port()]
+    processes = [subprocess.Popen([sys.executable, __file__, '--serve', str(port)], env=env, cwd=ROOT,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for port in ports]
+    try:
+        for port in ports:
+            wait_for_port(port)
+        yield ports, users
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        server.shutdown()
+        server.server_close()
+
+
+class Client:
+    """A logged-in Socket.IO client that records every event it receives."""
+
+    def __init__(self, port, cookie):
+        self.events = queue.Queue()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', lambda event, data=None: self.events.put((event, data)))
+        self.sio.connect(f'http://127.0.0.1:{port}', headers={'Cookie': f'session={cookie}'},
+                         transports=['websocket'], wait_timeout=10)
+
+    def call(self, event, data):
+        return self.sio.call(event, data, timeout=10)
+
+    def emit(self, event, data):
+        self.sio.emit(event, data)
+
+    def expect(self, event, predicate=lambda data: True, timeout=10):
+        """The first `event` whose data matches, skipping everything else."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise AssertionError(f"no matching {event!r} within {timeout}s")
+            try:
+                name, data = self.events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if name == event and predicate(data):
+                return data
+
+    def close(self):
+        self.sio.disconnect()
+
+
+# -------------------- TESTS --------------------
+
+def test_events_cross_workers(workers):
+    (port_a, port_b), users = workers
+    alice_id = users['alice']['id']
+
+    bob = Client(port_b, users['bob']['cookie'])
+    alice = None
+    try:
+        # Presence: bob (worker B) watches alice, who then connects to worker A
+        assert bob.call('watch_presence', {'user_ids': [alice_id]}) == {str(alice_id): False}
+        alice = Client(port_a, users['alice']['cookie'])
+        bob.expect('presence', lambda data: data == {'user_id': alice_id, 'online': True})
+
+        # Private message sent on worker A, delivered on worker B
+        room = alice.call('join', {'username': 'bob'})['room']
+        assert bob.call('join', {'username': 'alice'})['room'] == room
+        alice.emit('private_message', {'room': room, 'message': 'hello across workers'})
+        message = bob.expect('new_private_message')
+        assert message['message'] == 'hello across workers'
+        assert message['sender'] == 'alice'
+
+        # Call room: membership is shared, so the second join sees the first
+        first = alice.call('join_call', {'username': 'bob'})
+        second = bob.call('join_call', {'username': 'alice'})
+        assert first['room'] == second['room']
+        peers = bob.expect('peers_connected')
+        assert alice.expect('peers_connected') == peers
+        alice.emit('webrtc_signal', {'room': first['room'], 'signal': {'type': 'offer', 'sdp': 'v=0'}})
+        assert bob.expect('webrtc_signal') == {'type': 'offer', 'sdp': 'v=0'}
+    finally:
+        for client in (alice, bob):
+            if client is not None:
+                client.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--seed':
+        seed()
+    elif sys.argv[1] == '--serve':
+        serve(int(sys.argv[2]))
@@ -0,0 +1,64 @@
+"""Keyset cursors: encoding, validation and paging through rows with equal timestamps."""
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, feed_page
+
+
+def test_cursor_round_trip():
+    when = datetime(2026, 3, 1, 12, 30, 45, 123456)
+    cursor = encode_cursor(when, 42)
+    assert decode_cursor(cursor) == (when, 42)
+    # Opaque and URL-safe: no padding or characters that need escaping
+    assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor!',
+    encode_cursor(datetime(2026, 3, 1), 1)[:-3],
+    # Well-formed base64 of the wrong content
+    base64.urlsafe_b64encode(b'no-separator').decode(),
+    base64.urlsafe_b64encode(b'2026-03-01|abc').decode(),
+    base64.urlsafe_b64encode(b'yesterday|42').decode(),
+    base64.urlsafe_b64encode(b'\xff\xfe|1').decode(),
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_bad_cursor_is_a_400(app):
+    client = app.test_client()
+    assert client.get('/api/feed?cursor=garbage').status_code == 400
+
+
+def test_pages_split_inside_equal_timestamps(app, add_users):
+    from app import db
+    from app.models import Post
+
+    user_id, = add_users(app, 'alice')
+    same = datetime(2026, 3, 1, 12, 0)
+    with app.app_context():
+        # Five posts share one timestamp, so only the id tells them apart
+        times = [same + timedelta(minutes=1)] + [same] * 5 + [same - timedelta(minutes=1)]
+        db.session.add_all([Post(title=f'p{i}', content='x', user_id=user_id, date_posted=when)
+                            for i, when in enumerate(times)])
+        db.session.commit()
+        expected = [post.id for post in Post.query.order_by(Post.date_posted.desc(), Post.id.desc())]
+
+        seen, cursor = [], None
+        while True:
+            posts, cursor = feed_page(cursor, per_page=2)
+            seen += [post.id for post in posts]
+            if cursor is None:
+                break
+        assert seen == expected
+
+        # A cursor taken in the middle of the tie continues right after it
+        posts, cursor = feed_page(None, per_page=3)
+        assert decode_cursor(cursor) == (same, posts[-1].id)
+        rest, _ = feed_page(cursor, per_page=10)
+        assert [post.id for post in rest] == expected[3:]
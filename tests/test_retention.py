@@ -0,0 +1,103 @@
+"""Message archiving: chunking, unlinked messages, and history pages reading on into the archive."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.retention import archive_messages, purge_unlinkable
+
+CUTOFF = datetime(2026, 3, 1)
+
+
+@pytest.fixture
+def chat(app, add_users):
+    """alice and bob's conversation: (app, (conversation_id, alice, bob), add), add(body, when) storing a message."""
+    from app import db
+    from app.models import Conversation, Message
+
+    alice, bob = add_users(app, 'alice', 'bob')
+    with app.app_context():
+        conversation_id = Conversation.get_or_create(alice, bob).id
+        db.session.commit()
+
+    def add(body, when, conversation_id=conversation_id, sender_id=alice, recipient_id=bob):
+        with app.app_context():
+            message = Message(conversation_id=conversation_id, sender_id=sender_id, recipient_id=recipient_id,
+                              body=body, timestamp=when)
+            db.session.add(message)
+            db.session.commit()
+            return message.id
+    yield app, (conversation_id, alice, bob), add
+
+
+def test_archive_moves_old_messages_in_chunks(chat):
+    from app.models import Message, MessageArchive
+    from app.retention import unpack
+
+    app, (conversation_id, _, _), add = chat
+    old = [add(f'old {i}', CUTOFF - timedelta(days=10 - i)) for i in range(7)]
+    add('recent', CUTOFF + timedelta(days=1))
+    with app.app_context():
+        assert archive_messages(CUTOFF, chunk_size=3, max_chunks=1) == 3
+        assert archive_messages(CUTOFF, chunk_size=3) == 4
+        assert archive_messages(CUTOFF, chunk_size=3) == 0
+
+        assert [m.body for m in Message.query] == ['recent']
+        chunks = MessageArchive.query.order_by(MessageArchive.first_timestamp).all()
+        assert [chunk.message_count for chunk in chunks] == [3, 3, 1]
+        assert [(chunk.first_id, chunk.last_id) for chunk in chunks] == [(old[0], old[2]), (old[3], old[5]),
+                                                                         (old[6], old[6])]
+        assert [m.body for chunk in chunks for m in unpack(chunk)] == [f'old {i}' for i in range(7)]
+        assert all(chunk.conversation_id == conversation_id for chunk in chunks)
+
+
+def test_history_continues_into_the_archive(chat):
+    from app.pagination import message_page
+
+    app, (conversation_id, _, _), add = chat
+    # Two messages share a timestamp on each side of the cutoff
+    times = [CUTOFF - timedelta(days=3), CUTOFF - timedelta(days=2), CUTOFF - timedelta(days=2),
+             CUTOFF - timedelta(days=1), CUTOFF + timedelta(days=1), CUTOFF + timedelta(days=1),
+             CUTOFF + timedelta(days=2)]
+    ids = [add(f'm{i}', when) for i, when in enumerate(times)]
+    with app.app_context():
+        assert archive_messages(CUTOFF, chunk_size=2) == 4
+
+        for per_page in (1, 2, 3, 10):
+            seen, cursor = [], None
+            while True:
+                messages, cursor = message_page(conversation_id, cursor, per_page)
+                seen += [(m.id, m.body) for m in messages]
+                if cursor is None:
+                    break
+            assert seen == [(message_id, f'm{i}') for i, message_id in reversed(list(enumerate(ids)))]
+
+
+def test_archive_keeps_conversations_apart(chat, add_users):
+    from app import db
+    from app.models import Conversation, Message, MessageArchive
+
+    app, (conversation_id, alice, bob), add = chat
+    carol_id, = add_users(app, 'carol')
+    with app.app_context():
+        other = Conversation.get_or_create(alice, carol_id).id
+        db.session.commit()
+    add('ours', CUTOFF - timedelta(days=2))
+    add('theirs', CUTOFF - timedelta(days=1), conversation_id=other, recipient_id=carol_id)
+    with app.app_context():
+        assert archive_messages(CUTOFF, chunk_size=10) == 2
+        assert Message.query.count() == 0
+        assert sorted(chunk.conversation_id for chunk in MessageArchive.query) == sorted([conversation_id, other])
+
+
+def test_unlinkable_messages_are_deleted_and_linkable_ones_reported(chat):
+    from app.models import Message
+
+    app, (_, alice, bob), add = chat
+    before = CUTOFF - timedelta(days=1)
+    add('to self', before, conversation_id=None, recipient_id=alice)
+    add('no sender', before, conversation_id=None, sender_id=None)
+    add('not backfilled', before, conversation_id=None)
+    add('recent to self', CUTOFF + timedelta(days=1), conversation_id=None, recipient_id=alice)
+    with app.app_context():
+        assert purge_unlinkable(CUTOFF, batch_size=1) == (2, 1)
+        assert sorted(m.body for m in Message.query) == ['not backfilled', 'recent to self']
@@ -0,0 +1,135 @@
+"""BatchWriter: retries, order after a failed batch, and dropping items that can never be written."""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.write_behind import BatchWriter, MessageWriter
+
+
+class Recorder(BatchWriter):
+    """Writes into a list; fails the next failures_left writes and any batch holding a poison item."""
+
+    what = 'test items'
+    task = 'test_writer'
+
+    def __init__(self):
+        super().__init__()
+        self.written = []
+        self.poison = set()
+        self.failures_left = 0
+        self.during_write = None
+
+    def _write(self, batch):
+        if self.during_write:
+            self.during_write()
+        if self.failures_left:
+            self.failures_left -= 1
+            raise RuntimeError('database unavailable')
+        if self.poison.intersection(batch):
+            raise RuntimeError('bad row')
+        self.written.extend(batch)
+
+
+@pytest.fixture
+def recorder(make_app):
+    writer = Recorder()
+    writer.configure(make_app(MESSAGE_BATCH_SIZE=2, MESSAGE_BATCH_INTERVAL_MS=5, MESSAGE_WRITE_RETRIES=3,
+                              MESSAGE_RETRY_MAX_INTERVAL=0.05), 'batched')
+    return writer
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+def test_failed_batch_goes_back_in_front(recorder):
+    for item in range(1, 6):
+        recorder._add_pending(item)
+    recorder.poison = {3}
+
+    def arrive():
+        # 6 arrives while the batch is being written
+        recorder.during_write = None
+        recorder._add_pending(6)
+    recorder.during_write = arrive
+    with pytest.raises(RuntimeError):
+        recorder._write_pending()
+    # Batches are batch_size (2): [1, 2] made it, [3, 4] failed and [5] was never tried
+    assert recorder.written == [1, 2]
+    assert recorder._pending == [3, 4, 5, 6]
+
+    recorder.poison = set()
+    recorder._write_pending()
+    assert recorder.written == [1, 2, 3, 4, 5, 6]
+    assert recorder._pending == []
+
+
+def test_write_each_drops_only_unwritable_items(recorder):
+    for item in (1, 2, 3):
+        recorder._add_pending(item)
+    recorder.poison = {2}
+    recorder._write_each()
+    assert recorder.written == [1, 3]
+    assert recorder._pending == []
+
+
+def test_write_each_keeps_everything_when_nothing_succeeds(recorder):
+    for item in (1, 2, 3):
+        recorder._add_pending(item)
+    recorder.failures_left = 3
+    with pytest.raises(RuntimeError):
+        recorder._write_each()
+    assert recorder.written == []
+    assert recorder._pending == [1, 2, 3]
+
+
+def test_background_task_retries_in_order(recorder):
+    recorder.failures_left = 2
+    for item in range(1, 6):
+        assert recorder.submit_item(item)
+    wait_for(lambda: len(recorder.written) == 5)
+    assert recorder.written == [1, 2, 3, 4, 5]
+
+
+def test_background_task_drops_poison_after_retries(recorder):
+    recorder.poison = {'poison'}
+    for item in ('before', 'poison', 'after'):
+        assert recorder.submit_item(item)
+    # Failing batches are retried MESSAGE_WRITE_RETRIES times, then written one by one
+    wait_for(lambda: 'after' in recorder.written)
+    assert recorder.written[-1] == 'after' and 'poison' not in recorder.written
+    wait_for(lambda: recorder._pending_count() == 0)
+
+
+def test_message_writer_commits_batches_in_order(make_app, add_users, tmp_path):
+    from app.models import Message
+
+    # A file, not the shared in-memory connection: the writer commits from its own thread
+    app = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}", MESSAGE_WRITE_MODE='batched',
+                   MESSAGE_BATCH_INTERVAL_MS=5, MESSAGE_RETRY_MAX_INTERVAL=0.05)
+    alice, bob = add_users(app, 'alice', 'bob')
+    writer = MessageWriter()
+    writer.init_app(app)
+    original, failures = writer._write, [1]
+
+    def flaky(batch):
+        if failures:
+            failures.pop()
+            raise RuntimeError('database unavailable')
+        original(batch)
+    writer._write = flaky
+
+    start = datetime(2026, 3, 1)
+    for i in range(5):
+        assert writer.submit(alice, bob, f'm{i}', start + timedelta(seconds=i))
+
+    def stored():
+        with app.app_context():
+            return [m.body for m in Message.query.order_by(Message.id)]
+    wait_for(lambda: len(stored()) == 5)
+    assert stored() == [f'm{i}' for i in range(5)]